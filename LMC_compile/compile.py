@@ -1,7 +1,10 @@
 import contextlib
+import os
+import shutil
+import subprocess
 import sys
 from pathlib import Path
-from typing import Iterable, cast, Any
+from typing import Iterable, Literal, TypeAlias, cast, Any
 
 try:
     import distutils.ccompiler as ccompiler
@@ -10,7 +13,14 @@ except ImportError:
     import setuptools._distutils.ccompiler as ccompiler
 from LMC_compile._types_msvccompiler import MSVCCompiler
 
-__all__ = ['compile_runtime']
+__all__ = ['compile_runtime', 'compile_native', 'compile_native_pgo',
+           'native_lib_filename', 'run_benchmark']
+
+BENCHMARK = Path(__file__).parent / 'benchmark.lmc'
+"""Program used to train the profile-guided build (and to time the runtime)"""
+PgoT: TypeAlias = Literal['generate', 'use']
+PGO_GENERATE: PgoT = 'generate'
+PGO_USE: PgoT = 'use'
 
 
 class BaseCompiler:
@@ -18,7 +28,10 @@ class BaseCompiler:
                  libraries: Iterable[str] = (), out_dir: str = None,
                  obj_dir: str = None, exe_dir: str = None,
                  out_type: str = 'executable', debug=True, verbose=False,
-                 macros: Iterable[tuple[str, str | None] | tuple[str,]]=()):
+                 macros: Iterable[tuple[str, str | None] | tuple[str,]]=(),
+                 include_dirs: Iterable[str] = (), lto: bool | None = None,
+                 march: str | None = None, pgo: PgoT | None = None,
+                 profile_dir: str | None = None):
         self.sources = [sources] if isinstance(sources, str) else list(sources)
         self.libraries = list(libraries)
         self.obj_dir = Path(obj_dir) if obj_dir is not None else (
@@ -27,9 +40,22 @@ class BaseCompiler:
         self.exe_name = exe_path
         self.out_type = out_type
         self.debug = debug
-        self.cc = ccompiler.new_compiler()
+        # force: always rebuild (it only checks the mtimes, which can be the
+        #  same for a program transpiled again straight away)
+        self.cc = ccompiler.new_compiler(force=True)
         self.verbose = verbose
         self.macros = macros
+        self.include_dirs = list(include_dirs)
+        # (these are only used for gcc/clang)
+        self.lto = not debug if lto is None else lto
+        """Link time optimization, defaults to on for release builds"""
+        self.march = march
+        """e.g. 'native' to optimize for this CPU (None: portable)"""
+        self.pgo = pgo
+        """Profile-guided optimization: PGO_GENERATE builds it with
+        instrumentation that writes a profile to `profile_dir` when it runs,
+        PGO_USE builds it using that profile"""
+        self.profile_dir = profile_dir
         self.is_msvc = getattr(self.cc, 'compiler_type', None) == 'msvc'
         self.objects = None
 
@@ -53,9 +79,18 @@ class BaseCompiler:
                 postargs += ['/showIncludes']
             else:
                 postargs += ['/nologo']
+        else:
+            # gcc/clang: c2x for the digit separators (0x07'FF'FF'FF),
+            #  gnu for POSIX (fileno, mmap)
+            postargs += ['-std=gnu2x', '-Wall', '-Werror=implicit-function-declaration']
+            postargs += self._gcc_opt_args()
+            if self.out_type == ccompiler.CCompiler.SHARED_OBJECT:
+                postargs += ['-fPIC', '-fvisibility=hidden']
+            if self.verbose:
+                postargs += ['-v']
         self.objects = self.cc.compile(
             self.sources, str(self.obj_dir), debug=self.debug,
-            extra_postargs=postargs,
+            extra_postargs=postargs, include_dirs=self.include_dirs,
             # typeshed bug #11271
             macros=cast(Any, list(self.macros)))
 
@@ -70,35 +105,138 @@ class BaseCompiler:
                 postargs += ['/VERBOSE']
             else:
                 postargs += ['/NOLOGO']
+        else:
+            postargs += self._gcc_opt_args()  # (LTO/PGO need them when linking too)
         self.cc.link(self.out_type, self.objects, self.exe_name, self.exe_dir,
                      self.libraries, debug=self.debug, extra_postargs=postargs)
 
+    def _gcc_opt_args(self) -> list[str]:
+        if self.debug:
+            return []
+        args = ['-O3']
+        if self.lto:
+            args += ['-flto']
+        if self.march is not None:
+            args += [f'-march={self.march}']
+        if self.pgo == PGO_GENERATE:
+            args += [f'-fprofile-generate={self.profile_dir}']
+        elif self.pgo == PGO_USE:
+            # -fprofile-correction: the profile can be a bit off if the
+            #  training was multithreaded
+            args += [f'-fprofile-use={self.profile_dir}', '-fprofile-correction']
+        return args
+
     def run(self):
         self.compile()
         self.link()
 
 
 class LmcRtCompiler:
-    def __init__(self, sources: list[str], debug=True, verbose=False):
+    def __init__(self, sources: list[str], debug=True, verbose=False,
+                 out_file: str = 'lmc_runtime.exe', out_type: str = 'executable',
+                 macros: Iterable[tuple[str, str | None] | tuple[str,]] = (),
+                 include_dirs: Iterable[str] = (), out_dir: Path | None = None,
+                 march: str | None = None, threaded=False, pgo: PgoT | None = None):
         self.sources = sources
         self.debug = debug
         self.verbose = verbose
+        self.out_file = out_file
+        self.out_type = out_type
+        self.macros = list(macros)
+        if threaded:
+            self.macros.append(('LMC_THREADED_DISPATCH', '1'))
+        self.include_dirs = include_dirs
+        self.march = march
+        self.pgo = pgo
         self.out_name = 'debug' if self.debug else 'release'
         self.curr_dir = Path(__file__).parent
-        self.out_dir = self.curr_dir / 'out' / self.out_name
+        self.out_dir = (self.curr_dir / 'out' / self.out_name
+                        if out_dir is None else out_dir)
+        self.profile_dir = self.out_dir / 'pgo'
         self.base: None | BaseCompiler = None
 
     def run(self):
         with contextlib.chdir(self.curr_dir):
             self.out_dir.mkdir(parents=True, exist_ok=True)
             self.base = BaseCompiler(
-                self.sources, 'lmc_runtime.exe', [], str(self.out_dir),
-                str(self.out_dir / 'objects'), debug=self.debug, verbose=self.verbose)
+                self.sources, self.out_file, [], str(self.out_dir),
+                str(self.out_dir / 'objects'), out_type=self.out_type,
+                debug=self.debug, verbose=self.verbose, macros=self.macros,
+                include_dirs=self.include_dirs, march=self.march,
+                pgo=self.pgo, profile_dir=str(self.profile_dir))
             self.base.run()
 
 
-def compile_runtime(debug=True, verbose=False):
-    LmcRtCompiler(['lmc_runtime.c'], debug, verbose).run()
+def native_lib_filename() -> str:
+    """File name of the shared library for ``engine='native'`` (in
+    ``out/release`` or ``out/debug``), e.g. ``liblmc_native.so``"""
+    return ccompiler.new_compiler().library_filename('lmc_native', 'shared')
+
+
+def compile_runtime(debug=True, verbose=False, march: str | None = None,
+                    threaded=False) -> Path:
+    """Build ``lmc_runtime.exe`` (runs InterpB2 images, see lmc_runtime.c).
+    Returns its path."""
+    c = LmcRtCompiler(['lmc_runtime.c'], debug, verbose, march=march,
+                      threaded=threaded)
+    c.run()
+    return c.out_dir / c.out_file
+
+
+def compile_native(debug=False, verbose=False, march: str | None = None,
+                   threaded=False, pgo: PgoT | None = None) -> Path:
+    """Build the shared library used by ``LMC_interp.native_engine``.
+    ``threaded`` uses computed goto instead of a switch (gcc/clang only,
+    see ``LMC_THREADED_DISPATCH`` in lmc_interp.h). Returns its path."""
+    c = LmcRtCompiler(['lmc_native.c'], debug, verbose, native_lib_filename(),
+                      ccompiler.CCompiler.SHARED_OBJECT, march=march,
+                      threaded=threaded, pgo=pgo)
+    c.run()
+    return c.out_dir / c.out_file
+
+
+def compile_native_pgo(verbose=False, march: str | None = None,
+                       threaded=False) -> Path:
+    """Profile-guided release build of the native library (gcc/clang):
+    build it with instrumentation, run ``BENCHMARK`` with it then build it
+    again using the profile"""
+    profile_dir = LmcRtCompiler([], debug=False).profile_dir
+    shutil.rmtree(profile_dir, ignore_errors=True)  # (old profiles don't match)
+    path = compile_native(False, verbose, march, threaded, PGO_GENERATE)
+    run_benchmark(path)
+    if profiles := list(profile_dir.glob('*.profraw')):
+        # clang needs them merged first (gcc uses the .gcda files directly)
+        subprocess.run(['llvm-profdata', 'merge', '-output',
+                        str(profile_dir / 'default.profdata'), *map(str, profiles)],
+                       check=True)
+    return compile_native(False, verbose, march, threaded, PGO_USE)
+
+
+_BENCHMARK_SCRIPT = """\
+import sys, time
+from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+from LMC_interp.io_mgr import ListIOMgr
+with open(sys.argv[1]) as f:
+    inst = InterpB2.from_source(f.read(), engine='native')
+inst.io = ListIOMgr(inst, [])
+start = time.perf_counter()
+inst.run()
+print(time.perf_counter() - start)
+"""
+
+
+def run_benchmark(lib_path: str | os.PathLike | None = None,
+                  program: str | os.PathLike = BENCHMARK) -> float:
+    """Time (in seconds) that the native engine takes to run ``program``
+    using the library at ``lib_path`` (in a new process as the library
+    can only be loaded once)"""
+    env = dict(os.environ)
+    if lib_path is not None:
+        env['LMC_NATIVE_LIB'] = str(lib_path)
+    result = subprocess.run(
+        [sys.executable, '-c', _BENCHMARK_SCRIPT, str(program)], env=env,
+        cwd=Path(__file__).parent.parent, capture_output=True, text=True, check=True)
+    return float(result.stdout)
 
 
 def main(argv: list[str] = None):
@@ -116,14 +254,26 @@ def main(argv: list[str] = None):
     debug_group.add_argument('-a', '--all',
                              action='store_const', dest='debug', const='BOTH',
                              help='Compile both debug and release builds')
+    p.add_argument('--march', help="CPU to optimize for (gcc/clang), "
+                                   "e.g. 'native' (the default is portable)")
+    p.add_argument('--threaded', action='store_true',
+                   help="use computed goto instead of a switch (gcc/clang)")
+    p.add_argument('--pgo', action='store_true',
+                   help="profile-guided release build of the native library "
+                        "(trained on benchmark.lmc, gcc/clang)")
+    p.add_argument('--bench', action='store_true',
+                   help="time the native library on benchmark.lmc after building it")
     p.add_argument('-v', '--verbose', action='store_true',
                    help="Be VERY verbose")
     args = p.parse_args(argv)
-    if args.debug == 'BOTH':
-        compile_runtime(False, args.verbose)
-        compile_runtime(True, args.verbose)
-    else:
-        compile_runtime(args.debug, args.verbose)
+    for debug in ((False, True) if args.debug == 'BOTH' else (args.debug,)):
+        compile_runtime(debug, args.verbose, args.march, args.threaded)
+        if args.pgo and not debug:
+            lib = compile_native_pgo(args.verbose, args.march, args.threaded)
+        else:
+            lib = compile_native(debug, args.verbose, args.march, args.threaded)
+        if args.bench:
+            print(f'{lib}: {run_benchmark(lib) * 1000:.1f}ms')
 
 
 if __name__ == '__main__':
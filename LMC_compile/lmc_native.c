@@ -0,0 +1,90 @@
+// Shared library used by LMC_interp.native_engine (engine='native') to run
+// InterpB2 programs using the C interpreter.
+// The memory is the Python interpreter's own buffer so nothing is copied.
+// Output goes into a buffer that Python then writes using its IOMgr.
+// Anything else (input, errors) is left to Python so that it behaves exactly
+// the same as the Python interpreter.
+#include <stdbool.h>
+
+#include "lmc_runtime_lib/lmc_interp.h"
+
+#if defined(_WIN32)
+#define LMC_EXPORT __declspec(dllexport)
+#else
+#define LMC_EXPORT __attribute__((visibility("default")))
+#endif
+
+// Increase this when LmcNativeRunT changes (checked by the Python side)
+#define LMC_NATIVE_ABI_VERSION 1
+#define LMC_NATIVE_MAX_CHAR 0x10FFFF
+
+// Must match LMC_interp.native_engine._NativeRun
+typedef struct _LmcNativeRunS {
+    // in/out
+    u64 ip;
+    u64 n_instr;
+    i32 acc;
+    u8 is_halted;
+    // in
+    u8 wrap_memory;
+    u8 extensions;
+    u64 stop_n;
+    i32* mem;
+    u64 mem_len;
+    // out: (2 or 22, value) for each OUT/OTC
+    i32* out_buf;
+    u64 out_cap;  // number of pairs
+    u64 out_len;
+    // out: addresses written to (see LmcInterpT), the entries in
+    //  `dirty_map` from the previous run are cleared at the start
+    u8* dirty_map;
+    u32* dirty_list;
+    u64 n_dirty;
+} LmcNativeRunT;
+
+// Why LmcNative_run() returned (as well as the LmcStopT values)
+#define LMC_NATIVE_OUTPUT_FULL 100
+
+LMC_EXPORT int LmcNative_abiVersion(void) {
+    return LMC_NATIVE_ABI_VERSION;
+}
+
+// Returns a LmcStopT (the I/O ones only for INP and OTC that Python
+// has to do) or LMC_NATIVE_OUTPUT_FULL
+LMC_EXPORT int LmcNative_run(LmcNativeRunT* run) {
+    for(u64 i = 0; i < run->n_dirty; ++i) run->dirty_map[run->dirty_list[i]] = 0;
+    run->n_dirty = 0;
+    run->out_len = 0;
+    LmcInterpT interp = LmcInterp_createFromMem(
+        LmcMem_fromBuf(run->mem, (usize)run->mem_len), false);
+    interp.ip = (usize)run->ip;
+    interp.acc = run->acc;
+    interp.n_instr = run->n_instr;
+    interp.wrap_memory = run->wrap_memory;
+    interp.extensions = run->extensions;
+    interp.dirty_map = run->dirty_map;
+    interp.dirty_list = run->dirty_list;
+    int result;
+    for(;;) {
+        LmcStopT why = LmcInterp_runUntil(&interp, run->stop_n);
+        bool is_output = why == LmcStop_OUT || (
+            why == LmcStop_OTC && interp.acc >= 0 && interp.acc <= LMC_NATIVE_MAX_CHAR);
+        if(!is_output) {
+            result = (int)why; break;
+        }
+        if(run->out_len == run->out_cap) {
+            result = LMC_NATIVE_OUTPUT_FULL; break;
+        }
+        i32* out = &run->out_buf[2 * run->out_len++];
+        out[0] = why == LmcStop_OUT ? 2 : 22;
+        out[1] = interp.acc;
+        ++interp.ip;
+        ++interp.n_instr;
+    }
+    run->ip = interp.ip;
+    run->acc = interp.acc;
+    run->n_instr = interp.n_instr;
+    run->is_halted = interp.is_halted;
+    run->n_dirty = interp.n_dirty;
+    return result;
+}
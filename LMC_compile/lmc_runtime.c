@@ -1,40 +1,163 @@
+// Runs InterpB2 memory images (see InterpB2.save_image):
+//
+//   lmc_runtime [-m MEM_SIZE] [-q] IMAGE
+//       Run one image (inputs from stdin, -q: no '>? ' prompt)
+//   lmc_runtime [-m MEM_SIZE] --batch IMAGE INPUT [IMAGE INPUT ...]
+//   lmc_runtime [-m MEM_SIZE] --jobs JOBS_FILE
+//       Run lots of jobs in this process, each with its inputs read from
+//       the INPUT file ('-' for stdin, only for one job as the input
+//       is read ahead). JOBS_FILE has one job per line:
+//       IMAGE<tab>INPUT. The number of instructions and time taken by each
+//       job is written to stderr (the programs' output goes to stdout).
+//
+// Exits with 1 if a program didn't halt (error or ran out of input).
 #include <stdio.h>
 #include <stdlib.h>
 #include <stdint.h>
 #include <stdbool.h>
+#include <string.h>
+#include <time.h>
 
 #include "lmc_runtime_lib/lmc_interp.h"
+#include "lmc_runtime_lib/lmc_image.h"
 
-typedef struct {
-    i32 a;
-    i32 b;
-} intpair;
+#define LMC_RT_MEM_SIZE_DEFAULT 65536  // (same as InterpB2)
+#define LMC_RT_MAX_LINE 4096
 
+static double _LmcRt_nowMs(void) {
+    struct timespec ts;
+    timespec_get(&ts, TIME_UTC);
+    return (double)ts.tv_sec * 1e3 + (double)ts.tv_nsec / 1e6;
+}
+
+static int _LmcRt_usage(void) {
+    fprintf(stderr, "Usage: lmc_runtime [-m MEM_SIZE] [-q] IMAGE\n"
+                    "       lmc_runtime [-m MEM_SIZE] --batch IMAGE INPUT [IMAGE INPUT ...]\n"
+                    "       lmc_runtime [-m MEM_SIZE] --jobs JOBS_FILE\n");
+    return 2;
+}
+
+static int LmcRt_runOne(const char* image_path, usize mem_size, bool prompt) {
+    LmcImageT image;
+    const char* err = LmcImage_open(&image, image_path);
+    if(err == NULL && image.len > mem_size) err = "Image is bigger than the memory";
+    if(err != NULL) {
+        fprintf(stderr, "%s: %s\n", image_path, err);
+        LmcImage_close(&image);
+        return 1;
+    }
+    LmcInterpT lmc = LmcInterp_createCopyResize(
+        (i32*)image.words, image.len, mem_size, prompt);
+    LmcImage_close(&image);
+    LmcStopT why = LmcInterp_runToEnd(&lmc);
+    LmcIo_destroy(&lmc.io);
+    free(lmc.mem.mem_ptr);
+    if(why != LmcStop_HALTED) {
+        fprintf(stderr, "Error: %s\n", LmcStop_describe(why));
+        return 1;
+    }
+    return 0;
+}
+
+// State shared by all the jobs in a batch
+typedef struct _LmcRtBatchS {
+    LmcMemT arena;  // the memory (reused by every job)
+    usize n_jobs;
+    usize n_failed;
+    u64 n_instr;
+    double time_ms;
+} LmcRtBatchT;
+
+static void LmcRt_runJob(LmcRtBatchT* batch, const char* image_path, const char* input_path) {
+    usize job = batch->n_jobs++;
+    LmcImageT image;
+    const char* err = LmcImage_open(&image, image_path);
+    if(err == NULL && image.len > batch->arena.len) err = "Image is bigger than the memory";
+    FILE* in = NULL;
+    if(err == NULL) {
+        in = strcmp(input_path, "-") == 0 ? stdin : fopen(input_path, "r");
+        if(in == NULL) err = "Can't open the input";
+    }
+    if(err != NULL) {
+        fprintf(stderr, "job %zu (%s): %s\n", job, image_path, err);
+        LmcImage_close(&image);
+        ++batch->n_failed;
+        return;
+    }
+    // Load it into the arena (the rest of the memory is zeroes)
+    LmcMem_copyFrom(&batch->arena, image.words, image.len);
+    memset(&batch->arena.mem_ptr[image.len], 0, (batch->arena.len - image.len) * sizeof(i32));
+    LmcImage_close(&image);
+    LmcInterpT lmc = LmcInterp_createFromMem(batch->arena, false);
+    lmc.io.in = in;
+    double start = _LmcRt_nowMs();
+    LmcStopT why = LmcInterp_runToEnd(&lmc);
+    double time_ms = _LmcRt_nowMs() - start;
+    LmcIo_destroy(&lmc.io);  // (so the report comes after the output if they're the same file)
+    if(in != stdin) fclose(in);
+    fprintf(stderr, "job %zu (%s): %" PRIu64 " instructions in %.3fms: %s\n",
+            job, image_path, lmc.n_instr, time_ms, LmcStop_describe(why));
+    batch->n_failed += why != LmcStop_HALTED;
+    batch->n_instr += lmc.n_instr;
+    batch->time_ms += time_ms;
+}
+
+static bool LmcRt_runJobsFile(LmcRtBatchT* batch, const char* jobs_path) {
+    FILE* f = fopen(jobs_path, "r");
+    if(f == NULL) {
+        fprintf(stderr, "%s: Can't open the jobs file\n", jobs_path);
+        return false;
+    }
+    char line[LMC_RT_MAX_LINE];
+    while(fgets(line, sizeof(line), f) != NULL) {
+        line[strcspn(line, "\r\n")] = '\0';
+        if(line[0] == '\0') continue;
+        char* tab = strchr(line, '\t');
+        if(tab == NULL) {
+            fprintf(stderr, "%s: Expected IMAGE<tab>INPUT, got '%s'\n", jobs_path, line);
+            ++batch->n_failed;
+            continue;
+        }
+        *tab = '\0';
+        LmcRt_runJob(batch, line, tab + 1);
+    }
+    fclose(f);
+    return true;
+}
 
 int main(int argc, char** argv) {
-    (void)argc;(void)argv;
-
-    #define PSZ 4
-
-    intpair PRGPAIR[PSZ] = {
-        {9, 1},  // INP
-        {1, 3},  // ADD one
-        {9, 2},  // OUT
-        {0, 1},  // one DAT 1
-    };
-    i32 PRG[PSZ];
-    for(usize i=0; i<PSZ; ++i) {
-        intpair pair = PRGPAIR[i];
-        i32 res;
-        if(pair.a == 0) {
-            res = pair.b;
+    usize mem_size = LMC_RT_MEM_SIZE_DEFAULT;
+    bool prompt = true;
+    int i = 1;
+    for(; i < argc && argv[i][0] == '-' && argv[i][1] != '\0'; ++i) {
+        if(strcmp(argv[i], "-m") == 0 && i + 1 < argc) {
+            char* end;
+            mem_size = (usize)strtoull(argv[++i], &end, 10);
+            if(*end != '\0' || mem_size == 0) return _LmcRt_usage();
+        } else if(strcmp(argv[i], "-q") == 0) {
+            prompt = false;
+        } else if(strcmp(argv[i], "--batch") == 0 || strcmp(argv[i], "--jobs") == 0) {
+            break;
         } else {
-            res = pair.a << 27 | pair.b & 0x07'FF'FF'FF;
+            return _LmcRt_usage();
         }
-        PRG[i] = res;
     }
-    LmcInterpT lmc = LmcInterp_create_fromBuf(PRG, PSZ, true);
-    LmcInterp_main(&lmc);
-    // wprintf(L"Hello world, %zi\n", sizeof(LmcMemT));
-    return 0;
+    if(i == argc) return _LmcRt_usage();
+    bool is_batch = strcmp(argv[i], "--batch") == 0;
+    bool is_jobs_file = strcmp(argv[i], "--jobs") == 0;
+    if(!is_batch && !is_jobs_file) {
+        return i + 1 == argc ? LmcRt_runOne(argv[i], mem_size, prompt) : _LmcRt_usage();
+    }
+    ++i;
+    if(is_batch ? (argc - i) % 2 != 0 : argc - i != 1) return _LmcRt_usage();
+    LmcRtBatchT batch = {.arena = LmcMem_createZeroed(mem_size)};
+    if(is_batch) {
+        for(; i < argc; i += 2) LmcRt_runJob(&batch, argv[i], argv[i + 1]);
+    } else if(!LmcRt_runJobsFile(&batch, argv[i])) {
+        ++batch.n_failed;
+    }
+    free(batch.arena.mem_ptr);
+    fprintf(stderr, "%zu jobs (%zu failed), %" PRIu64 " instructions in %.3fms\n",
+            batch.n_jobs, batch.n_failed, batch.n_instr, batch.time_ms);
+    return batch.n_failed == 0 ? 0 : 1;
 }
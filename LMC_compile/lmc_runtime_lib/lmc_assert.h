@@ -17,11 +17,11 @@
 
 
 noreturn void _LmcAssert_FailWithMsg(const char* msg, const char* dunder_file, int dunder_line, const char* dunder_func) {
-    fwprintf(stderr, L"%hs:%i %hs (in function %hs)", dunder_file, dunder_line, msg, dunder_func);
+    fprintf(stderr, "%s:%i %s (in function %s)", dunder_file, dunder_line, msg, dunder_func);
     abort();
 }
 noreturn void _LmcAssert_FailNoMsg(const char* dunder_file, int dunder_line, const char* dunder_func) {
-    fwprintf(stderr, L"%hs:%i LmcAssert_ASSERT() failed in %hs, aborting", dunder_file, dunder_line, dunder_func);
+    fprintf(stderr, "%s:%i LmcAssert_ASSERT() failed in %s, aborting", dunder_file, dunder_line, dunder_func);
     abort();
 }
 
@@ -46,11 +46,11 @@ void _LmcAssert_AssertFatal_Func(bool cond, const char* dunder_file, int dunder_
 #define LmcAssert_UNREACHABLE1(msg) _LmcAssert_UnreachableMsgFatal(msg, __FILE__, __LINE__, __func__)
 
 noreturn void _LmcAssert_UnreachableFatal(const char* dunder_file, int dunder_line, const char* dunder_func) {
-    fwprintf(stderr, L"%hs:%i LmcAssert_UNREACHABLE() reached, aborting (in function %hs)", dunder_file, dunder_line, dunder_func);
+    fprintf(stderr, "%s:%i LmcAssert_UNREACHABLE() reached, aborting (in function %s)", dunder_file, dunder_line, dunder_func);
     abort();
 }
 noreturn void _LmcAssert_UnreachableMsgFatal(const char* msg, const char* dunder_file, int dunder_line, const char* dunder_func) {
-    fwprintf(stderr, L"%hs:%i %hs, aborting (in function %hs)", dunder_file, dunder_line, msg, dunder_func);
+    fprintf(stderr, "%s:%i %s, aborting (in function %s)", dunder_file, dunder_line, msg, dunder_func);
     abort();
 }
 
@@ -0,0 +1,101 @@
+#ifndef _LMC_IMAGE_H
+#define _LMC_IMAGE_H
+
+// InterpB2 memory images (see InterpB2.save_image): signed 32-bit words in
+// the native byte order. They are mapped into memory (read-only) instead
+// of being read so only the pages that are used are loaded.
+
+#include <stdbool.h>
+
+#if defined(_WIN32)
+#define WIN32_LEAN_AND_MEAN
+#include <windows.h>
+#else
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
+
+#include "concise_inttypes.h"
+
+typedef struct _LmcImageS {
+    const i32* words;
+    usize len;  // number of words
+    void* _view;  // what was mapped (NULL if nothing, e.g. empty file)
+    usize _view_size;
+} LmcImageT;
+
+static const i32 _LMC_IMAGE_EMPTY[1] = {0};
+
+// Returns NULL on success, otherwise an error message
+const char* LmcImage_open(LmcImageT* self, const char* path) {
+    self->words = _LMC_IMAGE_EMPTY;
+    self->len = 0;
+    self->_view = NULL;
+    self->_view_size = 0;
+    u64 size;
+#if defined(_WIN32)
+    HANDLE file = CreateFileA(path, GENERIC_READ, FILE_SHARE_READ, NULL,
+                              OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, NULL);
+    if(file == INVALID_HANDLE_VALUE) return "Can't open the image";
+    LARGE_INTEGER file_size;
+    if(!GetFileSizeEx(file, &file_size)) {
+        CloseHandle(file);
+        return "Can't get the size of the image";
+    }
+    size = (u64)file_size.QuadPart;
+    if(size % sizeof(i32) != 0) {
+        CloseHandle(file);
+        return "Image isn't a whole number of words";
+    }
+    if(size != 0) {
+        HANDLE mapping = CreateFileMappingA(file, NULL, PAGE_READONLY, 0, 0, NULL);
+        if(mapping != NULL) {
+            self->_view = MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0);
+            CloseHandle(mapping);  // (the view keeps it alive)
+        }
+    }
+    CloseHandle(file);
+#else
+    int fd = open(path, O_RDONLY);
+    if(fd < 0) return "Can't open the image";
+    struct stat st;
+    if(fstat(fd, &st) != 0) {
+        close(fd);
+        return "Can't get the size of the image";
+    }
+    size = (u64)st.st_size;
+    if(size % sizeof(i32) != 0) {
+        close(fd);
+        return "Image isn't a whole number of words";
+    }
+    if(size != 0) {
+        void* view = mmap(NULL, (usize)size, PROT_READ, MAP_PRIVATE, fd, 0);
+        self->_view = view == MAP_FAILED ? NULL : view;
+    }
+    close(fd);  // (the mapping keeps it alive)
+#endif
+    if(size == 0) return NULL;
+    if(self->_view == NULL) return "Can't map the image into memory";
+    self->words = (const i32*)self->_view;
+    self->len = (usize)(size / sizeof(i32));
+    self->_view_size = (usize)size;
+    return NULL;
+}
+
+void LmcImage_close(LmcImageT* self) {
+    if(self->_view != NULL) {
+#if defined(_WIN32)
+        UnmapViewOfFile(self->_view);
+#else
+        munmap(self->_view, self->_view_size);
+#endif
+    }
+    self->words = _LMC_IMAGE_EMPTY;
+    self->len = 0;
+    self->_view = NULL;
+    self->_view_size = 0;
+}
+
+#endif
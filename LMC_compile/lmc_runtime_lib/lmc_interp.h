@@ -6,14 +6,38 @@
 #include "lmc_mem.h"
 #include "lmc_io.h"
 
-// surprisingly this struct itself is only 32B, including padding
-// see https://godbolt.org/z/qPf5hPevK
+// Why LmcInterp_runUntil() stopped
+typedef enum _LmcStopE {
+    LmcStop_HALTED = 0,
+    LmcStop_BUDGET,  // ran `stop_n` instructions
+    // I/O, left for the caller to do
+    LmcStop_INP,
+    LmcStop_OUT,
+    LmcStop_OTC,
+    // errors
+    LmcStop_IP_OOB,
+    LmcStop_READ_OOB,
+    LmcStop_WRITE_OOB,
+    LmcStop_JMP_OOB,
+    LmcStop_BAD_OPCODE,
+    LmcStop_BAD_IO_OPERAND,
+    LmcStop_EXT_DISABLED,
+} LmcStopT;
+
 typedef struct _LmcInterpS {
     LmcMemT mem;
     usize ip;
     i32 acc;
     LmcIoT io;
     bool is_halted;
+    bool wrap_memory;  // wrap addresses around instead of it being an error
+    bool extensions;  // allow OTC
+    u64 n_instr;
+    // Optional (NULL to disable): each address written to is added to
+    //  `dirty_list` once (`dirty_map` has 1 byte per memory cell)
+    u8* dirty_map;
+    u32* dirty_list;
+    usize n_dirty;
 } LmcInterpT;
 
 LmcInterpT LmcInterp_createFromMem(LmcMemT mem, bool add_prompt) {
@@ -23,6 +47,12 @@ LmcInterpT LmcInterp_createFromMem(LmcMemT mem, bool add_prompt) {
         .acc = 0,
         .ip = 0,
         .is_halted = false,
+        .wrap_memory = false,
+        .extensions = true,
+        .n_instr = 0,
+        .dirty_map = NULL,
+        .dirty_list = NULL,
+        .n_dirty = 0,
     };
     return self;
 }
@@ -43,65 +73,208 @@ LmcInterpT LmcInterp_createCopyResize(i32* srcbuf, usize srclen, usize newlen, b
     return LmcInterp_createFromMem(LmcMem_createCopyResize(srcbuf, srclen, newlen), add_prompt);
 }
 
-u32 LmcInterp_fetchCurrInstr(const LmcInterpT* self) {
-    i32 sinstr = LmcMem_get(&self->mem, self->ip);
-    return (u32)sinstr;
+const char* LmcStop_describe(LmcStopT why) {
+    switch(why) {
+        case LmcStop_HALTED: return "Program halted";
+        case LmcStop_BUDGET: return "Ran out of steps";
+        case LmcStop_INP: return "Needs input (end of the input reached)";
+        case LmcStop_OUT: case LmcStop_OTC: return "I/O instruction";
+        case LmcStop_IP_OOB: return "Instruction pointer went outside of memory";
+        case LmcStop_READ_OOB: return "Attempt to read outside of memory";
+        case LmcStop_WRITE_OOB: return "Attempt to write outside of memory";
+        case LmcStop_JMP_OOB: return "Program branched outside of memory";
+        case LmcStop_BAD_OPCODE: return "Invalid opcode encountered";
+        case LmcStop_BAD_IO_OPERAND: return "Invalid operand of IO instruction";
+        case LmcStop_EXT_DISABLED: return "The non-standard OTC instruction is not enabled";
+    }
+    return "Unknown reason";
+}
+
+static inline void _LmcInterp_markDirty(LmcInterpT* self, usize addr) {
+    if(self->dirty_map != NULL && !self->dirty_map[addr]) {
+        self->dirty_map[addr] = 1;
+        self->dirty_list[self->n_dirty++] = (u32)addr;
+    }
 }
 
-// abort()s on invalid operand
-void LmcInterp_handleIoInstr(LmcInterpT* self, u32 operand32) {
-    switch(operand32) {
-        case 1: {  // INP
+// Set LMC_THREADED_DISPATCH to 1 to use computed goto (GCC/Clang) in
+// LmcInterp_runUntil() instead of a switch: each instruction jumps straight
+// to the next one's code so the CPU can predict each jump separately.
+#ifndef LMC_THREADED_DISPATCH
+#define LMC_THREADED_DISPATCH 0
+#endif
+#if LMC_THREADED_DISPATCH && !defined(__GNUC__)
+#error "LMC_THREADED_DISPATCH needs computed goto (GCC/Clang)"
+#endif
+
+// Runs until it halts, `n_instr` gets to `stop_n` or it gets to an
+// instruction that it doesn't run itself (I/O and errors).
+// Those are left to the caller: `ip` still points to them and they aren't
+// counted in `n_instr` (the caller does that if it runs them).
+// Values wrap around like InterpB2 (two's complement).
+LmcStopT LmcInterp_runUntil(LmcInterpT* self, u64 stop_n) {
+    i32* mem = self->mem.mem_ptr;
+    const usize len = self->mem.len;
+    const bool wrap_memory = self->wrap_memory;
+    usize ip = self->ip;
+    u32 acc = (u32)self->acc;  // unsigned so that it wraps (signed overflow is UB)
+    u64 n = self->n_instr;
+    u32 cir, operand32;
+    usize operand;
+    LmcStopT why;
+    // OOB addresses are wrapped or it stops with `err`
+    #define _LMC_CHECK_ADDR(addr, err) \
+        if((addr) >= len) { \
+            if(!wrap_memory) { why = (err); goto stop; } \
+            (addr) %= len; \
+        }
+    // FETCH and DECODE (all but the opcode)
+    #define _LMC_FETCH() \
+        if(n >= stop_n) { why = LmcStop_BUDGET; goto stop; } \
+        _LMC_CHECK_ADDR(ip, LmcStop_IP_OOB) \
+        cir = (u32)mem[ip]; \
+        operand32 = cir & 0x07'FF'FF'FF;  /* 27 LSB */ \
+        operand = (usize)operand32;
+    // 5 MSB; the `& 0x1F` is just to make it explicit to the compiler that its 5 bits
+    #define _LMC_OPCODE() ((cir >> 27) & 0x1F)
+#if LMC_THREADED_DISPATCH
+    static void* const DISPATCH[32] = {
+        [0] = &&op_hlt, [1] = &&op_add, [2] = &&op_sub, [3] = &&op_sta,
+        [4] = &&op_bad, [5] = &&op_lda, [6] = &&op_bra, [7] = &&op_brz,
+        [8] = &&op_brp, [9] = &&op_io, [10 ... 31] = &&op_bad,
+    };
+    #define _LMC_TARGET(opcode, name) op_##name
+    #define _LMC_DISPATCH() { _LMC_FETCH() goto *DISPATCH[_LMC_OPCODE()]; }
+    _LMC_DISPATCH()
+#else
+    #define _LMC_TARGET(opcode, name) case opcode
+    #define _LMC_DISPATCH() continue
+    for(;;) {
+        _LMC_FETCH()
+        switch(_LMC_OPCODE()) {
+#endif
+            // EXECUTE
+            _LMC_TARGET(0, hlt): {
+                self->is_halted = true;
+                ++ip; ++n;
+                why = LmcStop_HALTED; goto stop;
+            }
+            _LMC_TARGET(1, add): {
+                _LMC_CHECK_ADDR(operand, LmcStop_READ_OOB)
+                acc += (u32)mem[operand];
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(2, sub): {
+                _LMC_CHECK_ADDR(operand, LmcStop_READ_OOB)
+                acc -= (u32)mem[operand];
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(3, sta): {
+                _LMC_CHECK_ADDR(operand, LmcStop_WRITE_OOB)
+                mem[operand] = (i32)acc;
+                _LmcInterp_markDirty(self, operand);
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(5, lda): {
+                _LMC_CHECK_ADDR(operand, LmcStop_READ_OOB)
+                acc = (u32)mem[operand];
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(6, bra): {
+                _LMC_CHECK_ADDR(operand, LmcStop_JMP_OOB)
+                ip = operand; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(7, brz): {
+                if(acc == 0) {
+                    _LMC_CHECK_ADDR(operand, LmcStop_JMP_OOB)
+                    ip = operand; ++n; _LMC_DISPATCH();
+                }
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(8, brp): {
+                if((i32)acc >= 0) {
+                    _LMC_CHECK_ADDR(operand, LmcStop_JMP_OOB)
+                    ip = operand; ++n; _LMC_DISPATCH();
+                }
+                ++ip; ++n; _LMC_DISPATCH();
+            }
+            _LMC_TARGET(9, io): {
+                switch(operand32) {
+                    case 1: why = LmcStop_INP; break;
+                    case 2: why = LmcStop_OUT; break;
+                    case 22: why = self->extensions ? LmcStop_OTC : LmcStop_EXT_DISABLED; break;
+                    default: why = LmcStop_BAD_IO_OPERAND; break;
+                }
+                goto stop;
+            }
+#if LMC_THREADED_DISPATCH
+            op_bad:
+#else
+            default:
+#endif
+            {  // including 4 (unused)
+                why = LmcStop_BAD_OPCODE; goto stop;
+            }
+#if !LMC_THREADED_DISPATCH
+        }
+    }
+#endif
+    #undef _LMC_CHECK_ADDR
+    #undef _LMC_FETCH
+    #undef _LMC_OPCODE
+    #undef _LMC_TARGET
+    #undef _LMC_DISPATCH
+stop:
+    self->ip = ip;
+    self->acc = (i32)acc;
+    self->n_instr = n;
+    return why;
+}
+
+// Runs the I/O instruction that LmcInterp_runUntil() stopped at
+void LmcInterp_runIo(LmcInterpT* self, LmcStopT why) {
+    switch(why) {
+        case LmcStop_INP: {
             self->acc = LmcIo_readNum(&self->io); break;
-        } case 2: {
+        } case LmcStop_OUT: {
             LmcIo_writeNum(&self->io, self->acc); break;
-        } case 22: {
+        } case LmcStop_OTC: {
             LmcIo_writeChar(&self->io, self->acc); break;
         } default: {
-            LmcAssert_FATALX("Invalid operand of IO instruction");
+            LmcAssert_UNREACHABLE1("Not an I/O instruction");
         }
     }
+    ++(self->ip);
+    ++(self->n_instr);
 }
 
-// abort()s on invalid instruction or OOB read/write
-void LmcInterp_main(LmcInterpT* self) {
-    LmcMemT* mem = &self->mem;
+// Runs it until it halts (doing the I/O itself) or there is an error.
+// Returns LmcStop_INP if the input ran out (`ip` is still the INP).
+// The output is flushed when it returns.
+LmcStopT LmcInterp_runToEnd(LmcInterpT* self) {
+    LmcStopT why = LmcStop_HALTED;
     while(!self->is_halted) {
-        // FETCH
-        u32 cir = LmcInterp_fetchCurrInstr(self);
-        ++(self->ip);
-        // DECODE
-        // 5 MSB; the `& 0x1F` is just to make it explicit to the compiler that its 5 bits
-        u32 opcode = (cir >> 27) & 0x1F;
-        u32 operand32 = cir & 0x07'FF'FF'FF;  // 27 LSB
-        usize operand = (usize)operand32;
-        // EXECUTE
-        switch(opcode) {
-            case 0: {  // HLT
-                self->is_halted = true; break;
-            } case 1: {  // ADD
-                self->acc += LmcMem_get(mem, operand); break;
-            } case 2: {  // SUB
-                self->acc -= LmcMem_get(mem, operand); break;
-            } case 3: {  // STA
-                LmcMem_set(mem, operand, self->acc); break;
-            } case 4: {
-                LmcAssert_FATALX(false, "Opcode 4 is invalid");
-            } case 5: {  // LDA
-                self->acc = LmcMem_get(mem, operand); break;
-            } case 6: {  // BRA
-                self->ip = operand; break;
-            } case 7: {  // BRZ
-                if(self->acc == 0) self->ip = operand; break;
-            } case 8: {  // BRP
-                if(self->acc >= 0) self->ip = operand; break;
-            } case 9: {  // IO
-                LmcInterp_handleIoInstr(self, operand32); break;
-            } default: {
-                LmcAssert_FATALX(false, "Invalid opcode encountered");
-            }
+        why = LmcInterp_runUntil(self, UINT64_MAX);
+        if(why == LmcStop_INP) {
+            i32 value;
+            if(!LmcIo_tryReadNum(&self->io, &value)) break;
+            self->acc = value;
+            ++(self->ip);
+            ++(self->n_instr);
+        } else if(why == LmcStop_OUT || why == LmcStop_OTC) {
+            LmcInterp_runIo(self, why);
+        } else if(why != LmcStop_HALTED) {
+            break;
         }
     }
+    LmcIo_flush(&self->io);
+    return why;
+}
+
+// abort()s on invalid instruction or OOB read/write
+void LmcInterp_main(LmcInterpT* self) {
+    LmcStopT why = LmcInterp_runToEnd(self);
+    LmcAssert_FATALX(why == LmcStop_HALTED, LmcStop_describe(why));
 }
 
-#endif
\ No newline at end of file
+#endif
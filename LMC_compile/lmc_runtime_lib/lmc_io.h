@@ -2,25 +2,57 @@
 #define _LMC_IO_H
 
 #include <stdio.h>
-#include <wchar.h>
+#include <stdlib.h>
+#include <stdbool.h>
+#include <string.h>
 #include <inttypes.h>
 
+#if defined(_WIN32)
+#include <io.h>
+#define _LMC_IO_ISATTY(f) _isatty(_fileno(f))
+#else
+#include <unistd.h>
+#define _LMC_IO_ISATTY(f) isatty(fileno(f))
+#endif
+
 #include "concise_inttypes.h"
 #include "lmc_assert.h"
 
-// WARNING: This uses wprintf so everything in the rest 
-// of the program must also use wprintf to avoid UB
+// Output is formatted into a buffer that is written (fwrite) when it's full,
+// when input is needed and by LmcIo_flush() so remember to call that
+// (LmcInterp_runToEnd() does). Input is read in big chunks (a line at a
+// time from a terminal) and parsed here instead of using scanf.
+// Text is UTF-8 (not wide chars) so the rest of the program can use
+// printf and friends (but must flush first to keep the order).
 
+#define LMC_IO_BUF_SIZE 65536
 
 typedef struct _LmcIoS {
     bool is_line_mode;
     bool addPromptS;
+    FILE* in;  // where the inputs are read from (stdin by default)
+    FILE* out;  // stdout by default
+    // The buffers are only allocated when they are first used
+    char* out_buf;
+    usize out_len;
+    char* in_buf;
+    usize in_pos;
+    usize in_len;
+    bool in_eof;
 } LmcIoT;
 
 LmcIoT LmcIo_create1(bool addPromptS) {
     LmcIoT lio = {
-        false,
-        addPromptS
+        .is_line_mode = false,
+        .addPromptS = addPromptS,
+        .in = stdin,
+        .out = stdout,
+        .out_buf = NULL,
+        .out_len = 0,
+        .in_buf = NULL,
+        .in_pos = 0,
+        .in_len = 0,
+        .in_eof = false,
     };
     return lio;
 }
@@ -29,86 +61,169 @@ LmcIoT LmcIo_create0(void) {
     return LmcIo_create1(true);
 }
 
+void LmcIo_flush(LmcIoT* self) {
+    if(self->out_len != 0) {
+        fwrite(self->out_buf, 1, self->out_len, self->out);
+        self->out_len = 0;
+    }
+    fflush(self->out);
+}
+
+// Flushes the output and frees the buffers
+void LmcIo_destroy(LmcIoT* self) {
+    LmcIo_flush(self);
+    free(self->out_buf);
+    free(self->in_buf);
+    self->out_buf = self->in_buf = NULL;
+    self->in_pos = self->in_len = 0;
+}
+
+// Returns where to write `n` (at most LMC_IO_BUF_SIZE) bytes
+static inline char* _LmcIo_reserve(LmcIoT* self, usize n) {
+    if(self->out_buf == NULL) {
+        self->out_buf = (char*)malloc(LMC_IO_BUF_SIZE);
+        LmcAssert_FATAL2(self->out_buf != NULL, "Out of memory");
+    } else if(self->out_len + n > LMC_IO_BUF_SIZE) {
+        fwrite(self->out_buf, 1, self->out_len, self->out);
+        self->out_len = 0;
+    }
+    return &self->out_buf[self->out_len];
+}
+
+void _LmcIo_writeStr(LmcIoT* self, const char* s) {
+    for(; *s != '\0'; ++s) {
+        *_LmcIo_reserve(self, 1) = *s;
+        ++self->out_len;
+    }
+}
+
 void LmcIo_writeChar(LmcIoT* self, i32 value) {
-    u32 uval = (u32)value;
-    wchar_t wch = (wchar_t)uval;
-    wprintf(L"%c", wch);
-    if(wch == L'\n') {
-        self->is_line_mode = false;  // end of line; reset to normal
+    u32 c = (u32)value;
+    if(c > 0x10FFFF || (c >= 0xD800 && c <= 0xDFFF)) c = 0xFFFD;  // (not a character)
+    char* dst = _LmcIo_reserve(self, 4);
+    // UTF-8
+    if(c < 0x80) {
+        dst[0] = (char)c;
+        self->out_len += 1;
+    } else if(c < 0x800) {
+        dst[0] = (char)(0xC0 | (c >> 6));
+        dst[1] = (char)(0x80 | (c & 0x3F));
+        self->out_len += 2;
+    } else if(c < 0x10000) {
+        dst[0] = (char)(0xE0 | (c >> 12));
+        dst[1] = (char)(0x80 | ((c >> 6) & 0x3F));
+        dst[2] = (char)(0x80 | (c & 0x3F));
+        self->out_len += 3;
     } else {
-        self->is_line_mode = true;  // middle of line - keep outputting on this line
+        dst[0] = (char)(0xF0 | (c >> 18));
+        dst[1] = (char)(0x80 | ((c >> 12) & 0x3F));
+        dst[2] = (char)(0x80 | ((c >> 6) & 0x3F));
+        dst[3] = (char)(0x80 | (c & 0x3F));
+        self->out_len += 4;
     }
+    // Same as IOMgr.write_char: the numbers after a char are on the same
+    //  line until the line is ended with '\n'
+    self->is_line_mode = value != '\n';
 }
 
 void LmcIo_writeNum(LmcIoT* self, i32 value) {
-    if(self->is_line_mode) {
-        wprintf(L"%" PRIi32, value);
+    char* dst = _LmcIo_reserve(self, 12);  // "-2147483648\n"
+    char digits[10];
+    usize n_digits = 0;
+    u32 mag = value < 0 ? 0u - (u32)value : (u32)value;
+    do {
+        digits[n_digits++] = (char)('0' + mag % 10);
+        mag /= 10;
+    } while(mag != 0);
+    usize len = 0;
+    if(value < 0) dst[len++] = '-';
+    while(n_digits != 0) dst[len++] = digits[--n_digits];
+    if(!self->is_line_mode) dst[len++] = '\n';
+    self->out_len += len;
+}
+
+// Reads more input (returns false at the end of it)
+static bool _LmcIo_fill(LmcIoT* self) {
+    if(self->in_eof) return false;
+    if(self->in_buf == NULL) {
+        self->in_buf = (char*)malloc(LMC_IO_BUF_SIZE);
+        LmcAssert_FATAL2(self->in_buf != NULL, "Out of memory");
+    }
+    LmcIo_flush(self);  // show the output (e.g. the prompt) before waiting for input
+    if(_LMC_IO_ISATTY(self->in)) {
+        // (fread would wait for the whole buffer to be filled)
+        self->in_len = fgets(self->in_buf, LMC_IO_BUF_SIZE, self->in) != NULL
+            ? strlen(self->in_buf) : 0;
     } else {
-        wprintf(L"%" PRIi32 L"\n", value);
+        self->in_len = fread(self->in_buf, 1, LMC_IO_BUF_SIZE, self->in);
     }
+    self->in_pos = 0;
+    self->in_eof = self->in_len == 0;
+    return !self->in_eof;
 }
 
-void _LmcIo_wstdinConsumeSpaces() {
-    // There is a reason for size=8: this will be 8*16=128 bits (wchar_t = 16 bits on MSVC) 
-    //   or 8*32=256 bits (wchar_t = 8 bits on gcc) so this will fits exactly into an XMM/YMM register
-    wchar_t dummy_buf[8];  // so that we can use the return value of wscanf
-    for(;;) {
-        switch(wscanf(L"%7l[ \t\f]", dummy_buf)) {
-            case EOF: {
-                LmcAssert_UNREACHABLE1("End of stding reached, aborting");
-            } case 0: {
-                // Consumed <7 chars of whitespace so must be end of whitespace
-                return;
-            } case 1: {
-                // Filled up all 7 chars so continue
-                continue;
-            } default: {
-                LmcAssert_UNREACHABLE0();
-            }
-        }
-    }
+// The next byte of the input (without consuming it), -1 at the end
+static inline int _LmcIo_peek(LmcIoT* self) {
+    if(self->in_pos == self->in_len && !_LmcIo_fill(self)) return -1;
+    return (unsigned char)self->in_buf[self->in_pos];
 }
-void _LmcIo_wstdinConsumeLine() {
-    wchar_t dummy_buf[8];  // so that we can use the return value of wscanf
-    for(;;) {
-        switch (wscanf(L"%7l[^\n]", dummy_buf)) {
-            case EOF: {
-                LmcAssert_UNREACHABLE1("End of string reached, aborting");
-            } case 0: {
-                return;  // filled <7 chars; return
-            } case 1: {
-                continue;  // filled up all 7 chars
-            } default: {
-                LmcAssert_UNREACHABLE0();
-            }
-        }
+
+static inline bool _LmcIo_isSpace(int c) {
+    return c == ' ' || c == '\t' || c == '\f' || c == '\v' || c == '\r';
+}
+
+// Skips to the start of the next line
+static void _LmcIo_skipLine(LmcIoT* self) {
+    int c;
+    while((c = _LmcIo_peek(self)) >= 0) {
+        ++self->in_pos;
+        if(c == '\n') return;
     }
 }
 
-i32 LmcIo_readNum(LmcIoT* self) {
-    i32 ival;
-    // I really hope this works - IO + strings in C is a MESS
+// Returns false (without setting `*out`) if the input ran out.
+// Each input is a (base 10) integer on its own line, blank lines are skipped.
+bool LmcIo_tryReadNum(LmcIoT* self, i32* out) {
     for(;;) {
-        if(self->addPromptS) { wprintf(L">? "); }
-        _LmcIo_wstdinConsumeSpaces();
-        int nargs_i = wscanf(L"%" SCNi32, &ival);
-        LmcAssert_FATAL2(nargs_i != EOF, "End of stding reached, aborting");
-        if(nargs_i == 0) {
-            _LmcIo_wstdinConsumeLine();
-            wprintf(L"Input must be an integer\n");
+        if(self->addPromptS) { _LmcIo_writeStr(self, ">? "); }
+        int c;
+        while(_LmcIo_isSpace(c = _LmcIo_peek(self)) || c == '\n') ++self->in_pos;
+        if(c < 0) return false;
+        bool is_neg = c == '-';
+        if(c == '-' || c == '+') {
+            ++self->in_pos;
+            c = _LmcIo_peek(self);
+        }
+        bool has_digits = false;
+        u64 mag = 0;
+        for(; c >= '0' && c <= '9'; c = _LmcIo_peek(self)) {
+            has_digits = true;
+            if(mag <= (u64)INT32_MAX + 1) mag = mag * 10 + (u64)(c - '0');
+            ++self->in_pos;
+        }
+        while(_LmcIo_isSpace(c)) {
+            ++self->in_pos;
+            c = _LmcIo_peek(self);
+        }
+        if(!has_digits || (c >= 0 && c != '\n')) {
+            _LmcIo_skipLine(self);
+            _LmcIo_writeStr(self, "Input must be an integer\n");
             continue;
         }
-        _LmcIo_wstdinConsumeSpaces();
-        wint_t next_char = getwchar();
-        LmcAssert_FATAL2(next_char != WEOF, "End of stdin reached, aborting");
-        if((wchar_t)next_char == L'\n') {
-            // End of line after the number so allow
-            return ival;
+        if(c == '\n') ++self->in_pos;
+        if(mag > (is_neg ? (u64)INT32_MAX + 1 : (u64)INT32_MAX)) {
+            _LmcIo_writeStr(self, "Input out of range\n");
+            continue;
         }
-        // More non-space chars that are not part of the number so just consume rest of line
-        _LmcIo_wstdinConsumeLine();
-        wprintf(L"Input must be an integer32\n");
+        *out = is_neg ? (i32)(0u - (u32)mag) : (i32)mag;
+        return true;
     }
 }
 
+i32 LmcIo_readNum(LmcIoT* self) {
+    i32 ival;
+    LmcAssert_FATAL2(LmcIo_tryReadNum(self, &ival), "End of stdin reached, aborting");
+    return ival;
+}
+
 #endif
@@ -36,19 +36,16 @@ LmcMemT LmcMem_createCopyBuf(i32* srcbuf, usize srclen) {
     return self;
 }
 LmcMemT LmcMem_createCopyResize(i32* srcbuf, usize srclen, usize newlen) {
-    if(srclen == newlen) return LmcMem_createCopyBuf(srcbuf, newlen);
-    // Only copy newlen of srcbuf
-    if(srclen > newlen) return LmcMem_createCopyBuf(srcbuf, newlen);
-    LmcAssert_FATALX(newlen > srclen);
-    // Here, we need to copy into the first half, then memset(0) the 2nd half
+    // Only copy newlen of srcbuf (if it's longer)
+    // (one path for all the cases, gcc -O3 warns about reading too much
+    //  from small arrays in the ones that can't happen)
+    usize ncopy = srclen < newlen ? srclen : newlen;
     i32* newbuf = (i32*)malloc(newlen * sizeof(i32));
-    memcpy(newbuf, srcbuf, srclen * sizeof(i32));
-    // 0 1 ... srclen-1 | srclen srlen+1 ... newlen-1
-    // <----------------+-newlen-------------------->
-    // <----srclen----> | <----(newlen - srclen)---->
-    i32* newbuf_zeroes_start = &newbuf[srclen];
-    usize nzeroes = newlen - srclen;
-    memset(newbuf_zeroes_start, 0, nzeroes * sizeof(i32));
+    memcpy(newbuf, srcbuf, ncopy * sizeof(i32));
+    // 0 1 ... ncopy-1 | ncopy ncopy+1 ... newlen-1
+    // <---------------+-newlen------------------->
+    // <----ncopy----> | <----(newlen - ncopy)---->
+    memset(&newbuf[ncopy], 0, (newlen - ncopy) * sizeof(i32));
     return LmcMem_fromBuf(newbuf, newlen);
 }
 
@@ -61,11 +58,12 @@ void LmcMem_copyFrom(LmcMemT* self, const i32* src_buf, usize src_sz) {
     memcpy(self->mem_ptr, src_buf, nbytes);
 }
 
-inline i32 LmcMem_get(const LmcMemT* self, usize i) {
+// static so that gcc/clang don't need an extern definition when they don't inline it
+static inline i32 LmcMem_get(const LmcMemT* self, usize i) {
     LmcAssert_FATAL2(i < self->len, "Cannot get memory; index out of range");
     return self->mem_ptr[i];
 }
-inline void LmcMem_set(LmcMemT* self, usize i, i32 v) {
+static inline void LmcMem_set(LmcMemT* self, usize i, i32 v) {
     LmcAssert_FATAL2(i < self->len, "Cannot set memory; index out of range");
     self->mem_ptr[i] = v;
 }
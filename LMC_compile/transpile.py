@@ -0,0 +1,311 @@
+"""Ahead-of-time LMC to C transpiler: turns a parsed program (``AsmParser``
+output) into a C file that is then compiled into an executable or shared
+library using the C runtime (see ``compile_program``)::
+
+    python -m LMC_compile.transpile prog.lmc
+
+The program is for the InterpB2 machine (32-bit words, see
+instruction_format_b2.md). Each address that can be run becomes a label
+(``L<addr>``) with the instruction's C code after it so nothing is decoded
+when it runs: branches are ``goto``-s and the operands are constants.
+The address it starts at (``ip``) is looked up in a table of label
+addresses (computed goto, or a ``switch`` if the compiler doesn't have it).
+
+The C code is only right as long as the code isn't changed so a ``STA``
+to an address that can be run carries on using the normal interpreter
+(``LmcInterp_runToEnd``) after the store. Anything that would be an error
+(e.g. OOB addresses) is also left to the interpreter so it reports it."""
+from __future__ import annotations
+
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from LMC_interp.compiled import CompiledProgram
+from LMC_interp.disassemble import B2_OPCODE_SHIFT, B2_OPERAND_MASK, decode_b2
+from LMC_interp.interp_b2_quick_and_dirty import InterpB2, MEM_SIZE_DEFAULT
+
+if TYPE_CHECKING:
+    from LMC_interp.parse_asm import AsmParser
+
+__all__ = ['transpile', 'compile_program']
+
+_HEADER = r'''// Generated by LMC_compile.transpile, don't edit
+#include <stdbool.h>
+
+#include "lmc_runtime_lib/lmc_interp.h"
+
+#ifndef LMC_PROMPT
+#define LMC_PROMPT 1
+#endif
+#if defined(__GNUC__) && !defined(LMC_NO_COMPUTED_GOTO)
+#define LMC_COMPUTED_GOTO 1
+#else
+#define LMC_COMPUTED_GOTO 0
+#endif
+#if defined(_WIN32)
+#define LMC_EXPORT __declspec(dllexport)
+#else
+#define LMC_EXPORT __attribute__((visibility("default")))
+#endif
+'''
+
+_RUN_DOC = '''\
+// Runs the program from `self->ip` until it halts (returns LmcStop_HALTED)
+// or there is an error (LmcStop_INP if the input ran out), the output is
+// flushed when it returns. `self` must have the memory from LMC_PROGRAM
+// (with the code unchanged). Only the fallback to LmcInterp_runToEnd()
+// fills in `dirty_map`.'''
+
+_MAIN = r'''
+// abort()s if there is an error (like LmcInterp_main)
+LMC_EXPORT int LmcCompiled_main(void) {
+    LmcInterpT lmc = LmcInterp_createCopyResize(
+        LMC_PROGRAM, LMC_PROGRAM_LEN, LMC_MEM_SIZE, LMC_PROMPT);
+    LmcStopT why = LmcCompiled_run(&lmc);
+    LmcIo_destroy(&lmc.io);
+    LmcAssert_FATALX(why == LmcStop_HALTED, LmcStop_describe(why));
+    return 0;
+}
+
+#ifndef LMC_NO_MAIN
+int main(void) {
+    return LmcCompiled_main();
+}
+#endif
+'''
+
+_BRANCH_CONDS = {6: None, 7: 'acc == 0', 8: '(i32)acc >= 0'}
+"""The condition for each branch opcode (None: always)"""
+
+
+def _split(word: int) -> tuple[int, int]:
+    """(opcode, operand), the opcode is -1 for invalid words"""
+    if not 0 <= word < (10 << B2_OPCODE_SHIFT):
+        return -1, 0
+    return word >> B2_OPCODE_SHIFT, word & B2_OPERAND_MASK
+
+
+def _successors(addr: int, word: int, mem_size: int,
+                extensions: bool) -> list[int] | None:
+    """The addresses it can go to next (None: it isn't compiled,
+    it's left to the interpreter)"""
+    opcode, operand = _split(word)
+    if opcode == 0:
+        return []
+    if opcode in (1, 2, 3, 5):
+        return [addr + 1] if operand < mem_size else None
+    if opcode in _BRANCH_CONDS:
+        if operand >= mem_size:
+            return None
+        return [operand] if opcode == 6 else [operand, addr + 1]
+    if opcode == 9 and (operand in (1, 2) or (operand == 22 and extensions)):
+        return [addr + 1]
+    return None
+
+
+def _find_code(words: list[int], mem_size: int, extensions: bool) -> list[int]:
+    """The addresses that can be run (starting at 0), sorted"""
+    code: set[int] = set()
+    todo = [0]
+    while todo:
+        addr = todo.pop()
+        if addr in code or addr >= mem_size:
+            continue
+        code.add(addr)
+        word = words[addr] if addr < len(words) else 0
+        todo += _successors(addr, word, mem_size, extensions) or ()
+    return sorted(code)
+
+
+def _instr_code(addr: int, word: int, mem_size: int, extensions: bool,
+                code: set[int]) -> tuple[str, bool]:
+    """(C code, whether it carries on to ``addr + 1``)"""
+    if _successors(addr, word, mem_size, extensions) is None:
+        return f'ip = {addr}; goto generic;', False
+    opcode, operand = _split(word)
+    match opcode:
+        case 0:
+            return f'++n; ip = {addr + 1}; goto halted;', False
+        case 1:
+            return f'++n; acc += (u32)mem[{operand}];', True
+        case 2:
+            return f'++n; acc -= (u32)mem[{operand}];', True
+        case 3:
+            if operand in code:  # self-modifying code
+                return (f'++n; mem[{operand}] = (i32)acc; '
+                        f'ip = {addr + 1}; goto generic;'), False
+            return f'++n; mem[{operand}] = (i32)acc;', True
+        case 5:
+            return f'++n; acc = (u32)mem[{operand}];', True
+        case 6:
+            return f'++n; goto L{operand};', False
+        case 7 | 8:
+            return f'++n; if({_BRANCH_CONDS[opcode]}) goto L{operand};', True
+    # 9: IO
+    if operand == 1:
+        return (f'if(!LmcIo_tryReadNum(&self->io, &input)) {{ ip = {addr}; goto no_input; }} '
+                f'++n; acc = (u32)input;'), True
+    if operand == 2:
+        return '++n; LmcIo_writeNum(&self->io, (i32)acc);', True
+    return '++n; LmcIo_writeChar(&self->io, (i32)acc);', True
+
+
+def _describe(addr: int, word: int, entry: tuple[str, int | None] | None,
+              source_map: tuple[int, ...]) -> str:
+    if entry is None:
+        text = f'DAT {word}'
+    else:
+        text = entry[0] if entry[1] is None else f'{entry[0]} {entry[1]}'
+    if addr < len(source_map) and source_map[addr]:
+        return f'{addr}: {text} (line {source_map[addr]})'
+    return f'{addr}: {text}'
+
+
+def transpile(prog: AsmParser | CompiledProgram,
+              mem_size: int = MEM_SIZE_DEFAULT) -> str:
+    """The C code for the program (``AsmParser`` that has been parsed).
+    ``mem_size`` is the number of cells, like ``InterpB2(mem_size=...)``."""
+    if not isinstance(prog, CompiledProgram):
+        prog = CompiledProgram.from_parser(prog)
+    words = InterpB2._compiled_to_b2(prog)
+    lo, hi = InterpB2.value_range
+    if not all(lo <= w <= hi for w in words):
+        raise ValueError("The C runtime only supports 32-bit values "
+                         "(the program has a DAT that is too big)")
+    if len(words) > mem_size:
+        raise ValueError(f"The program ({len(words)} cells) doesn't "
+                         f"fit in the memory ({mem_size} cells)")
+    extensions = prog.extensions
+    code = _find_code(words, mem_size, extensions)
+    code_set = set(code)
+    decoded = decode_b2([words[a] if a < len(words) else 0 for a in code],
+                        extensions, mem_size)
+    image = words or [0]  # (C doesn't allow empty arrays)
+    out = [_HEADER,
+           f'#define LMC_PROGRAM_LEN {len(image)}',
+           f'#define LMC_MEM_SIZE {mem_size}',
+           '',
+           'static i32 LMC_PROGRAM[LMC_PROGRAM_LEN] = {']
+    out += [f'    {w},' for w in image]
+    out += ['};', '', _RUN_DOC,
+            'LMC_EXPORT LmcStopT LmcCompiled_run(LmcInterpT* self) {',
+            '    i32* const mem = self->mem.mem_ptr;',
+            '    usize ip = self->ip;',
+            '    u32 acc = (u32)self->acc;  // unsigned so that it wraps',
+            '    u64 n = self->n_instr;',
+            '    i32 input;',
+            '    (void)mem; (void)input;',
+            '    if(self->is_halted) return LmcStop_HALTED;',
+            '    if(self->mem.len != LMC_MEM_SIZE) goto generic;',
+            '#if LMC_COMPUTED_GOTO',
+            f'    static void* const ENTRY[{code[-1] + 1 if code else 1}] = {{']
+    out += [f'        [{a}] = &&L{a},' for a in code]
+    out += ['    };',
+            '    if(ip < sizeof(ENTRY) / sizeof(ENTRY[0]) && ENTRY[ip] != NULL) goto *ENTRY[ip];',
+            '#else',
+            '    switch(ip) {']
+    out += [f'        case {a}: goto L{a};' for a in code]
+    out += ['        default: break;',
+            '    }',
+            '#endif',
+            '    goto generic;']
+    uses_halted = uses_input = False
+    for i, (addr, entry) in enumerate(zip(code, decoded)):
+        word = words[addr] if addr < len(words) else 0
+        c_code, falls_through = _instr_code(addr, word, mem_size, extensions, code_set)
+        uses_halted |= c_code.endswith('goto halted;')
+        uses_input |= 'goto no_input;' in c_code
+        out.append(f'L{addr}: {c_code}  // {_describe(addr, word, entry, prog.source_map)}')
+        next_addr = code[i + 1] if i + 1 < len(code) else None
+        if falls_through and next_addr != addr + 1:
+            if addr + 1 < mem_size:
+                out.append(f'    goto L{addr + 1};')
+            else:  # (the interpreter reports it)
+                out.append(f'    ip = {addr + 1}; goto generic;')
+    if uses_halted:
+        out += ['halted:',
+                '    LmcIo_flush(&self->io);',
+                '    self->is_halted = true;',
+                '    self->ip = ip;',
+                '    self->acc = (i32)acc;',
+                '    self->n_instr = n;',
+                '    return LmcStop_HALTED;']
+    if uses_input:
+        out += ['no_input:',
+                '    LmcIo_flush(&self->io);',
+                '    self->ip = ip;',
+                '    self->acc = (i32)acc;',
+                '    self->n_instr = n;',
+                '    return LmcStop_INP;']
+    out += ['generic:',
+            '    self->ip = ip;',
+            '    self->acc = (i32)acc;',
+            '    self->n_instr = n;',
+            '    return LmcInterp_runToEnd(self);',
+            '}',
+            _MAIN]
+    return '\n'.join(out)
+
+
+def compile_program(prog: AsmParser | CompiledProgram, name: str,
+                    shared=False, debug=False, verbose=False, prompt=True,
+                    mem_size: int = MEM_SIZE_DEFAULT) -> Path:
+    """Transpile the program and compile it into an executable (or
+    a shared library that exports ``LmcCompiled_run`` and
+    ``LmcCompiled_main``) in ``out/{release,debug}/transpiled``.
+    ``prompt`` writes ``>? `` before each input. Returns its path."""
+    from LMC_compile.compile import LmcRtCompiler, ccompiler
+    name = Path(name).stem
+    mode = 'debug' if debug else 'release'
+    here = Path(__file__).parent
+    out_dir = here / 'out' / mode / 'transpiled'
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / f'{name}.c').write_text(transpile(prog, mem_size))
+    cc = ccompiler.new_compiler()
+    macros: list[tuple[str, str | None]] = [] if prompt else [('LMC_PROMPT', '0')]
+    if shared:
+        out_file = cc.library_filename(name, 'shared')
+        out_type = ccompiler.CCompiler.SHARED_OBJECT
+        macros.append(('LMC_NO_MAIN', None))
+    else:
+        out_file = cc.executable_filename(name)
+        out_type = ccompiler.CCompiler.EXECUTABLE
+    LmcRtCompiler([f'out/{mode}/transpiled/{name}.c'], debug, verbose,
+                  out_file, out_type, macros, include_dirs=['.'],
+                  out_dir=out_dir).run()
+    return out_dir / out_file
+
+
+def main(argv: list[str] = None):
+    if argv is None:
+        argv = sys.argv[1:]
+    import argparse
+    from LMC_interp.compiled import compile_file
+    p = argparse.ArgumentParser('python -m LMC_compile.transpile',
+                                description="Compile an LMC program (for InterpB2) into C")
+    p.add_argument('path', help="the program (.lmc)")
+    p.add_argument('-c', '--emit-c', action='store_true',
+                   help="write the C code to stdout instead of compiling it")
+    p.add_argument('-s', '--shared', action='store_true',
+                   help="make a shared library instead of an executable")
+    p.add_argument('-d', '--debug', action='store_true',
+                   help="Disable optimisations")
+    p.add_argument('--no-prompt', action='store_true',
+                   help="don't write '>? ' before each input")
+    p.add_argument('--no-extensions', action='store_true',
+                   help="disable the non-standard OTC instruction")
+    p.add_argument('--mem-size', type=int, default=MEM_SIZE_DEFAULT)
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help="Be VERY verbose")
+    args = p.parse_args(argv)
+    prog = compile_file(args.path, not args.no_extensions)
+    if args.emit_c:
+        sys.stdout.write(transpile(prog, args.mem_size))
+        return
+    print(compile_program(prog, args.path, args.shared, args.debug,
+                          args.verbose, not args.no_prompt, args.mem_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Command line interface::
+
+    python -m LMC_interp run prog.lmc [INPUT ...]
+    python -m LMC_interp disasm image.bin
+
+The inputs come from the arguments if there are any, otherwise they are
+read from stdin (all at once if it is a file/pipe or one at a time with
+a prompt if it is a terminal). The parsed program is cached on disk (see
+``LMC_interp.compiled``) so running the same program again doesn't parse it.
+
+This is often run once per job so the start-up time matters: only the
+modules that are needed are imported and only when they are needed
+(check with ``python -X importtime -m LMC_interp run ...``)."""
+from __future__ import annotations
+
+import sys
+
+# Don't import anything else from LMC_interp here (see above)
+
+MACHINES = ('b10', 'b2')
+
+
+def _make_arg_parser():
+    import argparse
+    from LMC_interp.engines import ENGINES, ENGINE_FDE
+    parser = argparse.ArgumentParser(
+        prog='python -m LMC_interp', description="Little Man Computer tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run a program")
+    run.add_argument('path', help="the program (.lmc source or .lmco)")
+    run.add_argument('inputs', nargs='*', type=int, metavar='INPUT',
+                     help="the inputs (read from stdin if there are none)")
+    run.add_argument('-m', '--machine', choices=MACHINES, default='b10',
+                     help="b10: the standard 100 cell LMC (default), "
+                          "b2: InterpB2 (32-bit words, 65536 cells)")
+    run.add_argument('-e', '--engine', choices=sorted(ENGINES),
+                     default=ENGINE_FDE)
+    run.add_argument('--wrap-memory', action='store_true',
+                     help="wrap addresses around instead of raising")
+    run.add_argument('--no-wrap-values', action='store_true',
+                     help="raise if a value is out of range (b10 only)")
+    run.add_argument('--no-extensions', action='store_true',
+                     help="disable the non-standard OTC instruction")
+    run.add_argument('--append-hlt', action='store_true',
+                     help="add a HLT to the end of the program")
+    run.add_argument('-O', '--optimize', action='store_true',
+                     help="run the optimizer on the program first")
+    run.add_argument('--no-cache', action='store_true',
+                     help="don't use the cache of parsed programs")
+    run.add_argument('--stats', action='store_true',
+                     help="print the number of instructions run to stderr")
+    run.set_defaults(func=cmd_run)
+    disasm = commands.add_parser(
+        'disasm', help="disassemble an InterpB2 memory image (or a .lmco)")
+    disasm.add_argument('path', help="the image (see InterpB2.save_image) or .lmco")
+    disasm.add_argument('-o', '--output', help="write it here instead of stdout")
+    disasm.add_argument('--no-extensions', action='store_true',
+                        help="OTC is data (so it can be parsed without extensions)")
+    disasm.add_argument('--no-trim', action='store_true',
+                        help="also write the zeroes at the end")
+    disasm.add_argument('--no-addresses', action='store_true',
+                        help="don't add the address of each line as a comment")
+    disasm.set_defaults(func=cmd_disasm)
+    return parser
+
+
+def cmd_run(args) -> int:
+    from LMC_interp.errors import LMCError
+    try:
+        prog = _load_program(args)
+        try:
+            interp = _make_interp(args, prog)
+        except ValueError as e:  # invalid combination of options
+            print(f'Error: {e}', file=sys.stderr)
+            return 2
+        _setup_io(args, interp)
+        try:
+            interp.run()
+        finally:
+            interp.io.flush()
+    except (LMCError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    if args.stats:
+        print(f'Instructions ran: {interp.n_instr}', file=sys.stderr)
+    return 0
+
+
+def cmd_disasm(args) -> int:
+    from LMC_interp.disassemble import disassemble, disassemble_image
+    from LMC_interp.errors import LMCError
+    extensions = not args.no_extensions
+    options = dict(trim=not args.no_trim, addresses=not args.no_addresses)
+    try:
+        if args.path.endswith('.lmco'):
+            from LMC_interp.compiled import CompiledProgram
+            prog = CompiledProgram.load(args.path)
+            text = disassemble(prog.memory, 'b10', extensions and prog.extensions,
+                               **options)
+        else:
+            text = disassemble_image(args.path, extensions, **options)
+        if args.output is None:
+            sys.stdout.write(text)
+        else:
+            with open(args.output, 'w') as f:
+                f.write(text)
+    except (LMCError, OSError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def _load_program(args):
+    from LMC_interp.compiled import CompiledProgram, ProgramCache, compile_source
+    if args.path.endswith('.lmco'):
+        return CompiledProgram.load(args.path)
+    with open(args.path) as f:
+        source = f.read()
+    return compile_source(source, not args.no_extensions, args.append_hlt,
+                          None if args.no_cache else ProgramCache(use_disk=True),
+                          args.optimize)
+
+
+def _make_interp(args, prog):
+    if args.machine == 'b2':
+        if args.no_wrap_values:
+            raise ValueError("--no-wrap-values isn't supported by b2 "
+                             "(its values always wrap)")
+        from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+        return InterpB2.from_compiled(prog, wrap_memory=args.wrap_memory,
+                                      engine=args.engine)
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    return InterpreterB10.from_compiled(
+        prog, wrap_memory=args.wrap_memory,
+        wrap_values=not args.no_wrap_values, engine=args.engine)
+
+
+def _setup_io(args, interp):
+    from LMC_interp.io_mgr import IOMgr
+    from LMC_interp.io_sinks import BufferedTextSink
+    source = None
+    if args.inputs:
+        from LMC_interp.io_sources import ArraySource
+        source = ArraySource(args.inputs)
+    elif not sys.stdin.isatty():
+        from LMC_interp.io_sources import StreamIntSource
+        source = StreamIntSource(getattr(sys.stdin, 'buffer', sys.stdin))
+    interp.io = IOMgr(interp, BufferedTextSink(), source)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _make_arg_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
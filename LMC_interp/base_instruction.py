@@ -19,6 +19,11 @@ class Instruction:
     def is_valid(self):
         return self.is_valid_cls
 
+    def get_runnable(self) -> Instruction:
+        """Returns the instruction that actually gets run, resolving any
+        dispatch on the operand (e.g. 9xx -> INP/OUT/OTC) ahead of time"""
+        return self
+
     @classmethod
     def get_canonical_forms(cls) -> set[int] | None:
         """Returns the `b10op`s corresponding to the valid and useful forms of
@@ -85,6 +90,18 @@ class Instruction:
     @classmethod
     def get_instr(cls, op: int) -> Instruction:
         return cls.get_instr_cls(op).from_b10_int(op)
+
+    @classmethod
+    def get_runnable_shared(cls, op: int) -> Instruction:
+        """Same as ``get_instr(op).get_runnable()`` but returns the same
+        instance every time so that nothing is allocated when running
+        an instruction (so instructions mustn't be modified in ``run()``)"""
+        instr = _SHARED_RUNNABLE.get(op)
+        if instr is None:
+            instr = cls.get_instr(op).get_runnable()
+            if 0 <= op < 1000:  # the rest are invalid, don't fill it with them
+                _SHARED_RUNNABLE[op] = instr
+        return instr
     # } </NOT FOR OVERLOADING>
 
 
@@ -153,11 +170,15 @@ class InstrFixedOperand(Instruction, ABC):
 
 
 INSTR_DISPATCH: dict[int, type[Instruction]] = {}
+_SHARED_RUNNABLE: dict[int, Instruction] = {}
+"""Cache for ``Instruction.get_runnable_shared``, cleared when an
+instruction is registered"""
 
 
 def _register_instr(cls: type[Instruction], opcode: int = None):
     b10_opcode = opcode if opcode is not None else cls.get_b10_opcode()
     INSTR_DISPATCH[b10_opcode] = cls
+    _SHARED_RUNNABLE.clear()
     return cls
 
 
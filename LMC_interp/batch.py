@@ -0,0 +1,61 @@
+"""Running one program many times with different inputs.
+
+The program is only parsed/prepared once and the interpreter is restored
+to a snapshot of the pristine state before each run (which only copies back
+the memory cells that the previous run wrote to)."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, TYPE_CHECKING, TypeVar
+
+from LMC_interp.io_mgr import ListIOMgr
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+_InterpT = TypeVar('_InterpT', 'InterpreterB10', 'InterpB2')
+
+
+@dataclass
+class BatchResult:
+    output: str
+    """Everything that the program output (as it would've been printed)"""
+    n_instr: int
+    """Number of instructions executed"""
+    error: Exception | None = None
+    """The error raised by the program (None if it halted normally)"""
+
+
+def run_batch(cls: type[_InterpT], program: str | list[int],
+              inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+    """Run ``program`` (source code or a memory image) once for each
+    input vector in ``inputs``. The ``kwargs`` are passed to ``from_source``
+    (or the constructor for a memory image)."""
+    return run_batch_on(make_interp(cls, program, **kwargs), inputs)
+
+
+def make_interp(cls: type[_InterpT], program: str | list[int],
+                **kwargs) -> _InterpT:
+    if isinstance(program, str):
+        return cls.from_source(program, **kwargs)
+    return cls(list(program), **kwargs)
+
+
+def run_batch_on(interp: _InterpT,
+                 inputs: Iterable[Iterable[int]]) -> list[BatchResult]:
+    """Run the program already loaded into ``interp`` once for each input
+    vector (``interp``'s state is overwritten)"""
+    interp.reset()
+    pristine = interp.snapshot()
+    results = []
+    for run_inputs in inputs:
+        interp.restore(pristine)
+        io = interp.io = ListIOMgr(interp, run_inputs)
+        error = None
+        try:
+            interp.run()
+        except Exception as e:
+            error = e
+        results.append(BatchResult(io.output, interp.n_instr, error))
+    return results
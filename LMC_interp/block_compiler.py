@@ -0,0 +1,370 @@
+"""Basic-block compiler (``engine='block'``).
+
+The program is split into basic blocks using the branch targets of
+BRA/BRZ/BRP. Each block is turned into a Python function (with the
+accumulator in a local variable and memory accesses as direct list
+indexing) that returns the next ip and the new accumulator.
+
+Only the straight-line instructions (ADD, SUB, STA, LDA and branches) are
+compiled, everything else (HLT, I/O, anything that would raise, ...) is run
+by the interpreter itself, one step at a time. STAs that could write into
+compiled code are also left to the interpreter. When the interpreter does
+write into a compiled block, that block is dropped and its instructions
+are interpreted from then on, so self-modifying code is still correct.
+
+The generated code is cached in memory keyed by a hash of the memory image
+and the interpreter config so the codegen cost is only paid once per
+program. It can also be cached on disk (``USE_DISK_CACHE``, see
+``LMC_interp.cache_utils``) but that is off by default as the cached code
+objects are loaded and run as they are."""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import marshal
+import os
+from array import array
+from collections import OrderedDict
+from typing import Callable, TypeAlias, TYPE_CHECKING
+
+from LMC_interp.base_instruction import INSTR_DISPATCH
+from LMC_interp.cache_utils import (
+    get_cache_dir, read_cache_file, write_cache_file)
+from LMC_interp.engines import EngineState
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+    InterpT: TypeAlias = InterpreterB10 | InterpB2
+
+BlockFnT: TypeAlias = Callable[[int, list[int]], tuple[int, int]]
+
+# Bump this when the generated code changes
+CODEGEN_VERSION = 3
+MEMO_SIZE = 16
+"""How many compiled programs to keep in memory"""
+USE_DISK_CACHE = False
+"""Also cache the generated code on disk (only enable this if nobody else
+can write to the cache directory)"""
+
+_BRANCH_OPCODES = frozenset({6, 7, 8})
+_SIMPLE_OPCODES = frozenset({1, 2, 3, 5, 6, 7, 8})
+
+
+class BlockProgram:
+    def __init__(self, blocks: dict[int, tuple[BlockFnT, int]],
+                 stores: frozenset[int] = frozenset()):
+        self.blocks = blocks
+        """leader -> (function, number of instructions)"""
+        self.stores = stores
+        """Addresses that the blocks can store to (for ``dirty_cells``)"""
+
+
+class BlockCompiler:
+    def __init__(self, interp: InterpT, entry: int = 0):
+        self.memory = interp.memory
+        self.size = len(self.memory)
+        self.split_word = interp.split_word
+        self.wrap_memory = interp.wrap_memory
+        self.wrap_values = interp.wrap_values
+        self.value_lo = interp.value_range[0]
+        self.value_mod = interp.value_range[1] - self.value_lo + 1
+        self.entry = entry
+        self.decoded: dict[int, tuple[int, int] | None] = {}
+        """addr -> (opcode, resolved operand) for reachable cells.
+        None if the cell can't be compiled."""
+        self.leaders: set[int] = set()
+        self.blocks: dict[int, list[int]] = {}
+
+    def compile(self) -> str:
+        """Returns the source code of a module defining ``BLOCKS``
+        (see ``BlockProgram.blocks``)"""
+        self.find_reachable()
+        self.mark_unsafe_stores()
+        self.find_blocks()
+        return self.generate_source()
+
+    # region analysis
+    def _resolve_addr(self, operand: int) -> int | None:
+        if 0 <= operand < self.size:
+            return operand
+        if self.wrap_memory:
+            return operand % self.size
+        return None  # this would raise
+
+    def _next_addr(self, addr: int) -> int | None:
+        if addr + 1 < self.size:
+            return addr + 1
+        return 0 if self.wrap_memory else None
+
+    def _decode_cell(self, addr: int) -> tuple[tuple[int, int] | None, list[int]]:
+        """Returns (compilable (opcode, addr) or None, successors)"""
+        nxt = self._next_addr(addr)
+        nxt_ls = [] if nxt is None else [nxt]
+        split = self.split_word(self.memory[addr])
+        if split is None:
+            # Probably raises but could be a custom instruction so assume
+            # it continues to the next one (if it doesn't, it'll just run
+            # in the interpreter until it gets to the start of a block)
+            return None, nxt_ls
+        opcode, operand = split
+        if opcode == 9:
+            return None, nxt_ls
+        if opcode not in _SIMPLE_OPCODES:
+            return None, []  # HLT or invalid
+        target = self._resolve_addr(operand)
+        if target is None:
+            return None, []  # this raises
+        if opcode == 6:
+            return (opcode, target), [target]
+        if opcode in _BRANCH_OPCODES:
+            return (opcode, target), nxt_ls + [target]
+        return (opcode, target), nxt_ls
+
+    def find_reachable(self):
+        self.leaders.add(self.entry)
+        todo = [self.entry]
+        while todo:
+            addr = todo.pop()
+            if addr in self.decoded:
+                continue
+            decoded, successors = self._decode_cell(addr)
+            self.decoded[addr] = decoded
+            if (decoded is None or decoded[0] in _BRANCH_OPCODES
+                    or addr == self.size - 1):
+                # Everything after a branch/uncompiled cell/wrapping around
+                # needs to be the start of a block
+                self.leaders.update(successors)
+            todo += successors
+
+    def mark_unsafe_stores(self):
+        """Don't compile stores into (potential) code, let the interpreter
+        run them so that it can invalidate the affected block"""
+        for addr, decoded in self.decoded.items():
+            if decoded is not None and decoded[0] == 3 and decoded[1] in self.decoded:
+                self.decoded[addr] = None
+                nxt = self._next_addr(addr)
+                if nxt is not None:
+                    self.leaders.add(nxt)
+
+    def find_blocks(self):
+        for leader in sorted(self.leaders):
+            if self.decoded.get(leader) is None:
+                continue
+            cells = []
+            addr = leader
+            while True:
+                cells.append(addr)
+                if self.decoded[addr][0] in _BRANCH_OPCODES:
+                    break
+                addr += 1
+                if (addr >= self.size or addr in self.leaders
+                        or self.decoded.get(addr) is None):
+                    break
+            self.blocks[leader] = cells
+    # endregion
+
+    # region codegen
+    def _wrap(self, expr: str) -> str:
+        if not self.wrap_values:
+            return expr
+        lo, mod = self.value_lo, self.value_mod
+        return f'({expr} - ({lo})) % {mod} + ({lo})'
+
+    def _gen_cell(self, addr: int) -> list[str]:
+        opcode, target = self.decoded[addr]
+        nxt = self._next_addr(addr)
+        nxt = self.size if nxt is None else nxt
+        match opcode:
+            case 1:
+                return [f'acc = {self._wrap(f"acc + m[{target}]")}']
+            case 2:
+                return [f'acc = {self._wrap(f"acc - m[{target}]")}']
+            case 3:
+                return [f'm[{target}] = acc']
+            case 5:
+                return [f'acc = {self._wrap(f"m[{target}]")}']
+            case 6:
+                return [f'return {target}, acc']
+            case 7:
+                return [f'if acc == 0:', f'    return {target}, acc',
+                        f'return {nxt}, acc']
+            case 8:
+                return [f'if acc >= 0:', f'    return {target}, acc',
+                        f'return {nxt}, acc']
+        assert 0, "should be unreachable"
+
+    def _gen_block(self, leader: int, cells: list[int]) -> list[str]:
+        lines = [f'def _b{leader}(acc, m):']
+        for addr in cells:
+            lines += ['    ' + ln for ln in self._gen_cell(addr)]
+        last = cells[-1]
+        if self.decoded[last][0] not in _BRANCH_OPCODES:
+            nxt = self._next_addr(last)
+            lines.append(f'    return {self.size if nxt is None else nxt}, acc')
+        return lines
+
+    def generate_source(self) -> str:
+        lines = ['# Generated by LMC_interp.block_compiler']
+        for leader, cells in self.blocks.items():
+            lines += self._gen_block(leader, cells)
+        lines.append('BLOCKS = {')
+        lines += [f'    {leader}: (_b{leader}, {len(cells)}),'
+                  for leader, cells in self.blocks.items()]
+        lines.append('}')
+        stores = sorted({self.decoded[addr][1]
+                         for cells in self.blocks.values() for addr in cells
+                         if self.decoded[addr][0] == 3})
+        lines.append(f'STORES = frozenset({stores})')
+        return '\n'.join(lines) + '\n'
+    # endregion
+
+
+# region caching
+_memo: OrderedDict[str, BlockProgram] = OrderedDict()
+
+
+def _memory_bytes(memory) -> bytes:
+    if isinstance(memory, array):
+        return memory.tobytes()
+    try:
+        return array('q', memory).tobytes()
+    except OverflowError:  # (only possible with wrap_values=False)
+        return repr(memory).encode()
+
+
+def get_cache_key(interp: InterpT, entry: int) -> str:
+    h = hashlib.sha256()
+    config = (CODEGEN_VERSION, importlib.util.MAGIC_NUMBER,
+              type(interp).__qualname__, tuple(interp.value_range),
+              len(interp.memory), interp.wrap_memory, interp.wrap_values,
+              interp.ext_otc__enabled(), entry,
+              # in case any custom instructions have been registered
+              sorted((k, v.__module__, v.__qualname__)
+                     for k, v in INSTR_DISPATCH.items()))
+    h.update(repr(config).encode())
+    h.update(_memory_bytes(interp.memory))
+    return h.hexdigest()
+
+
+def _compile_code(interp: InterpT, entry: int):
+    src = BlockCompiler(interp, entry).compile()
+    return compile(src, '<LMC_interp.block_compiler>', 'exec')
+
+
+def _get_code(interp: InterpT, entry: int, key: str):
+    cache_dir = get_cache_dir('blocks') if USE_DISK_CACHE else None
+    if cache_dir is None:
+        return _compile_code(interp, entry)
+    path = os.path.join(cache_dir, f'{key}.bin')
+    if (data := read_cache_file(path)) is not None:
+        try:
+            return marshal.loads(data)
+        except (ValueError, EOFError, TypeError):
+            pass  # corrupted, just regenerate it
+    code = _compile_code(interp, entry)
+    write_cache_file(path, marshal.dumps(code))
+    return code
+
+
+def get_block_program(interp: InterpT, entry: int = 0) -> BlockProgram:
+    key = get_cache_key(interp, entry)
+    if (prog := _memo.get(key)) is not None:
+        _memo.move_to_end(key)
+        return prog
+    namespace = {}
+    exec(_get_code(interp, entry, key), namespace)
+    prog = _memo[key] = BlockProgram(namespace['BLOCKS'],
+                                     namespace['STORES'])
+    if len(_memo) > MEMO_SIZE:
+        _memo.popitem(last=False)
+    return prog
+# endregion
+
+
+class BlockState(EngineState):
+    """The blocks of a ``BlockProgram`` laid out by address, kept between
+    runs (blocks that are written to are dropped from ``fns``)"""
+    def __init__(self, interp: InterpT, prog: BlockProgram):
+        super().__init__(interp)
+        size = len(self.memory)
+        self.stores = prog.stores
+        self.fns: list[BlockFnT | None] = [None] * (size + 1)
+        self.lengths = [0] * (size + 1)
+        self.cell_leader = [-1] * size
+        self.code: dict[int, tuple[int, ...]] = {}
+        """leader -> the words the block was compiled from"""
+        for leader, (fn, length) in prog.blocks.items():
+            self.fns[leader] = fn
+            self.lengths[leader] = length
+            self.cell_leader[leader:leader + length] = [leader] * length
+            self.code[leader] = tuple(self.memory[leader:leader + length])
+
+    def drop_changed(self):
+        """Drop the blocks whose code was changed since the last run
+        (e.g. by ``restore()`` or writing to ``.memory``)"""
+        mem = self.memory
+        for leader, words in self.code.items():
+            if (self.fns[leader] is not None
+                    and tuple(mem[leader:leader + len(words)]) != words):
+                self.fns[leader] = None
+
+
+def _get_state(interp: InterpT) -> BlockState:
+    state = interp._engine_state
+    if state is not None and state.is_valid_for(interp):
+        state.drop_changed()
+        return state
+    size = len(interp.memory)
+    entry = interp.ip % size if interp.wrap_memory else interp.ip
+    prog = get_block_program(interp, entry if 0 <= entry < size else 0)
+    state = interp._engine_state = BlockState(interp, prog)
+    return state
+
+
+def run_block_engine(interp: InterpT, stop_n: int | None = None):
+    mem = interp.memory
+    size = len(mem)
+    state = _get_state(interp)
+    # the blocks don't track their stores so assume they all happen
+    interp.dirty_cells.update(state.stores)
+    fns = state.fns
+    lengths = state.lengths
+    cell_leader = state.cell_leader
+    split_word = interp.split_word
+    wrap_memory = interp.wrap_memory
+    ip = interp.ip
+    acc = interp.acc_internal
+    n = interp.n_instr
+    while True:
+        fn = fns[ip] if 0 <= ip < size else None
+        if fn is not None and (stop_n is None or n + lengths[ip] <= stop_n):
+            new_ip, acc = fn(acc, mem)
+            n += lengths[ip]
+            ip = new_ip
+            continue
+        if stop_n is not None and n >= stop_n:
+            interp.ip = ip
+            interp.acc_internal = acc
+            interp.n_instr = n
+            return
+        # Run one instruction in the interpreter
+        interp.ip = ip
+        interp.acc_internal = acc
+        interp.n_instr = n
+        interp.fetch()
+        split = split_word(interp.cir)
+        if split is not None and split[0] == 3:  # STA
+            target = split[1]
+            if wrap_memory:
+                target %= size
+            if 0 <= target < size and (leader := cell_leader[target]) != -1:
+                fns[leader] = None  # drop back to the interpreter for this
+        interp.decode()
+        interp.execute()
+        if interp.is_halted:
+            return
+        ip = interp.ip
+        acc = interp.acc_internal
+        n = interp.n_instr
@@ -0,0 +1,54 @@
+"""Helpers for the on-disk caches used by LMC_interp.
+
+The cache lives in ``$LMC_CACHE_DIR`` if that is set, otherwise
+``$XDG_CACHE_HOME/LMC_interp`` (``~/.cache/LMC_interp`` by default).
+Setting ``LMC_CACHE_DIR`` to an empty string disables the on-disk caches."""
+from __future__ import annotations
+
+import os
+
+# NOTE: this is used when starting up so it uses os.path instead of
+#  pathlib (and tempfile is only imported when writing) as they are
+#  quite slow to import.
+
+
+def get_cache_dir(subdir: str) -> str | None:
+    """Returns the directory to use for the ``subdir`` cache (which might not
+    exist yet) or None if on-disk caching is disabled."""
+    root = os.environ.get('LMC_CACHE_DIR')
+    if root is None:
+        xdg = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        root = os.path.join(xdg, 'LMC_interp')
+    elif not root:
+        return None
+    return os.path.join(root, subdir)
+
+
+def read_cache_file(path: str) -> bytes | None:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cache_file(path: str, data: bytes) -> bool:
+    """Atomically write ``data`` to ``path`` so that concurrent readers never
+    see a partially written file. Errors are ignored (the cache is just an
+    optimisation) but it returns whether it was successful."""
+    import tempfile
+    try:
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)  # (only for this user)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        return False
+    return True
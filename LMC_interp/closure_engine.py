@@ -0,0 +1,273 @@
+"""Closure-threaded execution engine (``engine='closure'``).
+
+Each memory cell is compiled into a closure with its operand, bounds checks
+and wrapping settings baked in. A closure takes the address it is stored at
+and returns the next ip, so running the program is just
+``ip = handlers[ip](ip)`` in a loop. The accumulator lives in a closure cell
+shared by all the handlers instead of going through the ``acc`` property.
+
+Cells are compiled lazily (the first time they are executed) so that
+InterpB2's big memory doesn't need to be compiled up front. Storing into a
+cell resets its handler so that self-modifying code is recompiled. The
+handlers are kept on the interpreter so resuming the program (e.g.
+``run(max_steps=...)``) or running it again (``run_batch``) doesn't start
+from scratch.
+
+Anything unusual (invalid instructions, out-of-bounds operands without
+wrap_memory, OTC with extensions disabled, ...) is run by doing a single
+fetch-decode-execute step on the interpreter itself so that the errors
+(and the state afterwards) are exactly the same as with ``engine='fde'``."""
+from __future__ import annotations
+
+from typing import Callable, TypeAlias, TYPE_CHECKING
+
+from LMC_interp.engines import EngineState
+from LMC_interp.errors import ProgramIpOOB
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+    InterpT: TypeAlias = InterpreterB10 | InterpB2
+
+HandlerT: TypeAlias = Callable[[int], int]
+RunnerT: TypeAlias = Callable[['int | None'], None]
+
+
+class ClosureState(EngineState):
+    def __init__(self, interp: InterpT):
+        super().__init__(interp)
+        self.run: RunnerT = _make_runner(interp)
+
+
+def run_closure_engine(interp: InterpT, stop_n: int | None = None):
+    state = interp._engine_state
+    if state is None or not state.is_valid_for(interp):
+        state = interp._engine_state = ClosureState(interp)
+    state.run(stop_n)
+
+
+# This is one big function as all the handlers need to share `acc`
+def _make_runner(interp: InterpT) -> RunnerT:
+    mem = interp.memory
+    size = len(mem)
+    wrap_memory = interp.wrap_memory
+    wrap_values = interp.wrap_values
+    lo = interp.value_range[0]
+    mod = interp.value_range[1] - lo + 1
+    split_word = interp.split_word
+    dirty_add = interp.dirty_cells.add
+    acc = interp.acc_internal
+    compiled: dict[int, int] = {}
+    """addr -> the word its handler was compiled from"""
+    # ip after running the last cell
+    end_ip = 0 if wrap_memory else size
+
+    def resolve_addr(operand: int) -> int | None:
+        if 0 <= operand < size:
+            return operand
+        if wrap_memory:
+            return operand % size
+        return None  # will raise so let the interpreter deal with it
+
+    # region handler factories
+    def make_fallback() -> HandlerT:
+        def fallback(ip: int) -> int:
+            nonlocal acc
+            interp.acc_internal = acc
+            interp.ip = ip
+            interp.fetch()
+            interp.decode()
+            interp.execute()
+            interp.n_instr -= 1  # already counted by the main loop
+            acc = interp.acc_internal
+            if interp.is_halted:
+                return ~interp.ip
+            return interp.ip if interp.ip < size else end_ip
+        return fallback
+
+    def make_hlt(nxt: int) -> HandlerT:
+        halted = ~nxt  # negative so it stops the main loop
+
+        def hlt(_ip: int) -> int:
+            return halted
+        return hlt
+
+    def make_add(addr: int, nxt: int) -> HandlerT:
+        if wrap_values:
+            def add(_ip: int) -> int:
+                nonlocal acc
+                acc = (acc + mem[addr] - lo) % mod + lo
+                return nxt
+        else:
+            def add(_ip: int) -> int:
+                nonlocal acc
+                acc += mem[addr]
+                return nxt
+        return add
+
+    def make_sub(addr: int, nxt: int) -> HandlerT:
+        if wrap_values:
+            def sub(_ip: int) -> int:
+                nonlocal acc
+                acc = (acc - mem[addr] - lo) % mod + lo
+                return nxt
+        else:
+            def sub(_ip: int) -> int:
+                nonlocal acc
+                acc -= mem[addr]
+                return nxt
+        return sub
+
+    def make_sta(addr: int, nxt: int) -> HandlerT:
+        def sta(_ip: int) -> int:
+            mem[addr] = acc  # acc is already normalized
+            dirty_add(addr)
+            handlers[addr] = compile_stub  # might've been code
+            return nxt
+        return sta
+
+    def make_lda(addr: int, nxt: int) -> HandlerT:
+        # memory can contain values outside value_range (e.g. from DAT)
+        if wrap_values:
+            def lda(_ip: int) -> int:
+                nonlocal acc
+                acc = (mem[addr] - lo) % mod + lo
+                return nxt
+        else:
+            def lda(_ip: int) -> int:
+                nonlocal acc
+                acc = mem[addr]
+                return nxt
+        return lda
+
+    def make_bra(target: int) -> HandlerT:
+        def bra(_ip: int) -> int:
+            return target
+        return bra
+
+    def make_brz(target: int, nxt: int) -> HandlerT:
+        def brz(_ip: int) -> int:
+            return target if acc == 0 else nxt
+        return brz
+
+    def make_brp(target: int, nxt: int) -> HandlerT:
+        def brp(_ip: int) -> int:
+            return target if acc >= 0 else nxt
+        return brp
+
+    # (these use interp.io as it can be replaced between runs, e.g. run_batch)
+    def make_inp(nxt: int) -> HandlerT:
+        if wrap_values:
+            def inp(_ip: int) -> int:
+                nonlocal acc
+                acc = (interp.io.read_num() - lo) % mod + lo
+                return nxt
+        else:
+            def inp(_ip: int) -> int:
+                nonlocal acc
+                acc = interp.io.read_num()
+                return nxt
+        return inp
+
+    def make_out(nxt: int) -> HandlerT:
+        def out(_ip: int) -> int:
+            interp.io.write_num(acc)
+            return nxt
+        return out
+
+    def make_otc(nxt: int) -> HandlerT:
+        def otc(_ip: int) -> int:
+            interp.io.write_char(acc)
+            return nxt
+        return otc
+    # endregion
+
+    def compile_cell(ip: int) -> HandlerT:
+        nxt = ip + 1
+        decoded = split_word(mem[ip])
+        if decoded is None:
+            return make_fallback()
+        opcode, operand = decoded
+        if opcode == 0:
+            return make_hlt(nxt)  # not normalized, same as the FDE loop
+        if nxt == size:
+            nxt = end_ip
+        if opcode == 9:
+            match operand:
+                case 1:
+                    return make_inp(nxt)
+                case 2:
+                    return make_out(nxt)
+                case 22 if interp.ext_otc__enabled():
+                    return make_otc(nxt)
+            return make_fallback()
+        addr = resolve_addr(operand)
+        if addr is None:
+            return make_fallback()
+        match opcode:
+            case 1:
+                return make_add(addr, nxt)
+            case 2:
+                return make_sub(addr, nxt)
+            case 3:
+                return make_sta(addr, nxt)
+            case 5:
+                return make_lda(addr, nxt)
+            case 6:
+                return make_bra(addr)
+            case 7:
+                return make_brz(addr, nxt)
+            case 8:
+                return make_brp(addr, nxt)
+        return make_fallback()
+
+    def compile_stub(ip: int) -> int:
+        compiled[ip] = mem[ip]
+        handler = handlers[ip] = compile_cell(ip)
+        return handler(ip)
+
+    def ip_oob(_ip: int) -> int:
+        raise ProgramIpOOB("Instruction pointer went outside of memory",
+                           hint_wrap_memory=True)
+
+    handlers: list[HandlerT] = [compile_stub] * size + [ip_oob]
+
+    def run(stop_n: int | None):
+        nonlocal acc
+        # Recompile the cells that were changed since the last run
+        #  (e.g. by restore() or writing to .memory)
+        for addr, word in compiled.items():
+            if mem[addr] != word:
+                handlers[addr] = compile_stub
+        acc = interp.acc_internal
+        ip = interp.ip
+        if not 0 <= ip < size:
+            ip = ip % size if wrap_memory else size
+        n = interp.n_instr
+        try:
+            if stop_n is None:
+                while ip >= 0:
+                    n += 1
+                    ip = handlers[ip](ip)
+            else:
+                while ip >= 0 and n < stop_n:
+                    n += 1
+                    ip = handlers[ip](ip)
+        except ProgramIpOOB:
+            n -= 1  # wasn't actually fetched
+            interp.ip = ip
+            raise
+        except BaseException:
+            interp.ip = ip + 1  # already 'fetched', same as the FDE loop
+            raise
+        else:
+            if ip < 0:
+                interp.ip = ~ip
+                interp.is_halted = True
+            else:
+                interp.ip = ip  # ran out of steps
+        finally:
+            interp.n_instr = n
+            interp.acc_internal = acc
+    return run
@@ -0,0 +1,261 @@
+"""Compiled programs (the result of parsing the source) and a cache of them
+so that loading the same source again doesn't need to parse it at all.
+
+A ``CompiledProgram`` can be saved to a ``.lmco`` file: ``LMCO_MAGIC``
+followed by the program as (UTF-8) JSON.
+
+The cache is keyed by a hash of the source, the parser options and the
+registered instructions. It keeps the most recently used programs in memory
+and can also store them on disk (``ProgramCache(use_disk=True)``, used by
+the command line) using ``marshal`` which is faster to load and import than
+JSON, see ``LMC_interp.cache_utils``.
+
+This is imported when starting up so the parser (and ``json``) are only
+imported when they are needed: a cache hit doesn't need them."""
+from __future__ import annotations
+
+import marshal
+import os
+from collections import OrderedDict
+from hashlib import sha256
+from typing import Iterable, NamedTuple, TextIO, TYPE_CHECKING
+
+from LMC_interp.base_instruction import Instruction, INSTR_DISPATCH
+from LMC_interp.cache_utils import (
+    get_cache_dir, read_cache_file, write_cache_file)
+from LMC_interp.data_instruction import Data
+from LMC_interp.errors import InvalidCompiledProgramError
+
+if TYPE_CHECKING:
+    from LMC_interp.parse_asm import AsmParser
+
+LMCO_MAGIC = b'LMCO\n'
+# Bump this when the format (or the parser output) changes
+LMCO_VERSION = 2
+MEMO_SIZE = 256
+"""How many programs to keep in memory"""
+DISK_CACHE_MAX_FILES = 4096
+"""How many programs to keep on disk (the least recently used are removed)"""
+
+
+# (not a dataclass as importing dataclasses is slow)
+class CompiledProgram(NamedTuple):
+    memory: tuple[int, ...]
+    """The (base 10) memory image, same as ``AsmParser.memory``"""
+    opcodes: tuple[int, ...]
+    """The opcode of each cell, -1 for DAT (needed to convert it to InterpB2
+    as the operand can be more than 2 digits in a big program)"""
+    labels: dict[str, int]
+    source_map: tuple[int, ...]
+    """The (1-based) line number that each cell came from
+    (0 for the HLT added by ``append_hlt``)"""
+    extensions: bool = True
+    append_hlt: bool = False
+
+    @classmethod
+    def from_parser(cls, p: AsmParser):
+        """Make a ``CompiledProgram`` from an ``AsmParser`` that has been
+        ``.parse()``-d (or made using ``AsmParser.from_stream()``)"""
+        return cls(tuple(p.memory), tuple(p.get_opcodes()), dict(p.labels),
+                   tuple(p.get_source_map()), p.extensions, p.do_append_hlt)
+
+    @property
+    def instructions(self) -> list[Instruction | Data]:
+        from LMC_interp.instructions import ensure_instr_registered
+        ensure_instr_registered()
+        mult = Instruction.b10_opcode_mult
+        return [Data(op) if opcode < 0
+                else Instruction.get_instr_cls(opcode * mult)
+                .from_b10_opcode_operand(opcode, op - opcode * mult)
+                for op, opcode in zip(self.memory, self.opcodes)]
+
+    # region .lmco
+    def to_bytes(self) -> bytes:
+        import json
+        obj = {'version': LMCO_VERSION, 'memory': self.memory,
+               'opcodes': self.opcodes, 'labels': self.labels,
+               'source_map': self.source_map, 'extensions': self.extensions,
+               'append_hlt': self.append_hlt}
+        return LMCO_MAGIC + json.dumps(obj, separators=(',', ':')).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        import json
+        if not data.startswith(LMCO_MAGIC):
+            raise InvalidCompiledProgramError("Not a compiled LMC program")
+        try:
+            obj = json.loads(data[len(LMCO_MAGIC):])
+        except ValueError as e:
+            raise InvalidCompiledProgramError(f"Invalid compiled program: {e}")
+        if obj.get('version') != LMCO_VERSION:
+            raise InvalidCompiledProgramError(
+                f"Compiled program is version {obj.get('version')!r}, "
+                f"expected {LMCO_VERSION}")
+        return cls(tuple(obj['memory']), tuple(obj['opcodes']), obj['labels'],
+                   tuple(obj['source_map']), obj['extensions'],
+                   obj['append_hlt'])
+
+    def save(self, path: str | os.PathLike):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str | os.PathLike):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+    # endregion
+
+
+def get_cache_key(source: str, extensions=True, append_hlt=False,
+                  optimize=False) -> str:
+    from LMC_interp.instructions import ensure_instr_registered
+    ensure_instr_registered()
+    h = sha256(repr((LMCO_VERSION, extensions, append_hlt, optimize,
+                     # in case any custom instructions have been registered
+                     sorted((k, v.__module__, v.__qualname__)
+                            for k, v in INSTR_DISPATCH.items()))).encode())
+    h.update(source.encode())
+    return h.hexdigest()
+
+
+class ProgramCache:
+    def __init__(self, memo_size: int = MEMO_SIZE,
+                 max_files: int = DISK_CACHE_MAX_FILES, use_disk: bool = False):
+        self.memo_size = memo_size
+        self.max_files = max_files
+        self.use_disk = use_disk
+        self._memo: OrderedDict[str, CompiledProgram] = OrderedDict()
+
+    def compile(self, source: str, extensions=True, append_hlt=False,
+                optimize=False) -> CompiledProgram:
+        """Returns the compiled program, only parsing ``source`` if it isn't
+        in the cache"""
+        key = get_cache_key(source, extensions, append_hlt, optimize)
+        if (prog := self._memo.get(key)) is not None:
+            self._memo.move_to_end(key)
+            return prog
+        prog = self._load_from_disk(key)
+        if prog is None:
+            prog = _parse_source(source, extensions, append_hlt, optimize)
+            self._save_to_disk(key, prog)
+        self._memo[key] = prog
+        if len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+        return prog
+
+    def invalidate(self, source: str, extensions=True, append_hlt=False,
+                   optimize=False):
+        """Remove a program from the cache (memory and disk)"""
+        key = get_cache_key(source, extensions, append_hlt, optimize)
+        self._memo.pop(key, None)
+        if (path := self._get_path(key)) is not None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def clear(self, disk=True):
+        self._memo.clear()
+        if disk and (cache_dir := self._get_cache_dir()) is not None:
+            for path in _list_cache_files(cache_dir):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    # region disk
+    def _get_cache_dir(self) -> str | None:
+        return get_cache_dir('programs') if self.use_disk else None
+
+    def _get_path(self, key: str) -> str | None:
+        cache_dir = self._get_cache_dir()
+        return (None if cache_dir is None
+                else os.path.join(cache_dir, f'{key}{_CACHE_SUFFIX}'))
+
+    def _load_from_disk(self, key: str) -> CompiledProgram | None:
+        if (path := self._get_path(key)) is None:
+            return None
+        if (data := read_cache_file(path)) is None:
+            return None
+        try:
+            prog = CompiledProgram(*marshal.loads(data))
+        except (ValueError, EOFError, TypeError):
+            return None  # corrupted, just parse it again
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return prog
+
+    def _save_to_disk(self, key: str, prog: CompiledProgram):
+        if (path := self._get_path(key)) is None:
+            return
+        if write_cache_file(path, marshal.dumps(tuple(prog))):
+            self._evict(os.path.dirname(path))
+
+    def _evict(self, cache_dir: str):
+        """Remove the least recently used files if there are too many"""
+        paths = _list_cache_files(cache_dir)
+        if len(paths) <= self.max_files:
+            return
+        paths.sort(key=_get_mtime)
+        for path in paths[:len(paths) - self.max_files]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    # endregion
+
+
+_CACHE_SUFFIX = '.bin'
+
+
+def _get_mtime(path: str) -> float:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0
+
+
+def _list_cache_files(cache_dir: str) -> list[str]:
+    try:
+        return [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+                if name.endswith(_CACHE_SUFFIX)]
+    except OSError:
+        return []
+
+
+def _parse_source(source: str, extensions: bool, append_hlt: bool,
+                  optimize: bool) -> CompiledProgram:
+    from LMC_interp.parse_asm import AsmParser
+    return CompiledProgram.from_parser(
+        AsmParser(source, extensions, append_hlt, optimize).parse())
+
+
+default_cache = ProgramCache()
+"""Used by ``from_source`` (only in memory)"""
+
+
+def compile_source(source: str, extensions=True, append_hlt=False,
+                   cache: ProgramCache | None = default_cache,
+                   optimize=False) -> CompiledProgram:
+    """Parse ``source`` (using ``cache`` if it isn't None), ``optimize``
+    runs ``LMC_interp.optimizer`` on it"""
+    if cache is None:
+        return _parse_source(source, extensions, append_hlt, optimize)
+    return cache.compile(source, extensions, append_hlt, optimize)
+
+
+def compile_stream(stream: TextIO | Iterable[str], extensions=True,
+                   append_hlt=False) -> CompiledProgram:
+    """Parse a program from a (text) file object without loading the
+    whole source (see ``AsmParser.from_stream``). This isn't cached."""
+    from LMC_interp.parse_asm import AsmParser
+    return CompiledProgram.from_parser(
+        AsmParser.from_stream(stream, extensions, append_hlt))
+
+
+def compile_file(path: str | os.PathLike, extensions=True,
+                 append_hlt=False) -> CompiledProgram:
+    with open(path) as f:
+        return compile_stream(f, extensions, append_hlt)
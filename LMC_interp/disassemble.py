@@ -0,0 +1,145 @@
+"""Turn memory (e.g. after a program crashed) back into LMC assembly that
+can be parsed again (``AsmParser``) to give the same memory.
+
+Each word is looked up in a table (made once) instead of making an
+``Instruction`` (and its canonical forms) for each one like
+``instruction_conv.int_to_instr_1`` does, so even a whole InterpB2 image
+(65536 words) is quick. Words that aren't a canonical form of an instruction
+become ``DAT``. Addresses used as operands get labels: ``L<addr>``
+for code and ``D<addr>`` for data.
+
+NOTE: there is no way to know if a word was meant to be an instruction or
+data (e.g. ``DAT 0`` and ``HLT``) so the guess may differ from the original
+source but it is the same program."""
+from __future__ import annotations
+
+import os
+from array import array
+from typing import Sequence, TYPE_CHECKING
+
+from LMC_interp.instructions import (
+    HaltInstr, AddInstr, SubInstr, StoreInstr, LoadInstr,
+    BranchInstr, BranchZeroInstr, BranchPosInstr, IOInstr,
+    InputInstr, OutputInstr, OutputCharInstr)
+
+if TYPE_CHECKING:
+    from LMC_interp.specialised_loops import IsaT
+
+# Only the standard instructions (custom ones can't be written in the source)
+_ADDR_NAMES = {AddInstr: 'ADD', SubInstr: 'SUB', StoreInstr: 'STA',
+               LoadInstr: 'LDA', BranchInstr: 'BRA', BranchZeroInstr: 'BRZ',
+               BranchPosInstr: 'BRP'}
+"""Instructions that have an address as their operand"""
+_FIXED_NAMES = {HaltInstr: 'HLT', InputInstr: 'INP', OutputInstr: 'OUT',
+                OutputCharInstr: 'OTC'}
+"""Instructions that only have one form (no operand in the source)"""
+
+B2_OPCODE_SHIFT = 27
+B2_OPERAND_MASK = (1 << B2_OPCODE_SHIFT) - 1
+
+_Entry = tuple[str, int | None]
+"""(mnemonic, address operand or None)"""
+_b10_tables: dict[bool, list[_Entry | None]] = {}
+_B2_ADDR_NAMES: list[str | None] = [None] * (1 << (31 - B2_OPCODE_SHIFT))
+"""The mnemonic for each (non-negative) B2 opcode that has an address"""
+for _cls, _name in _ADDR_NAMES.items():
+    _B2_ADDR_NAMES[_cls.get_b10_opcode()] = _name
+
+
+def _get_b10_table(extensions: bool) -> list[_Entry | None]:
+    """The instruction for each word from 0 to 999 (None if it's data)"""
+    if (table := _b10_tables.get(extensions)) is not None:
+        return table
+    table: list[_Entry | None] = [None] * 1000
+    for cls, name in _ADDR_NAMES.items():
+        opcode = cls.get_b10_opcode()
+        for operand in range(100):
+            table[opcode * 100 + operand] = (name, operand)
+    for word in HaltInstr.get_canonical_forms() | IOInstr.get_canonical_forms():
+        instr = IOInstr(word % 100).get_runnable() if word >= 900 else HaltInstr()
+        if type(instr) is OutputCharInstr and not extensions:
+            continue  # would be an error to parse it
+        table[word] = (_FIXED_NAMES[type(instr)], None)
+    _b10_tables[extensions] = table
+    return table
+
+
+def decode_b10(memory: Sequence[int], extensions=True) -> list[_Entry | None]:
+    """The (mnemonic, address) of each word (None if it's data)"""
+    table = _get_b10_table(extensions)
+    return [table[word] if 0 <= word < 1000 else None for word in memory]
+
+
+def decode_b2(memory: Sequence[int], extensions=True,
+              mem_size: int | None = None) -> list[_Entry | None]:
+    """Same as ``decode_b10`` but for InterpB2 (see instruction_format_b2.md).
+    Addresses outside the memory (``mem_size`` cells, defaults to
+    ``len(memory)``) are assumed to be data."""
+    mem_size = len(memory) if mem_size is None else mem_size
+    b10_table = _get_b10_table(extensions)
+    result: list[_Entry | None] = []
+    for word in memory:
+        if not 0 <= word < (10 << B2_OPCODE_SHIFT):
+            result.append(None)  # negative or opcode > 9
+            continue
+        opcode = word >> B2_OPCODE_SHIFT
+        operand = word & B2_OPERAND_MASK
+        if (name := _B2_ADDR_NAMES[opcode]) is not None:
+            result.append((name, operand) if operand < mem_size else None)
+        elif operand < 100:
+            # HLT/INP/OUT/OTC: same as b10 (the only canonical forms are < 100)
+            result.append(b10_table[opcode * 100 + operand])
+        else:
+            result.append(None)
+    return result
+
+
+def disassemble(memory: Sequence[int], isa: IsaT = 'b10', extensions=True,
+                trim=True, addresses=True) -> str:
+    """Turn the memory into assembly. ``trim`` leaves out the zeroes at the
+    end (it's the same program as the memory is filled with zeroes),
+    ``addresses`` adds a comment with the address to each line."""
+    end = mem_size = len(memory)
+    if trim:
+        while end > 0 and memory[end - 1] == 0:
+            end -= 1
+    memory = memory[:end]
+    if isa == 'b10':
+        decoded = decode_b10(memory, extensions)
+    else:
+        decoded = decode_b2(memory, extensions, mem_size)
+    labels: dict[int, str] = {}
+    for entry in decoded:
+        if entry is not None and (addr := entry[1]) is not None and addr < end:
+            labels[addr] = ''  # (filled in below, needs to know if it's data)
+    for addr in labels:
+        labels[addr] = f'{"D" if decoded[addr] is None else "L"}{addr}'
+    width = max(map(len, labels.values()), default=-1) + 1
+    no_label = ' ' * width
+    comment_col = width + 16
+    codes: dict[_Entry, str] = {}
+    """Text of each instruction (most of them are the same)"""
+    lines = []
+    for addr, entry in enumerate(decoded):
+        if entry is None:
+            code = f'DAT {memory[addr]}'
+        elif (code := codes.get(entry)) is None:
+            target = entry[1]
+            code = codes[entry] = (entry[0] if target is None else
+                                   f'{entry[0]} {labels.get(target, target)}')
+        label = labels.get(addr)
+        line = no_label + code if label is None else f'{label:<{width}}{code}'
+        if addresses:
+            line = f'{line.ljust(comment_col)} // {addr}'
+        lines.append(line)
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def disassemble_image(path: str | os.PathLike, extensions=True, trim=True,
+                      addresses=True) -> str:
+    """Disassemble an InterpB2 memory image (see ``InterpB2.save_image``)"""
+    from LMC_interp.interp_b2_quick_and_dirty import WORD_TYPECODE
+    memory = array(WORD_TYPECODE)
+    with open(path, 'rb') as f:
+        memory.frombytes(f.read())
+    return disassemble(memory, 'b2', extensions, trim, addresses)
@@ -0,0 +1,73 @@
+"""The execution engines that ``InterpreterB10`` and ``InterpB2`` can use
+to run a program (selected using ``engine=...``):
+
+- ``'fde'`` (default): the classic fetch-decode-execute loop
+- ``'closure'``: compiles each memory cell into a specialised closure,
+  see ``LMC_interp.closure_engine``
+- ``'block'``: compiles basic blocks into Python functions (with caching),
+  best for long-running programs, see ``LMC_interp.block_compiler``
+- ``'native'``: runs the program using the C interpreter (InterpB2 only),
+  needs ``LMC_compile`` to be built, see ``LMC_interp.native_engine``"""
+from __future__ import annotations
+
+from typing import TypeAlias, Callable, Any, Literal, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+    InterpT: TypeAlias = InterpreterB10 | InterpB2
+
+EngineT: TypeAlias = Literal['fde', 'closure', 'block', 'native']
+
+ENGINE_FDE: EngineT = 'fde'
+ENGINE_CLOSURE: EngineT = 'closure'
+ENGINE_BLOCK: EngineT = 'block'
+ENGINE_NATIVE: EngineT = 'native'
+
+ENGINES: frozenset[EngineT] = frozenset({
+    ENGINE_FDE, ENGINE_CLOSURE, ENGINE_BLOCK, ENGINE_NATIVE})
+
+
+def check_engine(engine: EngineT):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of: "
+                         f"{', '.join(map(repr, sorted(ENGINES)))}")
+
+
+def get_engine_runner(engine: EngineT) -> Callable[[Any, 'int | None'], None]:
+    """Returns the function that runs an interpreter using this engine,
+    ``runner(interp, stop_n)`` runs it until it halts or (if ``stop_n``
+    isn't None) ``interp.n_instr`` gets to ``stop_n``.
+    The engine modules are only imported when they are first needed."""
+    match engine:
+        case 'closure':
+            from LMC_interp.closure_engine import run_closure_engine
+            return run_closure_engine
+        case 'block':
+            from LMC_interp.block_compiler import run_block_engine
+            return run_block_engine
+        case 'native':
+            from LMC_interp.native_engine import run_native_engine
+            return run_native_engine
+        case _:
+            # 'fde' is implemented by the interpreters themselves
+            raise ValueError(f"No separate runner for engine {engine!r}")
+
+
+class EngineState:
+    """What an engine compiled for an interpreter. It is kept on the
+    interpreter (``interp._engine_state``) so that resuming the program
+    (e.g. ``run(max_steps=...)`` in a loop) doesn't compile it again.
+    It is only valid for the memory object and config it was made for."""
+    def __init__(self, interp: InterpT):
+        self.memory = interp.memory
+        self.config = _engine_config(interp)
+
+    def is_valid_for(self, interp: InterpT) -> bool:
+        return (self.memory is interp.memory
+                and self.config == _engine_config(interp))
+
+
+def _engine_config(interp: InterpT) -> tuple:
+    return interp.wrap_memory, interp.wrap_values, interp.ext_otc__enabled()
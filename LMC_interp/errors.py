@@ -31,6 +31,27 @@ class ProgramJmpOOB(ProgramOOBError):
     pass  # this probably should never be raised as all addr to jmp to are from the operand
 
 
+# region error factories
+# These are passed to normalize_addr() instead of the error itself so that
+#  the error is only made when it is raised (not on every memory access)
+def make_ip_oob() -> ProgramIpOOB:
+    return ProgramIpOOB("Instruction pointer went outside of memory",
+                        hint_wrap_memory=True)
+
+
+def make_read_oob() -> ProgramReadOOB:
+    return ProgramReadOOB("Attempt to read outside of memory", hint_wrap_memory=True)
+
+
+def make_write_oob() -> ProgramWriteOOB:
+    return ProgramWriteOOB("Attempt to write outside of memory", hint_wrap_memory=True)
+
+
+def make_jmp_oob() -> ProgramJmpOOB:
+    return ProgramJmpOOB("Program branched outside of memory", hint_wrap_memory=True)
+# endregion
+
+
 class InvalidInstructionError(LMCError):
     pass
 
@@ -45,3 +66,40 @@ class InvalidOperandError(InvalidInstructionError):
 
 class ExtensionDisabledError(InvalidInstructionError):
     pass
+
+
+class InputError(LMCError):
+    pass
+
+
+class InputExhaustedError(InputError):
+    pass
+
+
+class InputOutOfRangeError(InputError):
+    pass
+
+
+class InvalidInputError(InputError):
+    pass
+
+
+class InvalidCompiledProgramError(LMCError):
+    pass
+
+
+class LimitExceededError(LMCError):
+    pass
+
+
+class InstrLimitExceededError(LimitExceededError):
+    pass
+
+
+class TimeLimitExceededError(LimitExceededError):
+    pass
+
+
+class InputNotReadyError(InputError):
+    """There is no input yet (but there might be later). This makes
+    ``run()`` return ``STATUS_NEEDS_INPUT`` instead of raising."""
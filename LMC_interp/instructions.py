@@ -112,6 +112,9 @@ class IOInstr(InstrSingleOpcodeCommon):
             case operand:
                 return InvalidIOInstr(operand)
 
+    def get_runnable(self) -> Instruction:
+        return self.dispatch_operand()
+
     def run(self, interp: InterpStateT):
         self.dispatch_operand().run(interp)
 
@@ -168,6 +171,13 @@ class OutputCharInstr(FixedOperandIOSubInstr):
         interp.io.write_char(interp.acc)
 
 
+STANDARD_INSTR_CLASSES: frozenset[type[Instruction]] = frozenset({
+    HaltInstr, AddInstr, SubInstr, StoreInstr, LoadInstr,
+    BranchInstr, BranchZeroInstr, BranchPosInstr, IOInstr})
+"""The classes registered for the standard opcodes (0-3 and 5-9)"""
+
+
 def ensure_instr_registered():
     """This function exists purely so that this file is imported
-    and the @register_instr() side effects are run"""
+    and the @register_instr() side effects are run. It is cheap and safe
+    to call any number of times (from any thread/process)."""
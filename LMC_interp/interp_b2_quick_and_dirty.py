@@ -1,32 +1,64 @@
 from __future__ import annotations
 
-from typing import Self
+import mmap
+import os
+from array import array
+from typing import Self, Iterable, Callable, Sequence, TYPE_CHECKING
 
 from LMC_interp.base_instruction import Instruction
+from LMC_interp.compiled import CompiledProgram, compile_source
 from LMC_interp.data_instruction import Data
+from LMC_interp.engines import (
+    EngineT, EngineState, ENGINE_FDE, check_engine, get_engine_runner)
 from LMC_interp.errors import (
-    ProgramReadOOB, ProgramWriteOOB, ProgramJmpOOB,
-    ExtensionDisabledError, ProgramOOBError, ProgramIpOOB, InvalidOpcodeError,
-    InvalidOperandError,
+    ExtensionDisabledError, ProgramOOBError, InvalidOpcodeError,
+    InvalidOperandError, InputNotReadyError,
+    make_ip_oob, make_read_oob, make_write_oob, make_jmp_oob,
 )
-from LMC_interp.parse_asm import AsmParser
+from LMC_interp.io_mgr import IOMgr
+from LMC_interp.run_status import (
+    RunStatusT, STATUS_HALTED, STATUS_NEEDS_INPUT, STATUS_BUDGET_EXHAUSTED)
+from LMC_interp.specialised_loops import get_run_loop, RunLoopT
+
+if TYPE_CHECKING:
+    # (imported when needed, see LMC_interp.__main__)
+    from LMC_interp.batch import BatchResult
+    from LMC_interp.snapshot import Snapshot
 
 MEM_SIZE_DEFAULT = 0x10000  # 2**16
+WORD_TYPECODE = 'i'
+"""``array`` typecode for the memory (signed 32-bit, see instruction_format_b2.md)"""
+WORD_SIZE = array(WORD_TYPECODE).itemsize
+DECODED_WORDS_MAX = 4096
+"""Max size of the cache of decoded words (it's cleared when it's full)"""
 
 
 class InterpB2:
     value_range = (-(1 << 31), (1 << 31) - 1)
 
-    def __init__(self, memory: list[int] | None = None,
+    def __init__(self, memory: Sequence[int] | None = None,
                  mem_size: int = MEM_SIZE_DEFAULT, extensions: bool = True,
-                 wrap_memory=False, inp_prompt: str = '>? '):
+                 wrap_memory=False, inp_prompt: str = '>? ',
+                 engine: EngineT = ENGINE_FDE):
+        check_engine(engine)
+        self.engine = engine
         self.memory_size = mem_size
         self.memory = self._make_memory_obj(memory)
+        self.dirty_cells: set[int] = set()
+        """Addresses written to since the last ``snapshot()``/``restore()``"""
+        self._dirty_base: tuple[Snapshot, Sequence[int]] | None = None
+        """The snapshot (and memory) that ``dirty_cells`` is relative to"""
         self.extensions = extensions
         self.wrap_memory = wrap_memory
         self.inp_prompt = inp_prompt
-        self.io = IOMgrB2(self)
         self.wrap_values = True
+        self.io = IOMgrB2(self)
+        self._value_lo = self.value_range[0]
+        self._value_mod = self.value_range[1] - self.value_range[0] + 1
+        self._run_loop: RunLoopT | None = self._pick_run_loop()
+        """Main loop specialised for this config (None to use the FDE methods)"""
+        self._engine_state: EngineState | None = None
+        """What the engine compiled (kept between runs)"""
         self.cir = None
         self.decoded_instr = None
         self.ip = 0
@@ -39,27 +71,138 @@ class InterpB2:
     def from_instr_list(cls, instructions: list[int | Instruction | Data],
                         mem_size: int = MEM_SIZE_DEFAULT,
                         extensions: bool = True, wrap_memory=False,
-                        inp_prompt: str = '>? '):
+                        inp_prompt: str = '>? ', engine: EngineT = ENGINE_FDE):
         return cls(cls._instr_b10_list_to_b2(instructions), mem_size,
-                   extensions, wrap_memory, inp_prompt)
+                   extensions, wrap_memory, inp_prompt, engine)
 
     @classmethod
     def from_source(cls: type[Self], source: str, mem_size: int = MEM_SIZE_DEFAULT,
                     extensions: bool = True, wrap_memory=False,
-                    append_hlt: bool = False, inp_prompt: str = '>? ') -> Self:
-        p = AsmParser(source, extensions, append_hlt).parse()
+                    append_hlt: bool = False, inp_prompt: str = '>? ',
+                    engine: EngineT = ENGINE_FDE, optimize=False) -> Self:
+        """``optimize`` runs ``LMC_interp.optimizer`` on the program"""
+        prog = compile_source(source, extensions, append_hlt, optimize=optimize)
+        return cls.from_compiled(prog, mem_size, wrap_memory, inp_prompt, engine)
+
+    @classmethod
+    def from_compiled(cls: type[Self], prog: CompiledProgram,
+                      mem_size: int = MEM_SIZE_DEFAULT, wrap_memory=False,
+                      inp_prompt: str = '>? ',
+                      engine: EngineT = ENGINE_FDE) -> Self:
+        """Load a program compiled by ``LMC_interp.compiled``
+        (e.g. from a ``.lmco`` file)"""
         # NOTE: can't use .memory as that's base10
-        return cls.from_instr_list(p.instructions, mem_size, extensions,
-                                   wrap_memory, inp_prompt)
+        return cls(cls._compiled_to_b2(prog), mem_size, prog.extensions,
+                   wrap_memory, inp_prompt, engine)
 
-    def _make_memory_obj(self, initial_memory: list[int] | None) -> list[int]:
+    @classmethod
+    def run_batch(cls, program: str | list[int],
+                  inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+        """Parse ``program`` (source or memory) once and run it with each of
+        the ``inputs``, see ``LMC_interp.batch.run_batch``"""
+        from LMC_interp.batch import run_batch
+        return run_batch(cls, program, inputs, **kwargs)
+
+    @classmethod
+    def run_lockstep(cls, program: str | list[int],
+                     inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+        """Same as ``run_batch`` but runs all the inputs at once using NumPy,
+        see ``LMC_interp.lockstep`` (needs numpy)"""
+        from LMC_interp.lockstep import run_lockstep
+        return run_lockstep(cls, program, inputs, **kwargs)
+
+    def reset(self, memory: Sequence[int] | None = None):
+        """Reset the registers and I/O state so that the program can be run
+        again. The memory is also reset if ``memory`` is passed."""
+        if memory is not None:
+            self.memory = self._make_memory_obj(memory)
+            self._dirty_base = None
+            self._engine_state = None
+        self.cir = None
+        self.decoded_instr = None
+        self.ip = 0
+        self.acc_internal = 0
+        self.n_instr = 0
+        self.is_halted = False
+        self.io.is_line_mode = False
+
+    def snapshot(self) -> Snapshot:
+        """Save the memory, registers and I/O line mode, see
+        ``LMC_interp.snapshot``"""
+        from LMC_interp.snapshot import take_snapshot
+        return take_snapshot(self)
+
+    def restore(self, snap: Snapshot):
+        """Go back to ``snap``. Only the memory cells that the program wrote
+        to are copied if ``snap`` is the latest snapshot taken/restored."""
+        from LMC_interp.snapshot import restore_snapshot
+        restore_snapshot(self, snap)
+
+    def _make_memory_obj(self, initial_memory: Sequence[int] | None
+                         ) -> array | memoryview | list[int]:
+        """The memory is an ``array('i')`` (4 bytes per word instead of a
+        pointer to an int object). A ``memoryview`` of the whole memory
+        (e.g. from ``from_image``) is used as-is."""
         if initial_memory is None:
-            return [0] * self.memory_size
+            return _zeros(self.memory_size)
         if len(initial_memory) > self.memory_size:
             raise ValueError("initial_memory doesn't fit in the memory size")
+        if (isinstance(initial_memory, memoryview)
+                and len(initial_memory) == self.memory_size):
+            return initial_memory
+        try:
+            memory = array(WORD_TYPECODE, initial_memory)
+        except OverflowError:
+            # DAT can be outside the 32-bit range so fall back to a list
+            memory = list(initial_memory)
+            memory += [0] * (self.memory_size - len(initial_memory))
+            return memory
         # fill rest (if any) with zeroes
-        extra_padding = self.memory_size - len(initial_memory)
-        return initial_memory + [0] * extra_padding
+        memory += _zeros(self.memory_size - len(initial_memory))
+        return memory
+
+    # region images
+    @classmethod
+    def from_image(cls: type[Self], path: str | os.PathLike,
+                   mem_size: int = MEM_SIZE_DEFAULT, extensions: bool = True,
+                   wrap_memory=False, inp_prompt: str = '>? ',
+                   engine: EngineT = ENGINE_FDE) -> Self:
+        """Load a binary memory image (see ``save_image``).
+
+        If the image is the whole memory (``mem_size`` words), it is mapped
+        copy-on-write with ``mmap`` so all the interpreters loading it
+        share the same pages (only the pages that are written to are copied)."""
+        with open(path, 'rb') as f:
+            n_bytes = os.fstat(f.fileno()).st_size
+            if n_bytes % WORD_SIZE != 0:
+                raise ValueError("Memory image isn't a whole number of words")
+            if n_bytes != mem_size * WORD_SIZE or n_bytes == 0:
+                memory = array(WORD_TYPECODE)
+                memory.frombytes(f.read())
+            else:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+                memory = memoryview(mm).cast(WORD_TYPECODE)
+        return cls(memory, mem_size, extensions, wrap_memory, inp_prompt, engine)
+
+    def save_image(self, path: str | os.PathLike, whole_memory=True):
+        """Save the memory as a binary image: signed 32-bit words in the
+        native byte order. Only saves up to the last non-zero word if
+        ``whole_memory`` is False (but then it can't be ``mmap``-ed)."""
+        memory = self.memory
+        if not whole_memory:
+            end = len(memory)
+            while end > 0 and memory[end - 1] == 0:
+                end -= 1
+            memory = memory[:end]
+        with open(path, 'wb') as f:
+            f.write(array(WORD_TYPECODE, memory).tobytes())
+    # endregion
+
+    def _pick_run_loop(self, budget: bool = False) -> RunLoopT | None:
+        if _overrides_fde_methods(type(self)):
+            return None  # these need to go through the normal methods
+        return get_run_loop('b2', self.wrap_memory, self.wrap_values,
+                            self.extensions, self.value_range, budget)
     # endregion
 
     # region convert (@classmethod)
@@ -68,9 +211,17 @@ class InterpB2:
             cls, instr_list: list[Instruction | Data | int]) -> list[int]:
         return [cls._instr_1_b10_to_int_b2(instr) for instr in instr_list]
 
+    @classmethod
+    def _compiled_to_b2(cls, prog: CompiledProgram) -> list[int]:
+        mult = Instruction.b10_opcode_mult
+        return [op if opcode < 0
+                else cls._b2_from_opcode_operand(opcode, op - opcode * mult)
+                for op, opcode in zip(prog.memory, prog.opcodes)]
+
     @classmethod
     def _b2_from_opcode_operand(cls, opcode: int, operand: int) -> int:
-        assert 0 <= operand < 100
+        # operand can be more than 2 digits (big programs)
+        assert 0 <= operand < (1 << 27)
         result = (1 << 27) * opcode + operand
         assert cls.value_range[0] <= result <= cls.value_range[1]
         return result
@@ -95,7 +246,11 @@ class InterpB2:
         self.n_instr += 1
 
     def decode(self):
-        self.decoded_instr = (self.cir >> 27, self.cir & 0x07_FF_FF_FF)
+        # (shared tuples so that nothing is allocated on each step)
+        decoded = _DECODED_WORDS.get(self.cir)
+        if decoded is None:
+            decoded = _decode_word(self.cir)
+        self.decoded_instr = decoded
 
     def execute(self):
         opcode, operand = self.decoded_instr
@@ -134,21 +289,61 @@ class InterpB2:
             case _:
                 raise InvalidOpcodeError(f"Invalid opcode: {opcode}")
 
-    def run(self):
-        while not self.is_halted:
-            self.fetch()
-            self.decode()
-            self.execute()
+    def run(self, max_steps: int | None = None) -> RunStatusT:
+        """Run the program until it halts or (if ``max_steps`` is passed)
+        until ``max_steps`` instructions have been run. Returns why it
+        stopped (see ``LMC_interp.run_status``), it can be resumed by
+        calling ``run()`` again unless it halted."""
+        if self.is_halted:
+            return STATUS_HALTED
+        stop_n = None if max_steps is None else self.n_instr + max_steps
+        try:
+            if self.engine != ENGINE_FDE:
+                get_engine_runner(self.engine)(self, stop_n)
+            elif (loop := self._get_run_loop(stop_n)) is not None:
+                loop(self, stop_n)
+            else:
+                self._run_fde(stop_n)
+        except InputNotReadyError:
+            # Undo the fetch so that the INP is run again when resumed
+            self.ip -= 1
+            self.n_instr -= 1
+            return STATUS_NEEDS_INPUT
+        finally:
+            self.io.flush()
+        return STATUS_HALTED if self.is_halted else STATUS_BUDGET_EXHAUSTED
+
+    def _get_run_loop(self, stop_n: int | None) -> RunLoopT | None:
+        if self._run_loop is None:
+            return None  # (custom instructions) need to use the FDE methods
+        return self._run_loop if stop_n is None else self._pick_run_loop(budget=True)
+
+    def _run_fde(self, stop_n: int | None):
+        if stop_n is None:
+            while not self.is_halted:
+                self.fetch()
+                self.decode()
+                self.execute()
+        else:
+            while not self.is_halted and self.n_instr < stop_n:
+                self.fetch()
+                self.decode()
+                self.execute()
+
+    @classmethod
+    def split_word(cls, op: int) -> tuple[int, int] | None:
+        """Split ``op`` into (opcode, operand), used by the other engines"""
+        return op >> 27, op & 0x07_FF_FF_FF
     # endregion
 
     # region  utils used by *Instr
     def get(self, addr: int) -> int:
-        err = ProgramReadOOB("Attempt to read outside of memory", hint_wrap_memory=True)
-        return self.memory[self.normalize_addr(addr, err)]
+        return self.memory[self.normalize_addr(addr, make_read_oob)]
 
     def set(self, addr: int, value: int):
-        err = ProgramWriteOOB("Attempt to write outside of memory", hint_wrap_memory=True)
-        self.memory[self.normalize_addr(addr, err)] = self.normalize_value(value)
+        addr = self.normalize_addr(addr, make_write_oob)
+        self.memory[addr] = self.normalize_value(value)
+        self.dirty_cells.add(addr)
 
     @property
     def acc(self) -> int:
@@ -159,8 +354,7 @@ class InterpB2:
         self.acc_internal = self.normalize_value(value)
 
     def jmp(self, addr: int):
-        err = ProgramJmpOOB("Program branched outside of memory", hint_wrap_memory=True)
-        self.ip = self.normalize_addr(addr, err)
+        self.ip = self.normalize_addr(addr, make_jmp_oob)
 
     # endregion
 
@@ -180,73 +374,52 @@ class InterpB2:
     def is_addr_in_bounds(self, addr: int) -> bool:
         return 0 <= addr < len(self.memory)
 
-    def normalize_addr(self, addr: int, err: Exception = None) -> int:
+    def normalize_addr(self, addr: int,
+                       err: Exception | Callable[[], Exception] = None) -> int:
+        """``err`` is raised if ``addr`` is out of bounds (and memory doesn't
+        wrap). Pass a function that makes the error to only make it then."""
         if self.is_addr_in_bounds(addr):
             return addr
         if self.wrap_memory:
             return addr % len(self.memory)
-        raise err if err is not None else ProgramOOBError(
-            "Attempt to access out-of-bounds memory")
+        if err is None:
+            raise ProgramOOBError("Attempt to access out-of-bounds memory")
+        raise err() if callable(err) else err
 
     def normalize_value(self, value: int) -> int:  # noexcept
         if self.wrap_values:
-            # convert desired -999..=999 -> 0..=(999+999)
-            value -= self.value_range[0]
-            # end_incl = 999+999 = 999 - (-999)
-            maxvalue_incl = self.value_range[1] - self.value_range[0]
-            maxvalue_excl = maxvalue_incl + 1
-            value %= maxvalue_excl
-            # convert back to orig range
-            value += self.value_range[0]
+            # convert to 0..=(max-min), wrap it (_value_mod = max-min + 1)
+            #  then convert back to orig range
+            value = (value - self._value_lo) % self._value_mod + self._value_lo
         return value
 
     def normalize_ip(self):
-        err = ProgramIpOOB("Instruction pointer went outside of memory",
-                           hint_wrap_memory=True)
-        self.ip = self.normalize_addr(self.ip, err)
+        self.ip = self.normalize_addr(self.ip, make_ip_oob)
     # endregion
 
 
-class IOMgrB2:
-    def __init__(self, interp: InterpB2):
-        self.interp = interp  # just for the config (e.g. value_range)
-        self.is_line_mode = False
-
-    def write_num(self, num: int):
-        print(num, end='' if self.is_line_mode else '\n')
-
-    def write_char(self, ascii_value: int):
-        # This function starts a 'line' if not already started and
-        #  everything will be output onto that single line without any spaces
-        #  until \n is output to end the line
-        #  (e.g. OTC 'a'; OUT 1; OUT 2; prints 'a12' NOT 'a\n 1\n 2\n').
-        # After the line is finished, outputting numbers goes back
-        #  to the usual behavior of 1 number / line; outputting a char will
-        #  put it back into the 'line' mode.
-        # This is so that code not using OTC gets the expected behavior
-        #  while allowing easier mixing of text and numbers on a single line
-        #  and (as long as all 'line'-s are terminated), using OTC in one part
-        #  of the program doesn't impact printing done by another part
-        #  of the program
-        # So this way it's both backwards-compatible and easier to mix the two
-        char = chr(ascii_value)
-        print(char, end='')
-        if char == '\n':
-            self.is_line_mode = False
-        else:
-            self.is_line_mode = True
-
-    def read_num(self) -> int:
-        num_range = self.interp.value_range
-        while True:
-            try:
-                value = int(input(self.interp.inp_prompt))
-            except ValueError:
-                print('Input must be an integer')
-                continue
-            if not self.interp.wrap_values:
-                return value  # allow any value if no wrap_values
-            if num_range[0] <= value <= num_range[1]:
-                return value
-            else:
-                print('Input out of range')
+_FDE_METHODS = ('fetch', 'decode', 'execute', 'get', 'set', 'acc', 'jmp',
+                'normalize_addr', 'normalize_value', 'normalize_ip')
+
+
+_DECODED_WORDS: dict[int, tuple[int, int]] = {}
+
+
+def _decode_word(word: int) -> tuple[int, int]:
+    if len(_DECODED_WORDS) >= DECODED_WORDS_MAX:
+        _DECODED_WORDS.clear()  # e.g. self-modifying code
+    decoded = _DECODED_WORDS[word] = InterpB2.split_word(word)
+    return decoded
+
+
+def _zeros(n: int) -> array:
+    return array(WORD_TYPECODE, bytes(n * WORD_SIZE))
+
+
+def _overrides_fde_methods(cls: type[InterpB2]) -> bool:
+    return any(getattr(cls, name) is not getattr(InterpB2, name)
+               for name in _FDE_METHODS)
+
+
+class IOMgrB2(IOMgr):
+    """Same as ``IOMgr``, kept so that existing code using it still works"""
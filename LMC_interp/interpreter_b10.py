@@ -13,20 +13,36 @@ Features:
   - Run text source code using ``InterpreterB10.from_source(...)``,
     see ``AsmParser``
   - Run list[Data | Instruction] using ``Interpreter.from_instr_list()``,
-    this is mainly for programmatic use"""
+    this is mainly for programmatic use
+
+- Multiple execution engines, see ``LMC_interp.engines``
+- Optional predecoding (``predecode=True``) where the memory is decoded
+  once up front and only cells that are written to get decoded again"""
 from __future__ import annotations
 
-from typing import Self
+from typing import Self, Iterable, Callable, TYPE_CHECKING
 
-from LMC_interp.base_instruction import Instruction
+from LMC_interp.base_instruction import Instruction, INSTR_DISPATCH
+from LMC_interp.compiled import CompiledProgram, compile_source
 from LMC_interp.data_instruction import Data
+from LMC_interp.engines import (
+    EngineT, EngineState, ENGINE_FDE, ENGINE_NATIVE, check_engine,
+    get_engine_runner)
 from LMC_interp.errors import (
-    ProgramOOBError, ProgramIpOOB, ProgramReadOOB, ProgramWriteOOB,
-    ProgramJmpOOB, ExtensionDisabledError)
+    ProgramOOBError, ExtensionDisabledError, InputNotReadyError,
+    make_ip_oob, make_read_oob, make_write_oob, make_jmp_oob)
 from LMC_interp.instruction_conv import instructions_to_memory
-from LMC_interp.instructions import ensure_instr_registered
+from LMC_interp.instructions import (
+    ensure_instr_registered, STANDARD_INSTR_CLASSES)
 from LMC_interp.io_mgr import IOMgr
-from LMC_interp.parse_asm import AsmParser
+from LMC_interp.run_status import (
+    RunStatusT, STATUS_HALTED, STATUS_NEEDS_INPUT, STATUS_BUDGET_EXHAUSTED)
+from LMC_interp.specialised_loops import get_run_loop, RunLoopT
+
+if TYPE_CHECKING:
+    # (imported when needed, see LMC_interp.__main__)
+    from LMC_interp.batch import BatchResult
+    from LMC_interp.snapshot import Snapshot
 
 
 class InterpreterB10:
@@ -37,12 +53,25 @@ class InterpreterB10:
     # region init
     def __init__(self, initial_memory: list[int] | None = None,
                  wrap_memory=False, wrap_values=True, extensions=True,
-                 inp_prompt='>? '):
+                 inp_prompt='>? ', predecode=False,
+                 engine: EngineT = ENGINE_FDE):
+        check_engine(engine)
+        if predecode and engine != ENGINE_FDE:
+            raise ValueError("predecode is only supported by the 'fde' engine")
+        if engine == ENGINE_NATIVE:
+            raise ValueError("The 'native' engine only supports InterpB2")
+        self.engine = engine
         self.wrap_memory = wrap_memory
         self.wrap_values = wrap_values
         self.extensions = extensions
         self.inp_prompt = inp_prompt
+        self._value_lo = self.value_range[0]
+        self._value_mod = self.value_range[1] - self.value_range[0] + 1
         self.memory = self._make_memory_obj(initial_memory)
+        self.dirty_cells: set[int] = set()
+        """Addresses written to since the last ``snapshot()``/``restore()``"""
+        self._dirty_base: tuple[Snapshot, list[int]] | None = None
+        """The snapshot (and memory) that ``dirty_cells`` is relative to"""
         self.io = IOMgr(self)
         self.ip = 0
         """Instruction pointer (PC)"""
@@ -53,6 +82,15 @@ class InterpreterB10:
         self.is_halted = False
         self.decoded_instr: Instruction | None = None
         self.n_instr = 0
+        self.predecode = predecode
+        self.decoded_cache: list[Instruction | None] | None = (
+            self._predecode_memory() if predecode else None)
+        """Runnable instruction for each memory cell (None = needs decoding).
+        Only used if ``predecode`` is enabled."""
+        self._run_loop: RunLoopT | None = self._pick_run_loop()
+        """Main loop specialised for this config (None to use the FDE methods)"""
+        self._engine_state: EngineState | None = None
+        """What the engine compiled (kept between runs)"""
 
     def _make_memory_obj(self, initial_memory: list[int] | None) -> list[int]:
         if initial_memory is None:
@@ -63,19 +101,97 @@ class InterpreterB10:
         extra_padding = self.memory_size - len(initial_memory)
         return initial_memory + [0] * extra_padding
 
+    def _pick_run_loop(self, budget: bool = False) -> RunLoopT | None:
+        if self.predecode or _overrides_fde_methods(type(self)):
+            return None  # these need to go through the normal methods
+        return get_run_loop('b10', self.wrap_memory, self.wrap_values,
+                            self.extensions, self.value_range, budget)
+
+    def _predecode_memory(self) -> list[Instruction]:
+        return [self._decode_runnable(op) for op in self.memory]
+
+    @classmethod
+    def _decode_runnable(cls, op: int) -> Instruction:
+        return Instruction.get_runnable_shared(op)
+
     @classmethod
     def from_instr_list(cls, instructions: list[int | Instruction | Data],
                         wrap_memory=False, wrap_values=True,
-                        extensions=True, inp_prompt: str = '>? ') -> Self:
+                        extensions=True, inp_prompt: str = '>? ',
+                        predecode=False, engine: EngineT = ENGINE_FDE) -> Self:
         return cls(instructions_to_memory(instructions),
-                   wrap_memory, wrap_values, extensions, inp_prompt)
+                   wrap_memory, wrap_values, extensions, inp_prompt, predecode,
+                   engine)
 
     @classmethod
     def from_source(cls: type[Self], source: str, wrap_memory=False, wrap_values=True,
                     extensions=True, append_hlt=False,
-                    inp_prompt: str = '>? ') -> Self:
-        p = AsmParser(source, extensions, append_hlt).parse()
-        return cls(p.memory, wrap_memory, wrap_values, extensions, inp_prompt)
+                    inp_prompt: str = '>? ', predecode=False,
+                    engine: EngineT = ENGINE_FDE, optimize=False) -> Self:
+        """``optimize`` runs ``LMC_interp.optimizer`` on the program"""
+        prog = compile_source(source, extensions, append_hlt, optimize=optimize)
+        return cls.from_compiled(prog, wrap_memory, wrap_values, inp_prompt,
+                                 predecode, engine)
+
+    @classmethod
+    def from_compiled(cls: type[Self], prog: CompiledProgram, wrap_memory=False,
+                      wrap_values=True, inp_prompt: str = '>? ',
+                      predecode=False, engine: EngineT = ENGINE_FDE) -> Self:
+        """Load a program compiled by ``LMC_interp.compiled``
+        (e.g. from a ``.lmco`` file)"""
+        return cls(list(prog.memory), wrap_memory, wrap_values,
+                   prog.extensions, inp_prompt, predecode, engine)
+
+    @classmethod
+    def run_batch(cls, program: str | list[int],
+                  inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+        """Parse ``program`` (source or memory) once and run it with each of
+        the ``inputs``, see ``LMC_interp.batch.run_batch``"""
+        from LMC_interp.batch import run_batch
+        return run_batch(cls, program, inputs, **kwargs)
+
+    @classmethod
+    def run_lockstep(cls, program: str | list[int],
+                     inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+        """Same as ``run_batch`` but runs all the inputs at once using NumPy,
+        see ``LMC_interp.lockstep`` (needs numpy)"""
+        from LMC_interp.lockstep import run_lockstep
+        return run_lockstep(cls, program, inputs, **kwargs)
+
+    def reset(self, initial_memory: list[int] | None = None):
+        """Reset the registers and I/O state so that the program can be run
+        again. The memory is also reset if ``initial_memory`` is passed."""
+        if initial_memory is not None:
+            self.memory = self._make_memory_obj(initial_memory)
+            self._dirty_base = None
+            self._engine_state = None
+            if self.decoded_cache is not None:
+                self.decoded_cache = self._predecode_memory()
+        self.ip = 0
+        self.cir = None
+        self.acc_internal = 0
+        self.is_halted = False
+        self.decoded_instr = None
+        self.n_instr = 0
+        self.io.is_line_mode = False
+
+    def snapshot(self) -> Snapshot:
+        """Save the memory, registers and I/O line mode, see
+        ``LMC_interp.snapshot``"""
+        from LMC_interp.snapshot import take_snapshot
+        return take_snapshot(self)
+
+    def restore(self, snap: Snapshot):
+        """Go back to ``snap``. Only the memory cells that the program wrote
+        to are copied if ``snap`` is the latest snapshot taken/restored."""
+        from LMC_interp.snapshot import restore_snapshot
+        restored = restore_snapshot(self, snap)
+        if self.decoded_cache is not None:
+            if restored is None:
+                self.decoded_cache = self._predecode_memory()
+            else:
+                for addr in restored:
+                    self.decoded_cache[addr] = None
 
     # endregion
 
@@ -89,26 +205,82 @@ class InterpreterB10:
         self.n_instr += 1
 
     def decode(self):
-        self.decoded_instr: Instruction = Instruction.get_instr(self.cir)
+        if self.decoded_cache is None:
+            # (shared instances so that nothing is allocated on each step)
+            self.decoded_instr: Instruction = self._decode_runnable(self.cir)
+            return
+        addr = self.ip - 1  # fetch() has already moved the ip on
+        instr = self.decoded_cache[addr]
+        if instr is None:  # cell was written to since it was decoded
+            instr = self.decoded_cache[addr] = self._decode_runnable(self.cir)
+        self.decoded_instr = instr
 
     def execute(self):
         self.decoded_instr.run(self)
 
-    def run(self):
-        while not self.is_halted:
-            self.fetch()
-            self.decode()
-            self.execute()
+    def run(self, max_steps: int | None = None) -> RunStatusT:
+        """Run the program until it halts or (if ``max_steps`` is passed)
+        until ``max_steps`` instructions have been run. Returns why it
+        stopped (see ``LMC_interp.run_status``), it can be resumed by
+        calling ``run()`` again unless it halted."""
+        if self.is_halted:
+            return STATUS_HALTED
+        stop_n = None if max_steps is None else self.n_instr + max_steps
+        try:
+            if self.engine != ENGINE_FDE:
+                get_engine_runner(self.engine)(self, stop_n)
+            elif (loop := self._get_run_loop(stop_n)) is not None:
+                loop(self, stop_n)
+            else:
+                self._run_fde(stop_n)
+        except InputNotReadyError:
+            # Undo the fetch so that the INP is run again when resumed
+            self.ip -= 1
+            self.n_instr -= 1
+            return STATUS_NEEDS_INPUT
+        finally:
+            self.io.flush()
+        return STATUS_HALTED if self.is_halted else STATUS_BUDGET_EXHAUSTED
+
+    def _get_run_loop(self, stop_n: int | None) -> RunLoopT | None:
+        if self._run_loop is None or not _is_standard_dispatch():
+            return None  # (custom instructions) need to use the FDE methods
+        return self._run_loop if stop_n is None else self._pick_run_loop(budget=True)
+
+    def _run_fde(self, stop_n: int | None):
+        if stop_n is None:
+            while not self.is_halted:
+                self.fetch()
+                self.decode()
+                self.execute()
+        else:
+            while not self.is_halted and self.n_instr < stop_n:
+                self.fetch()
+                self.decode()
+                self.execute()
     # endregion
 
+    @classmethod
+    def split_word(cls, op: int) -> tuple[int, int] | None:
+        """Split ``op`` into (opcode, operand). Returns None if it isn't
+        handled by one of the standard instructions (e.g. invalid opcodes,
+        custom registered instructions). Used by the other engines."""
+        if not 0 <= op < 1000:
+            return None
+        if Instruction.get_instr_cls(op) not in STANDARD_INSTR_CLASSES:
+            return None
+        return divmod(op, 100)
+
     # region  utils used by *Instr
     def get(self, addr: int) -> int:
-        err = ProgramReadOOB("Attempt to read outside of memory", hint_wrap_memory=True)
-        return self.memory[self.normalize_addr(addr, err)]
+        return self.memory[self.normalize_addr(addr, make_read_oob)]
 
     def set(self, addr: int, value: int):
-        err = ProgramWriteOOB("Attempt to write outside of memory", hint_wrap_memory=True)
-        self.memory[self.normalize_addr(addr, err)] = self.normalize_value(value)
+        addr = self.normalize_addr(addr, make_write_oob)
+        self.memory[addr] = self.normalize_value(value)
+        self.dirty_cells.add(addr)
+        if self.decoded_cache is not None:
+            self.decoded_cache[addr] = None  # (possibly) self-modifying code
 
     @property
     def acc(self) -> int:
@@ -119,8 +291,7 @@ class InterpreterB10:
         self.acc_internal = self.normalize_value(value)
 
     def jmp(self, addr: int):
-        err = ProgramJmpOOB("Program branched outside of memory", hint_wrap_memory=True)
-        self.ip = self.normalize_addr(addr, err)
+        self.ip = self.normalize_addr(addr, make_jmp_oob)
     # endregion
 
     # region extensions: ext_otc__*
@@ -138,31 +309,44 @@ class InterpreterB10:
     def is_addr_in_bounds(self, addr: int) -> bool:
         return 0 <= addr < len(self.memory)
 
-    def normalize_addr(self, addr: int, err: Exception = None) -> int:
+    def normalize_addr(self, addr: int,
+                       err: Exception | Callable[[], Exception] = None) -> int:
+        """``err`` is raised if ``addr`` is out of bounds (and memory doesn't
+        wrap). Pass a function that makes the error to only make it then."""
         if self.is_addr_in_bounds(addr):
             return addr
         if self.wrap_memory:
             return addr % len(self.memory)
-        raise err if err is not None else ProgramOOBError(
-            "Attempt to access out-of-bounds memory")
+        if err is None:
+            raise ProgramOOBError("Attempt to access out-of-bounds memory")
+        raise err() if callable(err) else err
 
     def normalize_value(self, value: int) -> int:  # noexcept
         if self.wrap_values:
-            # convert desired -999..=999 -> 0..=(999+999)
-            value -= self.value_range[0]
-            # end_incl = 999+999 = 999 - (-999)
-            maxvalue_incl = self.value_range[1] - self.value_range[0]
-            maxvalue_excl = maxvalue_incl + 1
-            value %= maxvalue_excl
-            # convert back to orig range
-            value += self.value_range[0]
+            # convert desired -999..=999 -> 0..=(999+999), wrap it
+            #  (_value_mod = 999+999 + 1) then convert back to orig range
+            value = (value - self._value_lo) % self._value_mod + self._value_lo
         return value
 
     def normalize_ip(self):
-        err = ProgramIpOOB("Instruction pointer went outside of memory",
-                           hint_wrap_memory=True)
-        self.ip = self.normalize_addr(self.ip, err)
+        self.ip = self.normalize_addr(self.ip, make_ip_oob)
     # endregion
 
 
+_FDE_METHODS = ('fetch', 'decode', 'execute', 'get', 'set', 'acc', 'jmp',
+                'normalize_addr', 'normalize_value', 'normalize_ip')
+
+
+def _overrides_fde_methods(cls: type[InterpreterB10]) -> bool:
+    return any(getattr(cls, name) is not getattr(InterpreterB10, name)
+               for name in _FDE_METHODS)
+
+
+def _is_standard_dispatch() -> bool:
+    """Checks that no custom instructions have been registered over the
+    standard ones (the specialised loop only knows about those)"""
+    return all(INSTR_DISPATCH.get(cls.get_b10_opcode()) is cls
+               for cls in STANDARD_INSTR_CLASSES)
+
+
 ensure_instr_registered()
@@ -1,19 +1,47 @@
 from __future__ import annotations
 
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
+
+from LMC_interp.errors import InputExhaustedError, InputNotReadyError
+from LMC_interp.io_sinks import OutputSink, StdoutSink, TextListSink
+from LMC_interp.io_sources import InputSource, make_source
 
 if TYPE_CHECKING:
     from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
 
 
 # noinspection PyMethodMayBeStatic
 class IOMgr:
-    def __init__(self, interp: InterpreterB10):
+    def __init__(self, interp: InterpreterB10 | InterpB2,
+                 sink: OutputSink | None = None,
+                 source: InputSource | None = None, wait_for_input: bool = False):
         self.interp = interp  # just for the config (e.g. value_range)
+        self.sink = sink if sink is not None else StdoutSink()
+        """Where the output goes, see ``LMC_interp.io_sinks``"""
+        self.source: InputSource | None = None
+        """Where the input comes from, see ``LMC_interp.io_sources``
+        (None to ask the user using ``input()``)"""
+        if source is not None:
+            self.set_source(source)
+        self.wait_for_input = wait_for_input
+        """If True, running out of input makes ``run()`` return
+        ``STATUS_NEEDS_INPUT`` instead of being an error"""
         self.is_line_mode = False
 
+    def set_source(self, source: InputSource):
+        source.set_range(self.interp.value_range if self.interp.wrap_values
+                         else None)  # allow any value if no wrap_values
+        self.source = source
+
+    def write_text(self, text: str):
+        self.sink.write(text)
+
+    def flush(self):
+        self.sink.flush()
+
     def write_num(self, num: int):
-        print(num, end='' if self.is_line_mode else '\n')
+        self.sink.write_num(num, f'{num}' if self.is_line_mode else f'{num}\n')
 
     def write_char(self, ascii_value: int):
         # This function starts a 'line' if not already started and
@@ -29,14 +57,26 @@ class IOMgr:
         #  of the program doesn't impact printing done by another part of the program
         # So this way it's both backwards-compatible and easier to mix the two
         char = chr(ascii_value)
-        print(char, end='')
+        self.sink.write_char(ascii_value, char)
         if char == '\n':
             self.is_line_mode = False
         else:
             self.is_line_mode = True
 
     def read_num(self) -> int:
+        if self.source is None:
+            return self._read_num_interactive()
+        value = self.source.read()
+        if value is None:
+            if self.wait_for_input:
+                raise InputNotReadyError("Waiting for input")
+            raise InputExhaustedError("Program tried to read more input "
+                                      "than was provided")
+        return value
+
+    def _read_num_interactive(self) -> int:
         num_range = self.interp.value_range
+        self.flush()  # so that any output is shown before the prompt
         while True:
             try:
                 value = int(input(self.interp.inp_prompt))
@@ -49,3 +89,24 @@ class IOMgr:
                 return value
             else:
                 print('Input out of range')
+
+
+class ListIOMgr(IOMgr):
+    """Reads the inputs from a list (or any iterable) and collects the
+    output in memory instead of using stdin/stdout.
+
+    If ``wait_for_input`` is True, running out of inputs makes ``run()``
+    return ``STATUS_NEEDS_INPUT`` (more can then be added using ``feed()``)
+    instead of being an error."""
+    def __init__(self, interp: InterpreterB10 | InterpB2,
+                 inputs: Iterable[int] = (), wait_for_input: bool = False):
+        super().__init__(interp, TextListSink(), make_source(inputs),
+                         wait_for_input)
+
+    def feed(self, values: Iterable[int]):
+        """Add more inputs (after the existing ones)"""
+        self.source.feed(values)
+
+    @property
+    def output(self) -> str:
+        return self.sink.text
@@ -0,0 +1,108 @@
+"""Where the output of OUT/OTC goes (see ``IOMgr(interp, sink=...)``).
+
+``IOMgr`` deals with the formatting (including the 'line mode' of OTC) and
+passes each output to the sink as both the value and the formatted text,
+so a sink can use whichever one it wants."""
+from __future__ import annotations
+
+import abc
+import sys
+from typing import Callable, TextIO
+
+BUFFER_SIZE_DEFAULT = 64 * 1024
+
+
+class OutputSink(abc.ABC):
+    """Base class for output sinks. Subclasses need to implement ``write()``
+    (and can override ``write_num()``/``write_char()`` to use the values)."""
+
+    def write_num(self, num: int, text: str):
+        """Called for OUT. ``text`` is what would be printed."""
+        self.write(text)
+
+    def write_char(self, value: int, text: str):
+        """Called for OTC. ``text`` is what would be printed."""
+        self.write(text)
+
+    @abc.abstractmethod
+    def write(self, text: str):
+        ...
+
+    def flush(self):
+        """Called at the end of ``run()`` and before reading input"""
+
+
+class StdoutSink(OutputSink):
+    """Writes straight to ``sys.stdout`` (looked up each time so that
+    redirecting ``sys.stdout`` still works). This is the default."""
+
+    def write(self, text: str):
+        sys.stdout.write(text)
+
+
+class BufferedTextSink(OutputSink):
+    """Collects the output and writes it to ``stream`` (``sys.stdout``
+    by default) in big chunks"""
+
+    def __init__(self, stream: TextIO | None = None,
+                 buffer_size: int = BUFFER_SIZE_DEFAULT):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.parts: list[str] = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write(''.join(self.parts))
+            self.parts = []
+            self.size = 0
+
+
+class TextListSink(OutputSink):
+    """Keeps all the output in memory, see ``.text``"""
+
+    def __init__(self):
+        self.parts: list[str] = []
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+    def write(self, text: str):
+        self.parts.append(text)
+
+
+class IntListSink(OutputSink):
+    """Collects the numbers output by OUT (and the character codes output by
+    OTC if ``include_chars`` is True) instead of the text"""
+
+    def __init__(self, include_chars: bool = False):
+        self.include_chars = include_chars
+        self.values: list[int] = []
+
+    def write_num(self, num: int, text: str):
+        self.values.append(num)
+
+    def write_char(self, value: int, text: str):
+        if self.include_chars:
+            self.values.append(value)
+
+    def write(self, text: str):
+        pass  # (not used, write_num() and write_char() don't call it)
+
+
+class CallbackSink(OutputSink):
+    """Calls ``callback(text)`` for each output"""
+
+    def __init__(self, callback: Callable[[str], object]):
+        self.callback = callback
+
+    def write(self, text: str):
+        self.callback(text)
@@ -0,0 +1,199 @@
+"""Where the input for INP comes from (see ``IOMgr(interp, source=...)``).
+
+The values are checked against the interpreter's ``value_range`` in bulk
+when they are added to the source instead of on every INP. A value that is
+out of range is still only an error when the program gets to it."""
+from __future__ import annotations
+
+import abc
+import itertools
+from array import array
+from typing import BinaryIO, Iterable, Iterator, Sequence, TextIO
+
+from LMC_interp.errors import InputOutOfRangeError, InvalidInputError
+
+CHUNK_SIZE_DEFAULT = 64 * 1024
+
+
+def find_out_of_range(values: Sequence[int], value_range: tuple[int, int] | None,
+                      start: int = 0) -> int:
+    """Returns the index of the first value (from ``start`` onwards)
+    that isn't in ``value_range`` (``len(values)`` if they all are)"""
+    n = len(values)
+    if value_range is None or start >= n:
+        return n
+    lo, hi = value_range
+    rest = values[start:] if start else values
+    if lo <= min(rest) and max(rest) <= hi:
+        return n  # the usual case, so check it quickly first
+    for i in range(start, n):
+        if not lo <= values[i] <= hi:
+            return i
+    return n  # unreachable
+
+
+def _as_list(values: Iterable[int]) -> list[int]:
+    # .tolist() so that numpy arrays give Python ints
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+class InputSource(abc.ABC):
+    """Base class for input sources. Subclasses need to implement ``read()``"""
+
+    def set_range(self, value_range: tuple[int, int] | None):
+        """Set the range that the values need to be in (None for any value).
+        This is done by ``IOMgr`` so doesn't usually need to be called."""
+
+    @abc.abstractmethod
+    def read(self) -> int | None:
+        """Returns the next value (None if there isn't one, at least for now).
+        Raises ``InputOutOfRangeError`` if it isn't in the range."""
+        ...
+
+    def feed(self, values: Iterable[int]):
+        """Add more values (after the existing ones)"""
+        raise TypeError(f"Can't add values to a {type(self).__name__}")
+
+
+class ArraySource(InputSource):
+    """Reads the values from a list, tuple, ``array`` (or numpy array).
+    Everything is range-checked up front so reading is just indexing."""
+
+    def __init__(self, values: Sequence[int]):
+        if not isinstance(values, (list, tuple, range, array)):
+            values = _as_list(values)
+        self.values = values
+        self.pos = 0
+        self.value_range: tuple[int, int] | None = None
+        self.n_valid = len(values)
+        """All the values before this index are in range"""
+
+    def set_range(self, value_range: tuple[int, int] | None):
+        self.value_range = value_range
+        self.n_valid = find_out_of_range(self.values, value_range, self.pos)
+
+    def read(self) -> int | None:
+        pos = self.pos
+        if pos < self.n_valid:
+            self.pos = pos + 1
+            return self.values[pos]
+        if pos < len(self.values):
+            raise InputOutOfRangeError(f"Input out of range: {self.values[pos]}")
+        return None
+
+    def feed(self, values: Iterable[int]):
+        old_len = len(self.values)
+        new = _as_list(self.values[self.pos:])
+        new.extend(_as_list(values))
+        n_valid = self.n_valid - self.pos
+        if self.n_valid == old_len:  # only need to check the new values
+            n_valid = find_out_of_range(new, self.value_range, n_valid)
+        self.values = new
+        self.pos = 0
+        self.n_valid = n_valid
+
+
+class IterableSource(InputSource):
+    """Reads the values lazily from any iterable (e.g. a generator).
+    As the values aren't known in advance, each one is checked as it is read
+    so use ``ArraySource`` if possible."""
+
+    def __init__(self, values: Iterable[int]):
+        self.values: Iterator[int] = iter(values)
+        self.value_range: tuple[int, int] | None = None
+
+    def set_range(self, value_range: tuple[int, int] | None):
+        self.value_range = value_range
+
+    def read(self) -> int | None:
+        value = next(self.values, None)
+        if value is not None and self.value_range is not None:
+            lo, hi = self.value_range
+            if not lo <= value <= hi:
+                raise InputOutOfRangeError(f"Input out of range: {value}")
+        return value
+
+    def feed(self, values: Iterable[int]):
+        self.values = itertools.chain(self.values, values)
+
+
+class StreamIntSource(InputSource):
+    """Reads whitespace-separated integers from a (text or binary) file or
+    pipe. The stream is read ``chunk_size`` at a time and each chunk is
+    parsed and range-checked all at once.
+
+    NOTE: this waits for a whole chunk (or the end of the stream) before
+    returning anything so isn't suitable for interactive input."""
+
+    def __init__(self, stream: TextIO | BinaryIO,
+                 chunk_size: int = CHUNK_SIZE_DEFAULT):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.value_range: tuple[int, int] | None = None
+        self.values: list[int] = []
+        self.pos = 0
+        self.n_valid = 0
+        self.partial: str | bytes = ''
+        """The start of a number that was cut off at the end of the chunk"""
+        self.is_eof = False
+
+    def set_range(self, value_range: tuple[int, int] | None):
+        self.value_range = value_range
+        self.n_valid = find_out_of_range(self.values, value_range, self.pos)
+
+    def read(self) -> int | None:
+        pos = self.pos
+        if pos < self.n_valid:
+            self.pos = pos + 1
+            return self.values[pos]
+        if pos < len(self.values):
+            raise InputOutOfRangeError(f"Input out of range: {self.values[pos]}")
+        if not self._read_chunk():
+            return None
+        return self.read()
+
+    def _read_chunk(self) -> bool:
+        """Load the next values, returns False at the end of the stream"""
+        tokens = []
+        while not tokens:
+            if self.is_eof:
+                return False
+            data = self.stream.read(self.chunk_size)
+            if not data:
+                self.is_eof = True
+                tokens = self.partial.split()
+                self.partial = self.partial[:0]
+                continue
+            data = self.partial + data if self.partial else data
+            tokens = data.split()
+            if tokens and not data[-1:].isspace():
+                self.partial = tokens.pop()  # might continue in the next chunk
+            else:
+                self.partial = data[:0]
+        try:
+            values = list(map(int, tokens))
+        except ValueError:
+            bad = next(t for t in tokens if not _is_int(t))
+            raise InvalidInputError(f"Input must be an integer: {bad!r}") from None
+        self.values = values
+        self.pos = 0
+        self.n_valid = find_out_of_range(values, self.value_range)
+        return True
+
+
+def _is_int(token: str | bytes) -> bool:
+    try:
+        int(token)
+    except ValueError:
+        return False
+    return True
+
+
+def make_source(inputs: Iterable[int] | InputSource) -> InputSource:
+    """Returns an ``ArraySource`` for sequences and arrays
+    and an ``IterableSource`` for any other iterable"""
+    if isinstance(inputs, InputSource):
+        return inputs
+    if isinstance(inputs, (Sequence, array)) or hasattr(inputs, 'tolist'):
+        return ArraySource(inputs)
+    return IterableSource(inputs)
@@ -0,0 +1,329 @@
+"""NumPy lockstep engine: runs many instances ('lanes') of one program
+at once, each with its own inputs.
+
+The accumulators, instruction pointers, instruction counts and memories of
+all the lanes are NumPy arrays and each step is run for all the lanes
+together, grouped by opcode, so a step is a handful of array operations
+instead of one Python dispatch per lane.
+
+Lanes that halt are masked out. Lanes that get to anything unusual
+(anything that raises, running out of inputs, custom instructions, ...)
+also drop out of the lockstep and are finished off one at a time by the
+normal interpreter, so the results (output, ``n_instr`` and errors) are
+exactly the same as with ``run_batch``.
+
+This needs ``numpy`` to be installed."""
+from __future__ import annotations
+
+from typing import Iterable, TYPE_CHECKING, TypeVar
+
+try:
+    import numpy as np
+except ImportError as _e:
+    raise ImportError("The lockstep engine needs numpy "
+                      "(install it using `pip install numpy`)") from _e
+
+from LMC_interp.batch import BatchResult, make_interp, run_batch_on
+from LMC_interp.io_mgr import ListIOMgr
+from LMC_interp.io_sources import ArraySource, find_out_of_range
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+_InterpT = TypeVar('_InterpT', 'InterpreterB10', 'InterpB2')
+
+LANE_MEMORY_BUDGET = 64 * 1024 * 1024
+"""Max number of bytes of lane memory to have at once, the lanes are run in
+chunks to stay below this"""
+LANE_MEMORY_MARGIN = 4096
+"""Each lane only gets its own copy of the memory up to this many words
+after the end of the program (InterpB2 has a lot of mostly unused memory).
+The rest is shared and lanes that try to write to it are finished by
+the interpreter instead."""
+_INVALID = 4  # not a valid opcode on either ISA
+# What each opcode does, indexed by opcode:
+# new acc = acc * _ACC_COEF + (memory value) * _VALUE_COEF
+_ACC_COEF = np.array([1, 1, 1, 1, 1, 0, 1, 1, 1, 1], np.int64)
+_VALUE_COEF = np.array([0, 1, -1, 0, 0, 1, 0, 0, 0, 0], np.int64)
+_BR_ALWAYS = np.arange(10) == 6
+_BR_ZERO = np.arange(10) == 7
+_BR_POS = np.arange(10) == 8
+_MAX_CHAR = 0x10FFFF
+_MAX_CELL = 2 ** 62
+"""Memory values are added to the acc (which is in the value range), this
+leaves room for that without overflowing int64"""
+
+
+def run_lockstep(cls: type[_InterpT], program: str | list[int],
+                 inputs: Iterable[Iterable[int]], **kwargs) -> list[BatchResult]:
+    """Same as ``run_batch`` but runs all the input vectors in lockstep.
+    Configs that can't be vectorised (``wrap_values=False``, subclasses
+    overriding the fetch/decode/execute methods) just use ``run_batch``."""
+    interp = make_interp(cls, program, **kwargs)
+    if not _can_vectorise(interp):
+        return run_batch_on(interp, inputs)
+    return LockstepRunner(interp, [list(run_inputs) for run_inputs in inputs]).run()
+
+
+def _can_vectorise(interp: InterpreterB10 | InterpB2) -> bool:
+    from LMC_interp import interpreter_b10, interp_b2_quick_and_dirty
+    if not interp.wrap_values:
+        return False  # values could get too big for int64
+    if not -_MAX_CELL <= min(interp.memory) <= max(interp.memory) <= _MAX_CELL:
+        return False  # some really big DATs, not worth vectorising
+    if isinstance(interp, interp_b2_quick_and_dirty.InterpB2):
+        return not interp_b2_quick_and_dirty._overrides_fde_methods(type(interp))
+    return not interpreter_b10._overrides_fde_methods(type(interp))
+
+
+class LockstepRunner:
+    def __init__(self, interp: InterpreterB10 | InterpB2,
+                 inputs: list[list[int]]):
+        from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+        self.interp = interp
+        """Used for the config and to finish off lanes that diverge"""
+        self.inputs = inputs
+        self.is_b2 = isinstance(interp, InterpB2)
+        self.size = len(interp.memory)
+        self.wrap_memory = interp.wrap_memory
+        self.otc_enabled = interp.ext_otc__enabled()
+        self.value_lo = interp.value_range[0]
+        self.value_mod = interp.value_range[1] - self.value_lo + 1
+        self.base_memory = self._make_base_memory()
+        self.width = min(self.size, _program_end(self.base_memory) + LANE_MEMORY_MARGIN)
+        """Number of words of memory that each lane has its own copy of"""
+        if not self.is_b2:
+            # opcode for each of 0..999 (_INVALID if not a standard instr)
+            self.b10_opcodes = np.array(
+                [_INVALID if (s := interp.split_word(op)) is None else s[0]
+                 for op in range(1000)], np.int64)
+        self.results: list[BatchResult | None] = [None] * len(inputs)
+
+    def _make_base_memory(self):
+        memory = np.array(self.interp.memory, np.int64)
+        i32 = np.iinfo(np.int32)
+        if i32.min <= memory.min() and memory.max() <= i32.max:
+            return memory.astype(np.int32)
+        return memory
+
+    def run(self) -> list[BatchResult]:
+        lane_bytes = self.width * self.base_memory.itemsize
+        chunk_size = max(1, LANE_MEMORY_BUDGET // lane_bytes)
+        for start in range(0, len(self.inputs), chunk_size):
+            self._run_chunk(range(start, min(start + chunk_size, len(self.inputs))))
+        return self.results
+
+    def _load_inputs(self, lanes: range):
+        """Returns (padded 2d array of inputs, number usable for each lane).
+        A lane stops being usable at the first value out of range,
+        it then gets finished by the interpreter (which raises the error)"""
+        value_range = self.interp.value_range
+        usable = [find_out_of_range(self.inputs[i], value_range) for i in lanes]
+        width = max(usable, default=0) + 1  # +1 so that indexing never fails
+        arr = np.zeros((len(lanes), width), np.int64)
+        for j, i in enumerate(lanes):
+            arr[j, :usable[j]] = self.inputs[i][:usable[j]]
+        return arr, np.array(usable, np.int64)
+
+    def _decode(self, cir):
+        if self.is_b2:
+            opcode = cir >> 27
+            operand = cir & 0x07_FF_FF_FF
+            opcode[(opcode < 0) | (opcode > 9)] = _INVALID
+            return opcode, operand
+        valid = (cir >= 0) & (cir < 1000)
+        opcode = np.where(valid, self.b10_opcodes[np.where(valid, cir, 0)],
+                          _INVALID)
+        return opcode, cir % 100
+
+    def _read(self, mem, base, addr):
+        if self.width == self.size:
+            return mem[base + addr]
+        own = addr < self.width
+        return np.where(own, mem[base + np.where(own, addr, 0)],
+                        self.base_memory[addr])
+
+    def _wrap(self, values):
+        return (values - self.value_lo) % self.value_mod + self.value_lo
+
+    # This is one big function to keep all the arrays as locals
+    def _run_chunk(self, lanes: range):
+        size = self.size
+        width = self.width
+        n_lanes = len(lanes)
+        # flattened (lane, addr)
+        mem = np.tile(self.base_memory[:width], n_lanes)
+        inp, all_inp_len = self._load_inputs(lanes)
+        # The state of the lanes still running in lockstep. Lanes that stop
+        # are removed from these (and their state saved in final_*) so that
+        # every step only deals with the running lanes.
+        lane = np.arange(n_lanes)
+        base = lane * width  # start of each lane's memory in `mem`
+        ip = np.zeros(n_lanes, np.int64)
+        acc = np.zeros(n_lanes, np.int64)
+        n_instr = np.zeros(n_lanes, np.int64)
+        inp_ptr = np.zeros(n_lanes, np.int64)
+        inp_len = all_inp_len
+        final_ip, final_acc, final_n, final_inp_ptr = (
+            np.zeros(n_lanes, np.int64) for _ in range(4))
+        out_log = _OutputLog()
+        halted: list[int] = []
+        diverged: list[int] = []
+        while lane.size:
+            # region fetch + decode
+            if self.wrap_memory:
+                cur_ip = ip % size
+                bad = np.zeros(lane.size, bool)
+            else:
+                bad = ip >= size
+                cur_ip = np.where(bad, 0, ip)
+            opcode, operand = self._decode(self._read(mem, base, cur_ip))
+            if self.wrap_memory:
+                addr = operand % size
+            else:
+                oob = operand >= size
+                bad |= oob & (opcode >= 1) & (opcode <= 8)
+                addr = np.where(oob, 0, operand)
+            bad |= opcode == _INVALID
+            if width < size:
+                bad |= (opcode == 3) & (addr >= width)
+            is_io = opcode == 9
+            if is_io.any():
+                io_ok = (operand == 2) | ((operand == 1) & (inp_ptr < inp_len))
+                if self.otc_enabled:
+                    io_ok |= (operand == 22) & (acc >= 0) & (acc <= _MAX_CHAR)
+                bad |= is_io & ~io_ok
+            if bad.any():
+                # Save them in the state before the fetch so that the
+                # interpreter can run them from there
+                idx = lane[bad]
+                diverged += idx.tolist()
+                final_ip[idx] = ip[bad]
+                final_acc[idx] = acc[bad]
+                final_n[idx] = n_instr[bad]
+                final_inp_ptr[idx] = inp_ptr[bad]
+                keep = ~bad
+                (lane, base, ip, acc, n_instr, inp_ptr, inp_len,
+                 cur_ip, opcode, operand, addr) = (
+                    arr[keep] for arr in (
+                        lane, base, ip, acc, n_instr, inp_ptr, inp_len,
+                        cur_ip, opcode, operand, addr))
+                if not lane.size:
+                    break
+                is_io = opcode == 9
+            n_instr += 1
+            # endregion
+            # region execute
+            # Done for all the lanes at once using the tables for each opcode
+            # instead of selecting the lanes for each opcode separately
+            value = self._read(mem, base, addr)
+            is_sta = opcode == 3
+            if is_sta.any():
+                mem[(base + addr)[is_sta]] = acc[is_sta]
+            taken = (_BR_ALWAYS[opcode] | (_BR_ZERO[opcode] & (acc == 0))
+                     | (_BR_POS[opcode] & (acc >= 0)))
+            next_ip = np.where(taken, addr, cur_ip + 1)
+            acc = self._wrap(acc * _ACC_COEF[opcode] + value * _VALUE_COEF[opcode])
+            if is_io.any():
+                self._run_io(np.flatnonzero(opcode == 9), lane, operand,
+                             acc, inp, inp_ptr, out_log)
+            ip = next_ip
+            is_hlt = opcode == 0
+            if is_hlt.any():
+                idx = lane[is_hlt]
+                halted += idx.tolist()
+                final_n[idx] = n_instr[is_hlt]
+                keep = ~is_hlt
+                lane, base, ip, acc, n_instr, inp_ptr, inp_len = (
+                    arr[keep] for arr in (
+                        lane, base, ip, acc, n_instr, inp_ptr, inp_len))
+            # endregion
+        ios = out_log.make_io_mgrs(self.interp, n_lanes)
+        for j in halted:
+            self.results[lanes[j]] = BatchResult(ios[j].output, int(final_n[j]))
+        for j in diverged:
+            memory = np.concatenate(
+                [mem[j * width:(j + 1) * width], self.base_memory[width:]])
+            self._finish_lane(lanes[j], memory,
+                              int(final_ip[j]), int(final_acc[j]),
+                              int(final_n[j]), ios[j], int(final_inp_ptr[j]))
+
+    @staticmethod
+    def _run_io(idx, lane, operand, acc, inp, inp_ptr, out_log: _OutputLog):
+        """Run the I/O instructions for the lanes at ``idx``"""
+        io_operand = operand[idx]
+        is_inp = io_operand == 1
+        if is_inp.any():
+            sel = idx[is_inp]
+            acc[sel] = inp[lane[sel], inp_ptr[sel]]
+            inp_ptr[sel] += 1
+        if not is_inp.all():
+            sel = idx[~is_inp]
+            out_log.add(lane[sel], acc[sel], io_operand[~is_inp] == 22)
+
+    def _finish_lane(self, i: int, memory, ip: int, acc: int, n_instr: int,
+                     io: ListIOMgr, inp_ptr: int):
+        """Continue running lane ``i`` in the normal interpreter"""
+        interp = self.interp
+        interp.reset(memory.tolist())
+        interp.ip = ip
+        interp.acc_internal = acc
+        interp.n_instr = n_instr
+        io.set_source(ArraySource(self.inputs[i][inp_ptr:]))
+        interp.io = io
+        error = None
+        try:
+            interp.run()
+        except Exception as e:
+            error = e
+        self.results[i] = BatchResult(io.output, interp.n_instr, error)
+
+
+def _program_end(memory) -> int:
+    """Returns the address after the last non-zero word"""
+    nonzero = np.flatnonzero(memory)
+    return int(nonzero[-1]) + 1 if nonzero.size else 0
+
+
+class _OutputLog:
+    """The output (OUT/OTC) of all the lanes in a chunk. This is only turned
+    into text at the end as doing it for each lane as it happens is slow."""
+    def __init__(self):
+        self.lanes = []
+        self.values = []
+        self.is_char = []
+
+    def add(self, lanes, values, is_char):
+        self.lanes.append(lanes)
+        self.values.append(values)
+        self.is_char.append(is_char)
+
+    def make_io_mgrs(self, interp: InterpreterB10 | InterpB2,
+                     n_lanes: int) -> list[ListIOMgr]:
+        """Returns a ListIOMgr for each lane with its output written to it"""
+        ios = [ListIOMgr(interp) for _ in range(n_lanes)]
+        if not self.lanes:
+            return ios
+        lanes = np.concatenate(self.lanes)
+        order = np.argsort(lanes, kind='stable')  # keep the order within a lane
+        values = np.concatenate(self.values)[order].tolist()
+        is_char = np.concatenate(self.is_char)[order]
+        lanes = lanes[order]
+        counts = np.bincount(lanes, minlength=n_lanes).tolist()
+        has_chars = np.bincount(lanes[is_char], minlength=n_lanes).tolist()
+        is_char = is_char.tolist()
+        start = 0
+        for j, count in enumerate(counts):
+            end = start + count
+            if not has_chars[j]:  # fast path, only numbers so 1 per line
+                ios[j].sink.parts = [f'{v}\n' for v in values[start:end]]
+            else:
+                io = ios[j]
+                for v, c in zip(values[start:end], is_char[start:end]):
+                    if c:
+                        io.write_char(v)
+                    else:
+                        io.write_num(v)
+            start = end
+        return ios
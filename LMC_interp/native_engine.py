@@ -0,0 +1,162 @@
+"""Native execution engine (``engine='native'``, InterpB2 only): runs the
+program using the C interpreter from ``LMC_compile`` (through ``ctypes``).
+
+The C code works directly on the interpreter's memory (no copying) and
+tells Python which cells it wrote to (for ``dirty_cells``). Output is
+collected in a buffer and then written using the interpreter's ``io`` so
+the sinks and the OTC line mode work the same. Anything else (input,
+errors, ...) is run by doing a single fetch-decode-execute step on the
+interpreter itself so that the errors (and the state afterwards) are exactly
+the same as with ``engine='fde'``.
+
+This needs the shared library to be built first:
+``python -m LMC_compile.compile -O`` (or ``compile_native()``). Set the
+``LMC_NATIVE_LIB`` environment variable to use a library somewhere else."""
+from __future__ import annotations
+
+import ctypes
+import os
+import sys
+import threading
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+ABI_VERSION = 1
+"""Must be the same as ``LMC_NATIVE_ABI_VERSION`` in lmc_native.c"""
+OUTPUT_BUFFER_SIZE = 4096
+"""Number of outputs to collect before going back to Python to write them"""
+NO_LIMIT = (1 << 64) - 1
+
+# LmcStopT values (see lmc_interp.h) that mean that it halted or ran out
+# of steps (everything else is run by the Python interpreter)
+_STOP_HALTED = 0
+_STOP_BUDGET = 1
+_OUTPUT_FULL = 100
+_OUT = 2
+
+
+class _NativeRun(ctypes.Structure):
+    """Must match ``LmcNativeRunT`` in lmc_native.c"""
+    _fields_ = [
+        ('ip', ctypes.c_uint64),
+        ('n_instr', ctypes.c_uint64),
+        ('acc', ctypes.c_int32),
+        ('is_halted', ctypes.c_uint8),
+        ('wrap_memory', ctypes.c_uint8),
+        ('extensions', ctypes.c_uint8),
+        ('stop_n', ctypes.c_uint64),
+        ('mem', ctypes.POINTER(ctypes.c_int32)),
+        ('mem_len', ctypes.c_uint64),
+        ('out_buf', ctypes.POINTER(ctypes.c_int32)),
+        ('out_cap', ctypes.c_uint64),
+        ('out_len', ctypes.c_uint64),
+        ('dirty_map', ctypes.POINTER(ctypes.c_uint8)),
+        ('dirty_list', ctypes.POINTER(ctypes.c_uint32)),
+        ('n_dirty', ctypes.c_uint64),
+    ]
+
+
+def default_lib_path() -> str:
+    if (path := os.environ.get('LMC_NATIVE_LIB')) is not None:
+        return path
+    if sys.platform == 'win32':
+        name = 'lmc_native.dll'
+    elif sys.platform == 'darwin':
+        name = 'liblmc_native.dylib'
+    else:
+        name = 'liblmc_native.so'
+    # (don't import LMC_compile, it imports distutils)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(root, 'LMC_compile', 'out', 'release', name)
+
+
+def _load_lib(path: str) -> ctypes.CDLL:
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError as e:
+        raise ImportError(
+            f"The native engine needs the C runtime to be built first "
+            f"(using `python -m LMC_compile.compile -O`): {e}") from e
+    lib.LmcNative_abiVersion.restype = ctypes.c_int
+    lib.LmcNative_abiVersion.argtypes = []
+    if (version := lib.LmcNative_abiVersion()) != ABI_VERSION:
+        raise ImportError(f"The native library at {path} is out of date "
+                          f"(ABI version {version}, expected {ABI_VERSION}), "
+                          f"rebuild it using `python -m LMC_compile.compile -O`")
+    lib.LmcNative_run.restype = ctypes.c_int
+    lib.LmcNative_run.argtypes = [ctypes.POINTER(_NativeRun)]
+    return lib
+
+
+_lib = _load_lib(default_lib_path())
+
+
+class _Buffers:
+    """The output and dirty cell buffers (reused between runs)"""
+    def __init__(self, mem_len: int):
+        self.mem_len = mem_len
+        self.out_buf = (ctypes.c_int32 * (2 * OUTPUT_BUFFER_SIZE))()
+        self.dirty_map = (ctypes.c_uint8 * mem_len)()
+        self.dirty_list = (ctypes.c_uint32 * mem_len)()
+
+
+_local = threading.local()  # (the GIL is released while the C code runs)
+
+
+def _get_buffers(mem_len: int) -> _Buffers:
+    buffers: _Buffers | None = getattr(_local, 'buffers', None)
+    if buffers is None or buffers.mem_len != mem_len:
+        buffers = _local.buffers = _Buffers(mem_len)
+    return buffers
+
+
+def run_native_engine(interp: InterpB2, stop_n: int | None = None):
+    memory = interp.memory
+    if (getattr(memory, 'typecode', None) or getattr(memory, 'format', None)) != 'i':
+        # e.g. the list memory for big DATs, the C code can't use that
+        interp._run_fde(stop_n)
+        return
+    size = len(memory)
+    buffers = _get_buffers(size)
+    c_mem = (ctypes.c_int32 * size).from_buffer(memory)
+    run = _NativeRun(
+        wrap_memory=interp.wrap_memory, extensions=interp.extensions,
+        stop_n=NO_LIMIT if stop_n is None else stop_n,
+        mem=c_mem, mem_len=size, out_buf=buffers.out_buf,
+        out_cap=OUTPUT_BUFFER_SIZE, dirty_map=buffers.dirty_map,
+        dirty_list=buffers.dirty_list)
+    run_ptr = ctypes.byref(run)
+    io = interp.io
+    dirty_cells = interp.dirty_cells
+    try:
+        while not interp.is_halted and (stop_n is None or interp.n_instr < stop_n):
+            run.ip = interp.ip
+            run.acc = interp.acc_internal
+            run.n_instr = interp.n_instr
+            why = _lib.LmcNative_run(run_ptr)
+            interp.ip = run.ip
+            interp.acc_internal = run.acc
+            interp.n_instr = run.n_instr
+            interp.is_halted = bool(run.is_halted)
+            if run.n_dirty:
+                dirty_cells.update(buffers.dirty_list[:run.n_dirty])
+            out = buffers.out_buf
+            for i in range(0, 2 * run.out_len, 2):
+                if out[i] == _OUT:
+                    io.write_num(out[i + 1])
+                else:
+                    io.write_char(out[i + 1])
+            if why not in (_STOP_HALTED, _STOP_BUDGET, _OUTPUT_FULL):
+                # Let the interpreter do it (input, raising errors)
+                interp.fetch()
+                interp.decode()
+                interp.execute()
+    finally:
+        # The C code only clears the dirty_map entries from the previous
+        #  call in this run so clear them here for the next run
+        for addr in buffers.dirty_list[:run.n_dirty]:
+            buffers.dirty_map[addr] = 0
+        run.mem = None  # release the memory's buffer (even if it raised)
+        del c_mem
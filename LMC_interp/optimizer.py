@@ -0,0 +1,308 @@
+"""Peephole and dead code optimisations on the parsed instructions
+(``AsmParser(..., optimize=True)``), to reduce the number of
+instructions that a program runs:
+
+- Jumps to a ``BRA`` go straight to where the ``BRA`` goes
+- ``BRZ``/``BRP`` on a constant accumulator (right after ``LDA`` of a
+  ``DAT`` that is never written to) become a ``BRA`` or are removed
+- ``BRA`` to the next instruction is removed
+- ``LDA x`` right after ``STA x`` is removed
+- Unreachable code (and data that nothing uses) is removed
+
+Removing cells moves everything after them so the program is only
+optimised if the code and data are separate (the addresses only ever
+appear as operands). Otherwise (e.g. self-modifying code or code that
+runs into a ``DAT``), it is left alone and ``skipped_reason`` says why.
+The only observable difference is ``n_instr``.
+
+NOTE: the values of ``DAT``s are never changed, even if they came from a
+label (they can only be used as numbers as they can't be written into
+the code)."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Literal, Sequence, TypeAlias
+
+from LMC_interp.base_instruction import Instruction
+from LMC_interp.data_instruction import Data
+from LMC_interp.instructions import (
+    HaltInstr, AddInstr, SubInstr, StoreInstr, LoadInstr,
+    BranchInstr, BranchZeroInstr, BranchPosInstr,
+    InputInstr, OutputInstr, OutputCharInstr)
+
+ChangeKindT: TypeAlias = Literal['thread_jump', 'const_branch', 'branch_to_next',
+                                 'redundant_load', 'unreachable']
+
+CHANGE_THREAD_JUMP: ChangeKindT = 'thread_jump'
+CHANGE_CONST_BRANCH: ChangeKindT = 'const_branch'
+CHANGE_BRANCH_TO_NEXT: ChangeKindT = 'branch_to_next'
+CHANGE_REDUNDANT_LOAD: ChangeKindT = 'redundant_load'
+CHANGE_UNREACHABLE: ChangeKindT = 'unreachable'
+
+MAX_PASSES = 16
+"""Each pass can allow more optimisations in the next one (e.g. a branch
+becoming a BRA makes the code after it unreachable)"""
+CONST_RANGE = (-999, 999)
+"""Only fold branches on values that don't wrap in any interpreter"""
+
+_MEMORY_OPS = frozenset({AddInstr, SubInstr, StoreInstr, LoadInstr})
+_BRANCHES = frozenset({BranchInstr, BranchZeroInstr, BranchPosInstr})
+_FALLS_THROUGH = _MEMORY_OPS | {BranchZeroInstr, BranchPosInstr,
+                                InputInstr, OutputInstr, OutputCharInstr}
+_KNOWN = _FALLS_THROUGH | {BranchInstr, HaltInstr}
+_NAMES = {HaltInstr: 'HLT', AddInstr: 'ADD', SubInstr: 'SUB',
+          StoreInstr: 'STA', LoadInstr: 'LDA', BranchInstr: 'BRA',
+          BranchZeroInstr: 'BRZ', BranchPosInstr: 'BRP'}
+
+
+@dataclass
+class OptimizeChange:
+    kind: ChangeKindT
+    addr: int
+    """The address of the cell in the original program"""
+    line: int | None
+    """The (1-based) source line of the cell (if known)"""
+    description: str
+
+    def __str__(self):
+        where = f'address {self.addr}' if not self.line else f'line {self.line}'
+        return f'{where}: {self.description}'
+
+
+@dataclass
+class OptimizeResult:
+    instructions: list[Instruction | Data]
+    kept: list[int]
+    """The original addresses of the cells that were kept (in order)"""
+    addr_map: list[int]
+    """The new address of each original address (and the end of the
+    program). Removed cells map to the next cell that was kept."""
+    changes: list[OptimizeChange] = field(default_factory=list)
+    skipped_reason: str | None = None
+    """Why the program wasn't optimised (None if it was)"""
+
+    @property
+    def n_removed(self) -> int:
+        return len(self.addr_map) - 1 - len(self.kept)
+
+    def summary(self) -> str:
+        if self.skipped_reason is not None:
+            return f'Not optimised: {self.skipped_reason}'
+        return '\n'.join([f'{len(self.changes)} changes, '
+                          f'{self.n_removed} cells removed',
+                          *map(str, self.changes)])
+
+
+def optimize(instructions: Sequence[Instruction | Data],
+             source_map: Sequence[int] | None = None) -> OptimizeResult:
+    """Optimise the program (``instructions`` isn't modified).
+    ``source_map`` is the line of each instruction (for the report)."""
+    return _Optimizer(instructions, source_map).run()
+
+
+class _Optimizer:
+    def __init__(self, instructions: Sequence[Instruction | Data],
+                 source_map: Sequence[int] | None):
+        self.instrs = list(instructions)
+        self.orig = list(range(len(self.instrs)))
+        """Original address of each cell"""
+        self.source_map = source_map
+        self.changes: list[OptimizeChange] = []
+        self.reachable: list[bool] = []
+        self.leaders: set[int] = set()
+        """Cells that can be jumped to (or are the entry point)"""
+        self.data_refs: set[int] = set()
+        self.stored: set[int] = set()
+
+    def run(self) -> OptimizeResult:
+        n_orig = len(self.instrs)
+        for i in range(MAX_PASSES):
+            reason = self.analyse()
+            if reason is not None:
+                if i == 0:
+                    return OptimizeResult(self.instrs, self.orig,
+                                          list(range(n_orig + 1)),
+                                          skipped_reason=reason)
+                break  # shouldn't happen, but the previous passes were fine
+            if not self.run_pass():
+                break
+        addr_map = [0] * (n_orig + 1)
+        new_addr = 0
+        for old_addr in range(n_orig + 1):
+            addr_map[old_addr] = new_addr
+            if new_addr < len(self.orig) and self.orig[new_addr] == old_addr:
+                new_addr += 1
+        return OptimizeResult(self.instrs, self.orig, addr_map, self.changes)
+
+    # region analysis
+    def analyse(self) -> str | None:
+        """Returns why it can't be optimised (None if it can)"""
+        instrs = self.instrs
+        n = len(instrs)
+        reachable = self.reachable = [False] * n
+        self.leaders = {0}
+        todo = [0] if n else []
+        while todo:
+            addr = todo.pop()
+            if reachable[addr]:
+                continue
+            reachable[addr] = True
+            instr = instrs[addr]
+            if isinstance(instr, Data):
+                return f"the DAT at address {self.orig[addr]} can be run"
+            if type(instr) not in _KNOWN:
+                return f"unknown instruction at address {self.orig[addr]}"
+            successors = []
+            if type(instr) in _BRANCHES:
+                self.leaders.add(instr.operand)
+                successors.append(instr.operand)
+            if type(instr) in _FALLS_THROUGH:
+                successors.append(addr + 1)
+            for nxt in successors:
+                if not 0 <= nxt < n:
+                    return "it can run past the end of the program"
+                todo.append(nxt)
+        self.data_refs = set()
+        self.stored = set()
+        for addr, instr in enumerate(instrs):
+            if reachable[addr] and type(instr) in _MEMORY_OPS:
+                target = instr.operand
+                if not 0 <= target < n:
+                    return "it uses memory outside the program"
+                if reachable[target]:
+                    return "code is used as data (e.g. self-modifying code)"
+                self.data_refs.add(target)
+                if type(instr) is StoreInstr:
+                    self.stored.add(target)
+        return None
+
+    def _falls_into(self, addr: int) -> bool:
+        """Whether the cell before ``addr`` can continue to it"""
+        return (addr > 0 and self.reachable[addr - 1]
+                and type(self.instrs[addr - 1]) in _FALLS_THROUGH)
+
+    def _const_value(self, addr: int) -> int | None:
+        """The value of the cell if it is a constant (that can be folded)"""
+        cell = self.instrs[addr]
+        if addr in self.stored or not isinstance(cell, Data):
+            return None
+        return cell.data if CONST_RANGE[0] <= cell.data <= CONST_RANGE[1] else None
+    # endregion
+
+    # region passes
+    def run_pass(self) -> bool:
+        """Returns whether anything was changed"""
+        n_changes = len(self.changes)
+        self.thread_jumps()
+        remove = self.fold_const_branches()
+        remove |= self.find_branches_to_next(remove)
+        remove |= self.find_redundant_loads(remove)
+        remove |= self.find_unreachable()
+        if remove:
+            self.remove_cells(remove)
+        return len(self.changes) != n_changes
+
+    def thread_jumps(self):
+        for addr, instr in enumerate(self.instrs):
+            if not self.reachable[addr] or type(instr) not in _BRANCHES:
+                continue
+            target = instr.operand
+            seen = set()
+            while type(self.instrs[target]) is BranchInstr and target not in seen:
+                seen.add(target)
+                target = self.instrs[target].operand
+            if target != instr.operand:
+                self._record(CHANGE_THREAD_JUMP, addr,
+                             f'{self._fmt(instr)} now goes straight to '
+                             f'address {self.orig[target]}')
+                self.instrs[addr] = type(instr)(target)
+
+    def fold_const_branches(self) -> set[int]:
+        remove = set()
+        acc = None  # the value of the accumulator if it is known
+        for addr, instr in enumerate(self.instrs):
+            if not self.reachable[addr]:
+                continue
+            if addr in self.leaders or not self._falls_into(addr):
+                acc = None
+            if type(instr) is LoadInstr:
+                acc = self._const_value(instr.operand)
+            elif type(instr) in (StoreInstr, OutputInstr, OutputCharInstr):
+                pass  # don't change the accumulator
+            elif (type(instr) in (BranchZeroInstr, BranchPosInstr)
+                  and acc is not None):
+                taken = acc == 0 if type(instr) is BranchZeroInstr else acc >= 0
+                if taken:
+                    self._record(CHANGE_CONST_BRANCH, addr,
+                                 f'{self._fmt(instr)} is always taken, '
+                                 f'replaced with BRA')
+                    self.instrs[addr] = BranchInstr(instr.operand)
+                else:
+                    self._record(CHANGE_CONST_BRANCH, addr,
+                                 f'{self._fmt(instr)} is never taken, removed')
+                    remove.add(addr)
+            elif type(instr) not in (BranchZeroInstr, BranchPosInstr):
+                acc = None
+        return remove
+
+    def find_branches_to_next(self, remove: set[int]) -> set[int]:
+        found = set()
+        for addr, instr in enumerate(self.instrs):
+            if (self.reachable[addr] and type(instr) is BranchInstr
+                    and instr.operand == addr + 1 and addr not in remove):
+                self._record(CHANGE_BRANCH_TO_NEXT, addr,
+                             f'{self._fmt(instr)} goes to the next '
+                             f'instruction, removed')
+                found.add(addr)
+        return found
+
+    def find_redundant_loads(self, remove: set[int]) -> set[int]:
+        found = set()
+        for addr, instr in enumerate(self.instrs):
+            if (self.reachable[addr] and type(instr) is LoadInstr
+                    and addr not in self.leaders and addr not in remove
+                    and self._falls_into(addr)
+                    and type(prev := self.instrs[addr - 1]) is StoreInstr
+                    and prev.operand == instr.operand):
+                self._record(CHANGE_REDUNDANT_LOAD, addr,
+                             f'{self._fmt(instr)} right after '
+                             f'{self._fmt(prev)} removed')
+                found.add(addr)
+        return found
+
+    def find_unreachable(self) -> set[int]:
+        found = set()
+        for addr in range(len(self.instrs)):
+            if not self.reachable[addr] and addr not in self.data_refs:
+                self._record(CHANGE_UNREACHABLE, addr,
+                             'unreachable (and not used as data), removed')
+                found.add(addr)
+        return found
+
+    def remove_cells(self, remove: set[int]):
+        n = len(self.instrs)
+        new_addr = [0] * (n + 1)
+        pos = 0
+        for addr in range(n + 1):
+            new_addr[addr] = pos
+            if addr < n and addr not in remove:
+                pos += 1
+        instrs = []
+        for addr, instr in enumerate(self.instrs):
+            if addr in remove:
+                continue
+            # only the operands of code are addresses (data is left alone)
+            if self.reachable[addr] and type(instr) in _MEMORY_OPS | _BRANCHES:
+                instr = type(instr)(new_addr[instr.operand])
+            instrs.append(instr)
+        self.instrs = instrs
+        self.orig = [a for i, a in enumerate(self.orig) if i not in remove]
+    # endregion
+
+    def _record(self, kind: ChangeKindT, addr: int, description: str):
+        orig = self.orig[addr]
+        line = self.source_map[orig] if self.source_map is not None else None
+        self.changes.append(OptimizeChange(kind, orig, line, description))
+
+    def _fmt(self, instr: Instruction) -> str:
+        return f'{_NAMES[type(instr)]} {self.orig[instr.operand]}'
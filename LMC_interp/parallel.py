@@ -0,0 +1,175 @@
+"""Running lots of jobs (program + inputs + config) on multiple cores.
+
+The jobs are fanned out over a ``concurrent.futures`` process pool (or a
+thread pool on free-threaded CPython where threads can actually run in
+parallel) and the results are yielded as soon as they are done.
+
+Each worker keeps the recently used programs parsed so jobs that share
+a program don't parse it again. Jobs can have an instruction limit
+and/or a time limit, going over them results in an
+``InstrLimitExceededError``/``TimeLimitExceededError``."""
+from __future__ import annotations
+
+import concurrent.futures as cf
+import functools
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Literal, Sequence, TypeAlias
+
+from LMC_interp.base_instruction import INSTR_DISPATCH, register_instr
+from LMC_interp.batch import BatchResult, make_interp
+from LMC_interp.errors import InstrLimitExceededError, TimeLimitExceededError
+from LMC_interp.instructions import ensure_instr_registered
+from LMC_interp.interpreter_b10 import InterpreterB10
+from LMC_interp.io_mgr import ListIOMgr
+from LMC_interp.run_status import STATUS_HALTED
+
+ExecutorKindT: TypeAlias = Literal['auto', 'process', 'thread']
+
+PROGRAM_CACHE_SIZE = 64
+"""Number of parsed programs to keep in each worker"""
+TIME_CHECK_INTERVAL = 10_000
+"""How many instructions to run between checking the time limit"""
+SOURCE_ONLY_OPTIONS = ('append_hlt', 'optimize')
+"""Options that only ``from_source`` takes (they are already applied to
+the cached memory)"""
+
+
+@dataclass
+class Job:
+    program: str | Sequence[int]
+    """Source code or memory image"""
+    inputs: Sequence[int] = ()
+    interp_cls: type = InterpreterB10
+    config: dict = field(default_factory=dict)
+    """Passed to ``from_source`` (or the constructor for a memory image)"""
+    max_instr: int | None = None
+    timeout: float | None = None
+    """Time limit in seconds (only checked every ``TIME_CHECK_INTERVAL``
+    instructions so it can go over it a bit)"""
+
+
+def use_threads() -> bool:
+    """Threads are only worth it if they can run Python in parallel"""
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return is_gil_enabled is not None and not is_gil_enabled()
+
+
+def run_parallel(jobs: Iterable[Job], max_workers: int | None = None,
+                 executor: ExecutorKindT = 'auto', chunksize: int = 1
+                 ) -> Iterator[tuple[int, BatchResult]]:
+    """Run the ``jobs`` in parallel, yielding ``(index of job, result)``
+    in the order that they finish. Jobs are sent to the workers in groups
+    of ``chunksize`` (use more for lots of short jobs)."""
+    if executor == 'auto':
+        executor = 'thread' if use_threads() else 'process'
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if executor == 'thread':
+        pool = cf.ThreadPoolExecutor(max_workers)
+    elif executor == 'process':
+        pool = cf.ProcessPoolExecutor(
+            max_workers, initializer=_init_worker,
+            initargs=(dict(INSTR_DISPATCH),))
+    else:
+        raise ValueError(f"Unknown executor kind {executor!r}")
+    with pool:
+        # Only submit a few chunks ahead so that `jobs` can be a
+        # (possibly huge) generator and results are yielded straight away
+        max_pending = 4 * max_workers
+        chunks = _chunked(enumerate(jobs), chunksize)
+        pending = set()
+        try:
+            while True:
+                for chunk in chunks:
+                    pending.add(pool.submit(_run_jobs, chunk))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    return
+                done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                for fut in done:
+                    yield from fut.result()
+        finally:
+            for fut in pending:
+                fut.cancel()
+
+
+def _chunked(it: Iterable, n: int) -> Iterator[list]:
+    chunk = []
+    for v in it:
+        chunk.append(v)
+        if len(chunk) >= n:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# region worker
+def _init_worker(instr_dispatch: dict):
+    """Make sure that the instructions registered in the worker are the same
+    as in the main process (custom ones aren't there if the worker isn't
+    forked from the main process)"""
+    ensure_instr_registered()
+    for opcode, cls in instr_dispatch.items():
+        if INSTR_DISPATCH.get(opcode) is not cls:
+            register_instr(cls, opcode)
+
+
+@functools.lru_cache(maxsize=PROGRAM_CACHE_SIZE)
+def _load_program(cls: type, program: str | tuple[int, ...],
+                  config: tuple[tuple[str, object], ...]) -> tuple[int, ...]:
+    if not isinstance(program, str):
+        program = list(program)
+    return tuple(make_interp(cls, program, **dict(config)).memory)
+
+
+def _make_job_interp(job: Job):
+    program = job.program if isinstance(job.program, str) else tuple(job.program)
+    config = dict(job.config)
+    memory = _load_program(job.interp_cls, program, tuple(sorted(config.items())))
+    for name in SOURCE_ONLY_OPTIONS:
+        config.pop(name, None)
+    return job.interp_cls(list(memory), **config)
+
+
+def _run_jobs(jobs: list[tuple[int, Job]]) -> list[tuple[int, BatchResult]]:
+    return [(i, run_job(job)) for i, job in jobs]
+
+
+def run_job(job: Job) -> BatchResult:
+    """Run a single job in this thread"""
+    interp = None
+    io = None
+    try:
+        interp = _make_job_interp(job)
+        io = interp.io = ListIOMgr(interp, job.inputs)
+        if job.max_instr is None and job.timeout is None:
+            interp.run()
+        else:
+            _run_limited(interp, job.max_instr, job.timeout)
+    except Exception as e:
+        return BatchResult(io.output if io else '',
+                           interp.n_instr if interp else 0, e)
+    return BatchResult(io.output, interp.n_instr)
+
+
+def _run_limited(interp, max_instr: int | None, timeout: float | None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        steps = TIME_CHECK_INTERVAL if deadline is not None else None
+        if max_instr is not None:
+            remaining = max_instr - interp.n_instr
+            steps = remaining if steps is None else min(steps, remaining)
+        if interp.run(max_steps=steps) == STATUS_HALTED:
+            return
+        if max_instr is not None and interp.n_instr >= max_instr:
+            raise InstrLimitExceededError(
+                f"Program didn't halt within {max_instr} instructions")
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeLimitExceededError(
+                f"Program didn't halt within {timeout}s")
+# endregion
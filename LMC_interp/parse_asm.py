@@ -1,22 +1,29 @@
 from __future__ import annotations
 
+import re
+from bisect import bisect_left
 from dataclasses import dataclass, field
+from itertools import chain
+from typing import Iterable, Iterator, TextIO
 
 from LMC_interp.base_instruction import Instruction
 from LMC_interp.data_instruction import Data
 from LMC_interp.errors import LMCError, ExtensionDisabledError
-from LMC_interp.instruction_conv import instructions_to_memory
+from LMC_interp.instruction_conv import instr_to_int_1, instructions_to_memory
 from LMC_interp.instructions import (
     HaltInstr, AddInstr, SubInstr, StoreInstr, LoadInstr,
     BranchInstr, BranchZeroInstr, BranchPosInstr,
     InputInstr, OutputInstr, OutputCharInstr)
+from LMC_interp.optimizer import OptimizeResult, optimize
 
 
-@dataclass
+@dataclass(slots=True)
 class ParsedInstr:
     opcode: str
     operand: str | int | None = None
     labels: set[str] = field(default_factory=set)
+    line: int = 0
+    """Line number (1-based) that it came from (0 if it was added)"""
 
 
 class AsmParseError(LMCError):
@@ -52,36 +59,136 @@ REQUIRED_OPERAND: set[type[Instruction]] = {
     BranchPosInstr,
 }
 
+_COMMENT_RE = re.compile('//.*')
+
+
+def _parse_operand(operand: str) -> str | int:
+    """Returns the number or the label"""
+    if operand.isidentifier():
+        return operand  # quick check for labels (int() would fail)
+    try:
+        return int(operand)
+    except ValueError:
+        return operand
+
 
 # noinspection PyMethodMayBeStatic
 class AsmParser:
     # yet another parser??!
     # NOTE: unrecognised instructions will often be interpreted as labels
     #  `HL` (typo, should be `HLT`) will be interpreted as a label
-    def __init__(self, src: str, extensions=True, append_hlt=False):
-        self.src = src
+    def __init__(self, src: str, extensions=True, append_hlt=False,
+                 optimize=False):
+        self._src: str | None = src
+        self._src_lines: list[str] | None = None
+        """The lines of the source (only used after ``update()``)"""
         self.extensions = extensions
         self.do_append_hlt = append_hlt
+        self.do_optimize = optimize
+        self.optimize_result: OptimizeResult | None = None
+        """What the optimizer changed (if ``optimize`` is enabled)"""
         self.instructions: list[Instruction | Data] = []
         self.memory: list[int] = []
         self.parsed_instr_ls: list[ParsedInstr] = []
         self.labels: dict[str, int] = {}
+        self.label_lines: dict[str, int] = {}
+        """The line number (1-based) that each label was defined on"""
+        self._redefined_labels: set[str] = set()
+        """Labels defined more than once for the same instruction (which is
+        allowed) so ``label_lines`` only has one of the lines"""
         self._queued_labels: set[str] = set()
         """Labels that will be attached to the next instruction"""
+        self._line_no = 0
+        self._operand_labels: list[str | None] = []
+        """The label used as the operand of each instruction (if any)"""
+        self._label_refs: dict[str, set[int]] = {}
+        """The addresses of the instructions using each label"""
+        self._is_parsed = False
+        self._stream_opcodes: list[int] | None = None
+        self._stream_source_map: list[int] | None = None
+
+    @property
+    def src(self) -> str:
+        if self._src is None:
+            self._src = '\n'.join(self._src_lines)
+        return self._src
+
+    @src.setter
+    def src(self, value: str):
+        self._src = value
+        self._src_lines = None
 
     def parse(self):
         self.parse_file()
         self.resolve_labels()
         self.generate_instructions()
+        if self.do_optimize:
+            self.optimize_instructions()
         self.generate_memory()
+        self._is_parsed = True
         return self  # for convenience
 
     # region parse_file
     def parse_file(self):
-        for line in self.src.splitlines():
-            self.parse_line(line)
+        # Fast path: remove all the comments with one regex pass over the
+        # whole source and split it into words (see _iter_parsed_instrs).
+        # Joining with '\n' normalises the line endings (and anything else
+        # that splitlines() splits on).
+        code = _COMMENT_RE.sub('', '\n'.join(self.src.splitlines()))
+        instrs = self.parsed_instr_ls
+        queued = self._queued_labels
+        for instr in self._iter_parsed_instrs(map(str.split, code.split('\n'))):
+            instrs.append(instr)
+            if queued:
+                self._attach_queued_labels()
         self._finish_parse_file()
 
+    def _iter_parsed_instrs(self, word_lists: Iterable[list[str]]
+                            ) -> Iterator[ParsedInstr]:
+        """Yields the instruction on each line (given as a list of words).
+        The labels are queued but not attached to the instructions.
+
+        This handles the common cases inline and gives the same result as
+        calling parse_line() on each line (_parse_words() is used for
+        anything else so that the errors are the same)."""
+        queued = self._queued_labels
+        label_lines = self.label_lines
+        for line_no, words in enumerate(word_lists, 1):
+            n_words = len(words)
+            if n_words == 0:
+                continue
+            label = operand = None
+            if n_words == 1:
+                opcode, = words
+                if opcode not in VALID_NAMES:
+                    label = opcode.removesuffix(':')
+                    if label in queued:
+                        self._redefined_labels.add(label)
+                    queued.add(label)
+                    label_lines[label] = line_no
+                    continue
+            elif n_words == 2 and words[0] in VALID_NAMES:
+                opcode, operand = words
+            elif n_words == 2 and words[1] in VALID_NAMES:
+                label, opcode = words
+            elif n_words == 3:
+                label, opcode, operand = words
+            else:
+                self._line_no = line_no
+                self._parse_words(words)  # raises
+                continue
+            if label is not None:
+                label = label.removesuffix(':')
+                if label in queued:
+                    self._redefined_labels.add(label)
+                queued.add(label)
+                label_lines[label] = line_no
+            if opcode not in VALID_NAMES:
+                raise AsmParseError(f"Invalid opcode: {opcode!r}")
+            if operand is not None:
+                operand = _parse_operand(operand)
+            yield ParsedInstr(opcode, operand, line=line_no)
+
     def parse_line(self, line: str):
         line = line.strip()
         code, *_comment = line.split('//', maxsplit=1)
@@ -113,7 +220,10 @@ class AsmParser:
     def _parse_3(self, label: str | None, opcode: str | None, operand: str | int | None):
         if label is not None:
             label = label.removesuffix(':')
+            if label in self._queued_labels:
+                self._redefined_labels.add(label)
             self._queued_labels.add(label)
+            self.label_lines[label] = self._line_no
         if opcode is None:
             assert operand is None
         else:
@@ -121,13 +231,10 @@ class AsmParser:
 
     def _parse_opcode_operand(self, opcode: str, operand: str | int | None):
         if operand is not None:
-            try:
-                operand = int(operand)
-            except ValueError:
-                pass
+            operand = _parse_operand(operand)
         if opcode not in VALID_NAMES:
             raise AsmParseError(f"Invalid opcode: {opcode!r}")
-        self._add_instruction(ParsedInstr(opcode, operand))
+        self._add_instruction(ParsedInstr(opcode, operand, line=self._line_no))
 
     def _add_instruction(self, instr: ParsedInstr):
         self.parsed_instr_ls.append(instr)
@@ -163,21 +270,98 @@ class AsmParser:
         self._add_instruction(ParsedInstr('HLT', 0))
 
     def _handle_leftover_queued_labels(self):
-        idx_after_last = len(self.parsed_instr_ls)
         # don't add to the Instr as there is no ParsedInstr to add to
         #  and the .labels of the ParsedInstr is not actually used
+        self._attach_queued_labels_to_addr(len(self.parsed_instr_ls))
+
+    def _attach_queued_labels_to_addr(self, addr: int):
         for lb in self._queued_labels:
             if lb in self.labels:
                 raise AsmParseError(f"Error: label `{lb}` used more than once")
-            self.labels[lb] = idx_after_last
+            self.labels[lb] = addr
         self._queued_labels.clear()
     # endregion
 
+    # region stream
+    @classmethod
+    def from_stream(cls, stream: TextIO | Iterable[str], extensions=True,
+                    append_hlt=False) -> AsmParser:
+        """Parse a program from a (text) file object, or any iterable of
+        lines, without loading the whole source.
+
+        Each line is turned into its memory word straight away and labels
+        that are used before they are defined are backpatched at the end
+        so ``parsed_instr_ls``, ``instructions`` and the source aren't kept.
+        Only ``memory``, ``labels``, ``label_lines``, ``get_opcodes()`` and
+        ``get_source_map()`` are available afterwards (and not ``update()``).
+
+        Errors are the same as for ``parse()`` but if the source has more
+        than one, a different one may be raised."""
+        p = cls('', extensions, append_hlt)
+        p._parse_stream(stream)
+        return p
+
+    def _parse_stream(self, stream: Iterable[str]):
+        memory = self.memory
+        opcodes = self._stream_opcodes = []
+        source_map = self._stream_source_map = []
+        labels = self.labels
+        queued = self._queued_labels
+        # label -> (address, opcode) of the instructions that used it
+        #  before it was defined
+        backpatch: dict[str, list[tuple[int, str]]] = {}
+        # splitlines() so the line numbers are the same as for parse()
+        lines = chain.from_iterable(map(str.splitlines, stream))
+        for instr in self._iter_parsed_instrs(map(_split_words, lines)):
+            addr = len(memory)
+            if queued:
+                self._attach_queued_labels_to_addr(addr)
+            if isinstance(label := instr.operand, str):
+                if label in labels:
+                    instr.operand = labels[label]
+                else:
+                    backpatch.setdefault(label, []).append((addr, instr.opcode))
+                    instr.operand = 0  # for now (still checks for errors)
+            self._append_stream_instr(self._generate_instr(instr), instr.line)
+        self._attach_queued_labels_to_addr(len(memory))
+        if self.do_append_hlt:
+            self._append_stream_instr(
+                self._generate_instr(ParsedInstr('HLT', 0)), 0)
+        for label, refs in backpatch.items():
+            operand = self._resolve_label(label)
+            for addr, opcode in refs:
+                instr = self._generate_instr(ParsedInstr(opcode, operand))
+                memory[addr] = instr_to_int_1(instr)
+        self._is_parsed = True
+
+    def _append_stream_instr(self, instr: Instruction | Data, line: int):
+        self.memory.append(instr_to_int_1(instr))
+        self._stream_opcodes.append(_get_opcode(instr))
+        self._stream_source_map.append(line)
+
+    def get_opcodes(self) -> list[int]:
+        """The (base 10) opcode of each memory cell (-1 for DAT)"""
+        if self._stream_opcodes is not None:
+            return self._stream_opcodes
+        return [_get_opcode(instr) for instr in self.instructions]
+
+    def get_source_map(self) -> list[int]:
+        """The (1-based) line number that each memory cell came from
+        (0 for the HLT added by ``append_hlt``)"""
+        if self._stream_source_map is not None:
+            return self._stream_source_map
+        return [parsed.line for parsed in self.parsed_instr_ls]
+    # endregion
+
     # region resolve_labels
     def resolve_labels(self):
-        for instr in self.parsed_instr_ls:
+        operand_labels = self._operand_labels = [None] * len(self.parsed_instr_ls)
+        refs = self._label_refs = {}
+        for addr, instr in enumerate(self.parsed_instr_ls):
             if isinstance(instr.operand, str):
-                instr.operand = self._resolve_label(instr.operand)
+                label = operand_labels[addr] = instr.operand
+                refs.setdefault(label, set()).add(addr)
+                instr.operand = self._resolve_label(label)
 
     def _resolve_label(self, label: str) -> int:
         try:
@@ -220,5 +404,202 @@ class AsmParser:
         return Data(operand)
     # endregion
 
+    # region optimize
+    def optimize_instructions(self):
+        """Run the optimizer (see ``LMC_interp.optimizer``) on the
+        instructions and update everything else to match"""
+        res = self.optimize_result = optimize(
+            self.instructions, [parsed.line for parsed in self.parsed_instr_ls])
+        if res.skipped_reason is not None:
+            return
+        self.instructions = res.instructions
+        self.labels = {lb: res.addr_map[addr] for lb, addr in self.labels.items()}
+        by_addr: dict[int, set[str]] = {}
+        for lb, addr in self.labels.items():
+            by_addr.setdefault(addr, set()).add(lb)
+        parsed_ls = []
+        for addr, (old_addr, instr) in enumerate(zip(res.kept, res.instructions)):
+            parsed = self.parsed_instr_ls[old_addr]
+            if not isinstance(instr, Data):
+                parsed.operand = instr.get_b10_operands()
+                if type(instr) is not NAME_TO_CLS_MAP[parsed.opcode]:
+                    parsed.opcode = 'BRA'  # (the only thing it can change to)
+            parsed.labels = by_addr.get(addr, set())
+            parsed_ls.append(parsed)
+        self.parsed_instr_ls = parsed_ls
+    # endregion
+
     def generate_memory(self):
         self.memory = instructions_to_memory(self.instructions)
+
+    # region incremental
+    def update(self, start: int, stop: int, new_lines: str | list[str]) -> bool:
+        """Replace lines ``start`` to ``stop`` (0-based, excluding ``stop``)
+        of the source with ``new_lines`` and update the results.
+
+        If the edit doesn't change the number of instructions (so no
+        addresses move), only the new lines and the instructions using labels
+        that moved are re-done, otherwise everything is re-parsed.
+        Returns whether it could be done incrementally.
+
+        Errors are the same as for ``parse()`` (after an error, the
+        next update will re-parse everything)."""
+        if self._stream_opcodes is not None:
+            raise TypeError("Can't update() a program parsed using from_stream()")
+        if isinstance(new_lines, str):
+            new_lines = new_lines.splitlines()
+        if self._src_lines is None:
+            self._src_lines = self.src.splitlines()
+        if not 0 <= start <= stop <= len(self._src_lines):
+            raise IndexError("Line range out of range")
+        old_lines = self._src_lines[start:stop]
+        self._src_lines[start:stop] = new_lines
+        self._src = None
+        if self._is_parsed and not self.do_optimize:
+            try:
+                if self._update_incremental(start, stop, old_lines, new_lines):
+                    return True
+            except LMCError:
+                pass  # re-parse everything to get the same error as parse()
+        self._reparse()
+        return False
+
+    def _reparse(self):
+        self._is_parsed = False
+        p = AsmParser(self.src, self.extensions, self.do_append_hlt,
+                      self.do_optimize).parse()
+        self.optimize_result = p.optimize_result
+        self.instructions = p.instructions
+        self.memory = p.memory
+        self.parsed_instr_ls = p.parsed_instr_ls
+        self.labels = p.labels
+        self.label_lines = p.label_lines
+        self._redefined_labels = p._redefined_labels
+        self._operand_labels = p._operand_labels
+        self._label_refs = p._label_refs
+        self._is_parsed = True
+
+    def _update_incremental(self, start: int, stop: int, old_lines: list[str],
+                            new_lines: list[str]) -> bool:
+        """Returns False if it can't be done incrementally. Nothing is
+        changed until all the (possible) errors have been checked for."""
+        old_sub = self._parse_lines(start, old_lines)
+        sub = self._parse_lines(start, new_lines)
+        new_instrs = sub.parsed_instr_ls
+        n_src_instrs = len(self.parsed_instr_ls) - self.do_append_hlt
+        a0 = bisect_left(self.parsed_instr_ls, start + 1, hi=n_src_instrs,
+                         key=_get_line)
+        a1 = bisect_left(self.parsed_instr_ls, stop + 1, lo=a0,
+                         hi=n_src_instrs, key=_get_line)
+        if a1 - a0 != len(new_instrs):
+            return False  # addresses would shift
+        # region check labels
+        old_labels = old_sub.labels.keys() | old_sub._queued_labels
+        if sub._redefined_labels or not old_labels.isdisjoint(
+                self._redefined_labels):
+            return False  # don't know all the lines these are defined on
+        new_labels = {lb: a0 + i for lb, i in sub.labels.items()}
+        for lb in sub._queued_labels:  # attached to the instr after the edit
+            if lb in new_labels:
+                return False
+            new_labels[lb] = a1
+        if any(lb in self.labels and lb not in old_labels for lb in new_labels):
+            return False  # duplicate label
+        moved = {lb for lb in old_labels | new_labels.keys()
+                 if self.labels.get(lb) != new_labels.get(lb)}
+        # endregion
+        # region generate the new instructions
+        new_operand_labels = []
+        new_instructions = []
+        for instr in new_instrs:
+            label = None
+            if isinstance(instr.operand, str):
+                label = instr.operand
+                if label in new_labels:
+                    instr.operand = new_labels[label]
+                elif label in self.labels and label not in old_labels:
+                    instr.operand = self.labels[label]
+                else:
+                    return False  # unknown label
+            new_operand_labels.append(label)
+            new_instructions.append(self._generate_instr(instr))
+        patches = []
+        for lb in moved:
+            for addr in self._label_refs.get(lb, ()):
+                if a0 <= addr < a1:
+                    continue  # being replaced
+                if lb not in new_labels:
+                    return False  # unknown label
+                operand = new_labels[lb]
+                new = ParsedInstr(self.parsed_instr_ls[addr].opcode, operand)
+                patches.append((addr, operand, self._generate_instr(new)))
+        # endregion
+        # Can't fail after this so update everything
+        self._replace_labels(a0, a1, old_labels, new_labels, new_instrs)
+        for lb in old_labels:
+            del self.labels[lb]
+            del self.label_lines[lb]
+        if (shift := len(new_lines) - (stop - start)) != 0:
+            self._shift_lines(stop, shift, a1, n_src_instrs)
+        self.labels.update(new_labels)
+        self.label_lines.update(sub.label_lines)
+        for addr in range(a0, a1):
+            if (lb := self._operand_labels[addr]) is not None:
+                self._label_refs[lb].discard(addr)
+        for addr, lb in enumerate(new_operand_labels, a0):
+            if lb is not None:
+                self._label_refs.setdefault(lb, set()).add(addr)
+        self.parsed_instr_ls[a0:a1] = new_instrs
+        self._operand_labels[a0:a1] = new_operand_labels
+        self.instructions[a0:a1] = new_instructions
+        self.memory[a0:a1] = instructions_to_memory(new_instructions)
+        for addr, operand, instr in patches:
+            self.parsed_instr_ls[addr].operand = operand
+            self.instructions[addr] = instr
+            self.memory[addr] = instr_to_int_1(instr)
+        return True
+
+    def _parse_lines(self, start: int, lines: list[str]) -> AsmParser:
+        """Parse (just the first stage) the lines starting at line
+        ``start`` (0-based) on their own"""
+        sub = AsmParser('', self.extensions)
+        for sub._line_no, line in enumerate(lines, start + 1):
+            sub.parse_line(line)
+        return sub
+
+    def _generate_instr(self, parsed: ParsedInstr) -> Instruction | Data:
+        return (self._get_dat_instr(parsed) if parsed.opcode == 'DAT'
+                else self._get_normal_instr(parsed))
+
+    def _replace_labels(self, a0: int, a1: int, old_labels: set[str],
+                        new_labels: dict[str, int], new_instrs: list[ParsedInstr]):
+        """Update the ``.labels`` of the instructions that the labels from
+        the edit are attached to"""
+        for addr in range(a0, min(a1 + 1, len(self.parsed_instr_ls))):
+            labels = self.parsed_instr_ls[addr].labels - old_labels
+            labels.update(lb for lb, a in new_labels.items() if a == addr)
+            if addr < a1:
+                new_instrs[addr - a0].labels = labels
+            else:
+                self.parsed_instr_ls[addr].labels = labels
+
+    def _shift_lines(self, stop: int, shift: int, a1: int, n_src_instrs: int):
+        """Move the line numbers after the edit by ``shift``"""
+        for instr in self.parsed_instr_ls[a1:n_src_instrs]:
+            instr.line += shift
+        for lb, ln in self.label_lines.items():
+            if ln > stop:
+                self.label_lines[lb] = ln + shift
+    # endregion
+
+
+def _get_line(instr: ParsedInstr) -> int:
+    return instr.line
+
+
+def _split_words(line: str) -> list[str]:
+    return line.split('//', 1)[0].split()
+
+
+def _get_opcode(instr: Instruction | Data) -> int:
+    return -1 if isinstance(instr, Data) else instr.get_b10_opcode()
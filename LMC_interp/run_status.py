@@ -0,0 +1,15 @@
+"""The statuses returned by ``run()`` to say why it stopped"""
+from __future__ import annotations
+
+from typing import Literal, TypeAlias
+
+RunStatusT: TypeAlias = Literal['halted', 'needs_input', 'budget_exhausted']
+
+STATUS_HALTED: RunStatusT = 'halted'
+"""The program halted (HLT)"""
+STATUS_NEEDS_INPUT: RunStatusT = 'needs_input'
+"""The program is waiting for input (``InputNotReadyError`` was raised
+by the I/O manager). It can be resumed (by calling ``run()`` again) once
+there is input, the INP instruction will then be run again."""
+STATUS_BUDGET_EXHAUSTED: RunStatusT = 'budget_exhausted'
+"""``max_steps`` instructions were run, call ``run()`` again to continue"""
@@ -0,0 +1,104 @@
+"""Running lots of interpreters at the same time (in one thread) by giving
+each of them a few steps at a time (using ``run(max_steps=...)``) so that
+one program with an infinite loop doesn't stop the others from running."""
+from __future__ import annotations
+
+from collections import deque
+from typing import Iterable, Literal, TypeAlias, TYPE_CHECKING
+
+from LMC_interp.errors import InstrLimitExceededError
+from LMC_interp.run_status import (
+    STATUS_HALTED, STATUS_NEEDS_INPUT, STATUS_BUDGET_EXHAUSTED)
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+    InterpT: TypeAlias = InterpreterB10 | InterpB2
+
+TaskStateT: TypeAlias = Literal['ready', 'waiting', 'halted', 'failed']
+
+TASK_READY: TaskStateT = 'ready'
+TASK_WAITING: TaskStateT = 'waiting'
+"""Waiting for input, see ``RoundRobinScheduler.feed()``"""
+TASK_HALTED: TaskStateT = 'halted'
+TASK_FAILED: TaskStateT = 'failed'
+"""An error was raised (including running out of instruction budget)"""
+
+QUANTUM_DEFAULT = 1000
+
+
+class Task:
+    def __init__(self, interp: InterpT, budget: int | None = None):
+        self.interp = interp
+        self.budget = budget
+        """Maximum total number of instructions (None for no limit)"""
+        self.state: TaskStateT = TASK_READY
+        self.error: Exception | None = None
+
+    @property
+    def is_done(self):
+        return self.state in (TASK_HALTED, TASK_FAILED)
+
+    def __repr__(self):
+        return f'<Task state={self.state!r} n_instr={self.interp.n_instr}>'
+
+
+class RoundRobinScheduler:
+    def __init__(self, quantum: int = QUANTUM_DEFAULT):
+        self.quantum = quantum
+        """Number of instructions to run each task for at a time"""
+        self.tasks: list[Task] = []
+        self.ready: deque[Task] = deque()
+
+    def add(self, interp: InterpT, budget: int | None = None) -> Task:
+        """Add an interpreter to be run. To be able to wait for input,
+        its I/O manager should raise ``InputNotReadyError`` when there
+        isn't any (e.g. ``ListIOMgr(interp, wait_for_input=True)``)."""
+        task = Task(interp, budget)
+        self.tasks.append(task)
+        self.ready.append(task)
+        return task
+
+    def feed(self, task: Task, values: Iterable[int]):
+        """Give more input to ``task`` (its I/O manager needs a ``feed``
+        method e.g. ``ListIOMgr``)"""
+        task.interp.io.feed(values)
+        if task.state == TASK_WAITING:
+            task.state = TASK_READY
+            self.ready.append(task)
+
+    def step(self) -> Task | None:
+        """Run the next ready task for (at most) one quantum. Returns the
+        task that was run (None if there aren't any ready tasks)."""
+        if not self.ready:
+            return None
+        task = self.ready.popleft()
+        interp = task.interp
+        steps = self.quantum
+        if task.budget is not None:
+            steps = min(steps, task.budget - interp.n_instr)
+        try:
+            status = interp.run(max_steps=steps)
+        except Exception as e:
+            task.state = TASK_FAILED
+            task.error = e
+            return task
+        if status == STATUS_HALTED:
+            task.state = TASK_HALTED
+        elif status == STATUS_NEEDS_INPUT:
+            task.state = TASK_WAITING
+        else:
+            assert status == STATUS_BUDGET_EXHAUSTED
+            if task.budget is not None and interp.n_instr >= task.budget:
+                task.state = TASK_FAILED
+                task.error = InstrLimitExceededError(
+                    f"Program didn't halt within {task.budget} instructions")
+            else:
+                self.ready.append(task)
+        return task
+
+    def run(self):
+        """Run until all the tasks are done or waiting for input"""
+        while self.ready:
+            self.step()
@@ -0,0 +1,83 @@
+"""Snapshots of an interpreter's state so that it can be reset quickly.
+
+The interpreters keep track of which memory cells have been written to
+(``.dirty_cells``) so restoring the snapshot that was taken (or restored)
+most recently only needs to copy those cells back. Restoring any other
+snapshot copies the whole memory.
+
+NOTE: writes done directly to ``.memory`` (not by the program)
+aren't tracked so take a new snapshot after doing that."""
+from __future__ import annotations
+
+from array import array
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Sequence, TypeVar
+
+if TYPE_CHECKING:
+    from LMC_interp.interpreter_b10 import InterpreterB10
+    from LMC_interp.interp_b2_quick_and_dirty import InterpB2
+
+_InterpT = TypeVar('_InterpT', 'InterpreterB10', 'InterpB2')
+
+FULL_COPY_FRACTION = 8
+"""Copy the whole memory if more than 1/8 of it is dirty (it's faster)"""
+
+
+@dataclass(frozen=True, eq=False)
+class Snapshot:
+    memory: Sequence[int]
+    """A copy of the memory (don't modify this)"""
+    acc: int
+    ip: int
+    n_instr: int
+    is_line_mode: bool
+    """Whether the output was in line mode (see ``IOMgr.is_line_mode``)"""
+    is_halted: bool
+
+
+def take_snapshot(interp: _InterpT) -> Snapshot:
+    snap = Snapshot(_copy_memory(interp.memory), interp.acc_internal,
+                    interp.ip, interp.n_instr, interp.io.is_line_mode,
+                    interp.is_halted)
+    interp.dirty_cells.clear()
+    interp._dirty_base = (snap, interp.memory)
+    return snap
+
+
+def restore_snapshot(interp: _InterpT, snap: Snapshot) -> list[int] | None:
+    """Returns the addresses that were restored (None if it was all of them)"""
+    memory = interp.memory
+    dirty = interp.dirty_cells
+    if (interp._dirty_base is not None and interp._dirty_base[0] is snap
+            and interp._dirty_base[1] is memory
+            and len(dirty) * FULL_COPY_FRACTION <= len(memory)):
+        restored = list(dirty)
+        src = snap.memory
+        for addr in restored:
+            memory[addr] = src[addr]
+    else:
+        restored = None
+        memory[:] = _like_memory(memory, snap.memory)
+        interp._dirty_base = (snap, memory)
+    dirty.clear()
+    interp.acc_internal = snap.acc
+    interp.ip = snap.ip
+    interp.n_instr = snap.n_instr
+    interp.io.is_line_mode = snap.is_line_mode
+    interp.is_halted = snap.is_halted
+    interp.cir = None
+    interp.decoded_instr = None
+    return restored
+
+
+def _like_memory(memory: Sequence[int], src: Sequence[int]) -> Sequence[int]:
+    """Convert ``src`` so that it can be slice-assigned to ``memory``"""
+    if isinstance(memory, list) or isinstance(src, array):
+        return src
+    return array(getattr(memory, 'typecode', None) or memory.format, src)
+
+
+def _copy_memory(memory: Sequence[int]) -> Sequence[int]:
+    if isinstance(memory, memoryview):
+        return array(memory.format, memory)  # slicing would be a view
+    return memory[:]
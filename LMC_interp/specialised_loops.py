@@ -0,0 +1,167 @@
+"""Run loops specialised for each combination of the interpreter config.
+
+``InterpreterB10`` and ``InterpB2`` pick one of these when they are created
+(see ``get_run_loop``) so that their main loop doesn't have to check
+``wrap_memory``/``wrap_values``/``extensions`` on every step (and doesn't go
+through the ``fetch``/``decode``/``execute``/``get``/``set``/... methods).
+
+The loops are generated from the template below (once for each config)
+with the config-dependant parts filled in. Anything unusual (errors,
+invalid instructions, ...) is handled by running the normal
+``decode``/``execute`` methods for that one instruction so that the errors
+raised are exactly the same as in the plain FDE loop.
+
+There is a separate version of each loop that stops after a number of
+instructions (for ``run(max_steps=...)``) so that the normal loop doesn't
+have to check that."""
+from __future__ import annotations
+
+from typing import Callable, Any, Literal, TypeAlias
+
+from LMC_interp.errors import ProgramIpOOB
+
+IsaT: TypeAlias = Literal['b10', 'b2']
+RunLoopT: TypeAlias = Callable[[Any, 'int | None'], None]
+"""(interp, stop_n) -> None. Only the budget loops use ``stop_n``
+(stop when ``n_instr`` gets to this)"""
+
+_loops: dict[tuple, RunLoopT] = {}
+
+
+def get_run_loop(isa: IsaT, wrap_memory: bool, wrap_values: bool,
+                 extensions: bool, value_range: tuple[int, int],
+                 budget: bool = False) -> RunLoopT:
+    key = (isa, wrap_memory, wrap_values, extensions, tuple(value_range), budget)
+    if (loop := _loops.get(key)) is None:
+        loop = _loops[key] = _make_run_loop(*key)
+    return loop
+
+
+def _make_run_loop(isa: IsaT, wrap_memory: bool, wrap_values: bool,
+                   extensions: bool, value_range: tuple[int, int],
+                   budget: bool) -> RunLoopT:
+    src = _LoopGenerator(isa, wrap_memory, wrap_values, extensions,
+                         value_range, budget).generate()
+    namespace = {'ProgramIpOOB': ProgramIpOOB}
+    exec(compile(src, f'<run_loop {isa} {wrap_memory=} {wrap_values=} '
+                      f'{extensions=} {budget=}>', 'exec'), namespace)
+    return namespace['run_loop']
+
+
+# Run the current instruction using the normal methods (for the rare cases)
+_SLOW_PATH = '''\
+interp.ip = ip
+interp.acc_internal = acc
+interp.n_instr = n
+interp.cir = cir
+interp.decode()
+interp.execute()
+ip = interp.ip
+acc = interp.acc_internal
+n = interp.n_instr
+if interp.is_halted:
+    break
+continue'''
+
+
+class _LoopGenerator:
+    def __init__(self, isa: IsaT, wrap_memory: bool, wrap_values: bool,
+                 extensions: bool, value_range: tuple[int, int],
+                 budget: bool = False):
+        self.isa = isa
+        self.budget = budget
+        self.wrap_memory = wrap_memory
+        self.wrap_values = wrap_values
+        self.extensions = extensions
+        self.value_lo = value_range[0]
+        self.value_mod = value_range[1] - value_range[0] + 1
+
+    def wrap(self, expr: str) -> str:
+        if not self.wrap_values:
+            return expr
+        return f'({expr} - ({self.value_lo})) % {self.value_mod} + ({self.value_lo})'
+
+    def check_operand(self) -> list[str]:
+        if self.isa == 'b10':
+            return []  # operand is always 0-99 so always in bounds
+        if self.wrap_memory:
+            return ['if operand >= size:', '    operand %= size']
+        return ['if operand >= size:', *_indent(_SLOW_PATH)]
+
+    def generate(self) -> str:
+        if self.isa == 'b10':
+            decode = ['opcode = cir // 100', 'operand = cir % 100']
+        else:
+            decode = ['opcode = cir >> 27', 'operand = cir & 0x07_FF_FF_FF']
+        if self.wrap_memory:
+            ip_oob = ['ip %= size']
+        else:
+            ip_oob = ['raise ProgramIpOOB("Instruction pointer went outside'
+                      ' of memory", hint_wrap_memory=True)']
+        otc = ['elif operand == 22:', '    write_char(acc)'] if self.extensions else []
+        check = self.check_operand()
+        body = [
+            *(['if n >= stop_n:', '    break'] if self.budget else []),
+            'if not 0 <= ip < size:', *_indent(ip_oob),
+            'cir = mem[ip]',
+            'ip += 1',
+            'n += 1',
+            *decode,
+            'if opcode == 5:  # LDA', *_indent(check),
+            f'    acc = {self.wrap("mem[operand]")}',
+            'elif opcode == 1:  # ADD', *_indent(check),
+            f'    acc = {self.wrap("acc + mem[operand]")}',
+            'elif opcode == 2:  # SUB', *_indent(check),
+            f'    acc = {self.wrap("acc - mem[operand]")}',
+            'elif opcode == 3:  # STA', *_indent(check),
+            '    mem[operand] = acc',
+            '    dirty_add(operand)',
+            'elif opcode == 7:  # BRZ',
+            '    if acc == 0:', *_indent(check, 2),
+            '        ip = operand',
+            'elif opcode == 8:  # BRP',
+            '    if acc >= 0:', *_indent(check, 2),
+            '        ip = operand',
+            'elif opcode == 6:  # BRA', *_indent(check),
+            '    ip = operand',
+            'elif opcode == 9:',
+            '    if operand == 2:',
+            '        write_num(acc)',
+            '    elif operand == 1:',
+            f'        acc = {self.wrap("read_num()")}',
+            *_indent(otc),
+            '    else:', *_indent(_SLOW_PATH, 2),
+            'elif opcode == 0:  # HLT',
+            '    interp.is_halted = True',
+            '    break',
+            'else:', *_indent(_SLOW_PATH),
+        ]
+        return '\n'.join([
+            'def run_loop(interp, stop_n=None):',
+            '    mem = interp.memory',
+            '    size = len(mem)',
+            '    read_num = interp.io.read_num',
+            '    write_num = interp.io.write_num',
+            '    write_char = interp.io.write_char',
+            '    dirty_add = interp.dirty_cells.add',
+            '    ip = interp.ip',
+            '    acc = interp.acc_internal',
+            '    n = interp.n_instr',
+            '    cir = interp.cir',
+            '    try:',
+            '        while True:',
+            *_indent(body, 3),
+            '    finally:',
+            '        interp.ip = ip',
+            '        interp.acc_internal = acc',
+            '        interp.n_instr = n',
+            '        if cir is not None:',
+            '            interp.cir = cir',
+            '            interp.decode()',
+        ]) + '\n'
+
+
+def _indent(lines: list[str] | str, n: int = 1) -> list[str]:
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    return ['    ' * n + ln for ln in lines]
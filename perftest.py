@@ -1,5 +1,11 @@
+import os
+import random
+import tempfile
 import time
+import tracemalloc
 
+from LMC_interp.compiled import compile_source
+from LMC_interp.interp_b2_quick_and_dirty import MEM_SIZE_DEFAULT, InterpB2
 from LMC_interp.interpreter_b10 import InterpreterB10
 from LMC_interp.parse_asm import AsmParser
 
@@ -12,7 +18,8 @@ def readfile(path: str):
 class PerfSort5:
     PATH = 'sort_5_nums_perf.lmc'
 
-    def __init__(self):
+    def __init__(self, **interp_kwargs):
+        self.interp_kwargs = interp_kwargs
         self.read_times = []
         self.parse_times = []
         self.run_times = []
@@ -28,7 +35,9 @@ class PerfSort5:
         t0 = time.perf_counter()
         src = readfile(self.PATH)
         t1 = time.perf_counter()
-        ip = InterpreterB10.from_source(src)
+        # (not cached, so that this times the parser)
+        prog = compile_source(src, cache=None)
+        ip = InterpreterB10.from_compiled(prog, **self.interp_kwargs)
         t2 = time.perf_counter()
         ip.run()
         t3 = time.perf_counter()
@@ -56,13 +65,127 @@ class PerfSort5:
         print(f'Total time: {self.fmt_min_avg(self.total_times)}')
         parsed = AsmParser(readfile(self.PATH)).parse()
         print(f'Instructions in file: {len(parsed.instructions):>5}')
-        ip = InterpreterB10(parsed.memory)
+        ip = InterpreterB10(parsed.memory, **self.interp_kwargs)
         ip.run()
         print(f'Instructions ran:     {ip.n_instr:>5}')
 
 
+def generate_program(n_instr: int, seed=1) -> str:
+    """Generate a (nonsense) program with ``n_instr`` instructions
+    with labels, comments and blank lines mixed in"""
+    rng = random.Random(seed)
+    labels = [f'label{i}' for i in range(max(1, n_instr // 8))]
+    label_at = dict(zip(rng.sample(range(n_instr), len(labels)), labels))
+    lines = ['// generated by perftest.py']
+    for addr in range(n_instr):
+        line = label_at.get(addr, '').ljust(10)
+        op = rng.choice(['LDA', 'STA', 'ADD', 'SUB', 'BRA', 'BRZ', 'BRP',
+                         'INP', 'OUT', 'HLT', 'DAT'])
+        if op == 'DAT':
+            line += f'DAT {rng.randint(-99, 99)}'
+        elif op in ('INP', 'OUT', 'HLT'):
+            line += op
+        else:
+            line += f'{op} {rng.choice(labels)}'
+        if rng.random() < 0.2:
+            line += '  // comment'
+        lines.append(line)
+        if rng.random() < 0.3:
+            lines.append(rng.choice(['', '// another comment']))
+    return '\n'.join(lines) + '\n'
+
+
+class PerfParse:
+    """Parsing big generated programs (up to InterpB2's memory size)"""
+    SIZES = (10_000, 30_000, MEM_SIZE_DEFAULT)
+
+    def run(self, n=5):
+        for n_instr in self.SIZES:
+            src = generate_program(n_instr)
+            times = []
+            for _ in range(n):
+                t0 = time.perf_counter()
+                AsmParser(src).parse()
+                times.append(time.perf_counter() - t0)
+            n_lines = len(src.splitlines())
+            print(f'{n_instr:>6} instructions ({n_lines:>6} lines): '
+                  f'{PerfSort5.fmt_min_avg(times)}, '
+                  f'{min(times) / n_lines * 1e6:.2f}us/line')
+
+
+class PerfParseStream:
+    """Peak memory (and time) of reading a big program from a file then
+    parsing it vs using ``AsmParser.from_stream``"""
+    N_INSTR = MEM_SIZE_DEFAULT
+
+    def run(self):
+        fd, path = tempfile.mkstemp(suffix='.lmc')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(generate_program(self.N_INSTR))
+            self.measure('read + parse()', lambda: AsmParser(readfile(path)).parse())
+            self.measure('from_stream()', lambda: self._from_stream(path))
+        finally:
+            os.unlink(path)
+
+    @classmethod
+    def _from_stream(cls, path: str):
+        with open(path) as f:
+            return AsmParser.from_stream(f)
+
+    @classmethod
+    def measure(cls, name: str, fn):
+        t0 = time.perf_counter()
+        fn()
+        t1 = time.perf_counter()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name:<15}: {(t1 - t0) * 1000:>8.3f}ms, '
+              f'peak memory {peak / 2**20:>6.2f}MiB')
+
+
+class PerfFDEAllocs:
+    """Time and memory allocated by each instruction run by ``run()``
+    in a loop that never halts"""
+    SOURCE = 'loop LDA n\nADD one\nSTA n\nBRA loop\nn DAT 900\none DAT 1'
+
+    def run(self, n=100_000):
+        for cls in (InterpreterB10, InterpB2):
+            inst = cls.from_source(self.SOURCE)
+            t0 = time.perf_counter()
+            self.step(inst, n)
+            t1 = time.perf_counter()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            self.step(inst, n)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{cls.__name__:<15}: {(t1 - t0) / n * 1e9:>6.0f}ns/instr, '
+                  f'{(current - before) / n:.3f}B/instr kept, '
+                  f'{peak - before}B peak')
+
+    @classmethod
+    def step(cls, inst: InterpreterB10 | InterpB2, n: int):
+        inst.run(max_steps=n)
+
+
 def main():
+    print('--- PerfSort5 ---')
     PerfSort5().run()
+    print('--- PerfSort5 (predecode=True) ---')
+    PerfSort5(predecode=True).run()
+    print("--- PerfSort5 (engine='closure') ---")
+    PerfSort5(engine='closure').run()
+    print("--- PerfSort5 (engine='block') ---")
+    PerfSort5(engine='block').run()
+    print('--- PerfFDEAllocs ---')
+    PerfFDEAllocs().run()
+    print('--- PerfParse ---')
+    PerfParse().run()
+    print('--- PerfParseStream ---')
+    PerfParseStream().run()
 
 
 if __name__ == '__main__':
@@ -1,5 +1,8 @@
+import itertools
+import os
 import random
 import sys
+import tempfile
 import unittest
 from io import StringIO
 from typing import TextIO, Generic, TypeVar
@@ -15,6 +18,26 @@ def readfile(path: str) -> str:
         return f.read()
 
 
+_module_cache_dir: tempfile.TemporaryDirectory | None = None
+_prev_cache_env: str | None = None
+
+
+def setUpModule():
+    # don't write to the real cache (the CLI uses it)
+    global _module_cache_dir, _prev_cache_env
+    _module_cache_dir = tempfile.TemporaryDirectory()
+    _prev_cache_env = os.environ.get('LMC_CACHE_DIR')
+    os.environ['LMC_CACHE_DIR'] = _module_cache_dir.name
+
+
+def tearDownModule():
+    if _prev_cache_env is None:
+        del os.environ['LMC_CACHE_DIR']
+    else:
+        os.environ['LMC_CACHE_DIR'] = _prev_cache_env
+    _module_cache_dir.cleanup()
+
+
 class RedirectStdin:
     def __init__(self, new_stdin: TextIO):
         self.new_stdin = new_stdin
@@ -54,12 +77,14 @@ class MockStdoutToString:
 
 class CommonT(unittest.TestCase, Generic[_T]):
     ClassToTest: type[_T] = None
+    extra_kwargs: dict = {}
     # set seed + PRNG for reproducibility, use SystemRandom for
     # true random / low-budget 'fuzzing'
     rng: random.Random = random.Random(3.14)
 
     def test_sort_5_nums_perf(self):
-        inst = self.ClassToTest.from_source(readfile('sort_5_nums_perf.lmc'))
+        inst = self.ClassToTest.from_source(readfile('sort_5_nums_perf.lmc'),
+                                            **self.extra_kwargs)
         inst.run()
         values = [inst.get(73 + i) for i in range(5)]
         self.assertEqual(values, [-158, -56, 15, 73, 89])
@@ -68,7 +93,8 @@ class CommonT(unittest.TestCase, Generic[_T]):
         return [self.rng.randint(-350, 350) for _ in range(5)]
 
     def _test_sort_5_nums_rng_once(self, source: str):
-        inst: _T = self.ClassToTest.from_source(source, inp_prompt='')
+        inst: _T = self.ClassToTest.from_source(source, inp_prompt='',
+                                                **self.extra_kwargs)
         nums = self._get_5_nums()
         inp_s = '\n'.join(map(str, nums)) + '\n'
         expect_out = '\n'.join(map(str, sorted(nums))) + '\n'
@@ -76,10 +102,208 @@ class CommonT(unittest.TestCase, Generic[_T]):
             inst.run()
         self.assertEqual(out.string, expect_out)
 
+    def test_sort_5_nums_stdin(self):
+        self._test_sort_5_nums_rng_once(readfile('sort_5_nums.lmc'))
+
     def test_sort_5_nums_prng(self):
         source = readfile('sort_5_nums.lmc')
-        for _ in range(50):
-            self._test_sort_5_nums_rng_once(source)
+        inputs = [self._get_5_nums() for _ in range(50)]
+        results = self.ClassToTest.run_batch(source, inputs, **self.extra_kwargs)
+        self.assertEqual(len(results), 50)
+        for nums, res in zip(inputs, results):
+            self.assertIsNone(res.error)
+            self.assertEqual(res.output, '\n'.join(map(str, sorted(nums))) + '\n')
+
+    def test_sort_5_nums_lockstep(self):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            self.skipTest("numpy is needed for run_lockstep")
+        source = readfile('sort_5_nums.lmc')
+        inputs = [self._get_5_nums() for _ in range(50)]
+        inputs += [[1, 2], [1, 2, 3, 4, 10_000_000_000]]  # these raise
+        expected = self.ClassToTest.run_batch(source, inputs, **self.extra_kwargs)
+        results = self.ClassToTest.run_lockstep(source, inputs, **self.extra_kwargs)
+        self.assertEqual([(r.output, r.n_instr) for r in results],
+                         [(r.output, r.n_instr) for r in expected])
+        self.assertEqual([type(r.error) for r in results],
+                         [type(r.error) for r in expected])
+        self.assertIsNotNone(results[-1].error)
+        # ADD/SUB of a huge DAT mustn't overflow
+        source = 'INP\nSUB m\nOUT\nHLT\nm DAT -9223372036854775808'
+        inputs = [[5], [6]]
+        self.assertEqual(
+            self.ClassToTest.run_lockstep(source, inputs, **self.extra_kwargs),
+            self.ClassToTest.run_batch(source, inputs, **self.extra_kwargs))
+
+    def test_self_modifying(self):
+        source = '\n'.join([
+            '       LDA instr',
+            '       STA slot',
+            '       LDA value',
+            'slot   HLT  // overwritten with OUT',
+            '       HLT',
+            'instr  OUT',
+            'value  DAT 42',
+        ])
+        inst: _T = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        with MockStdoutToString() as out:
+            inst.run()
+        self.assertEqual(out.string, '42\n')
+        self.assertEqual(inst.n_instr, 5)
+
+    def test_run_max_steps(self):
+        from LMC_interp.run_status import STATUS_HALTED, STATUS_BUDGET_EXHAUSTED
+        inst = self.ClassToTest.from_source(readfile('sort_5_nums_perf.lmc'),
+                                            **self.extra_kwargs)
+        statuses = []
+        while (status := inst.run(max_steps=7)) != STATUS_HALTED:
+            statuses.append(status)
+        values = [inst.get(73 + i) for i in range(5)]
+        self.assertEqual(values, [-158, -56, 15, 73, 89])
+        self.assertEqual(set(statuses), {STATUS_BUDGET_EXHAUSTED})
+        self.assertEqual(len(statuses), (inst.n_instr - 1) // 7)
+        self.assertEqual(inst.run(), STATUS_HALTED)
+
+    def test_negative_ip(self):
+        from LMC_interp.errors import ProgramIpOOB
+        inst = self.ClassToTest.from_source('OUT\nHLT', **self.extra_kwargs)
+        inst.ip = -1
+        with self.assertRaises(ProgramIpOOB):
+            inst.run()
+
+    def test_needs_input(self):
+        from LMC_interp.io_mgr import ListIOMgr
+        from LMC_interp.run_status import STATUS_HALTED, STATUS_NEEDS_INPUT
+        inst = self.ClassToTest.from_source(readfile('sort_5_nums.lmc'),
+                                            **self.extra_kwargs)
+        io = inst.io = ListIOMgr(inst, [5, -3], wait_for_input=True)
+        self.assertEqual(inst.run(), STATUS_NEEDS_INPUT)
+        self.assertEqual(inst.n_instr, 4)  # the 3rd INP isn't counted yet
+        io.feed([7, 2])
+        self.assertEqual(inst.run(), STATUS_NEEDS_INPUT)
+        io.feed([0])
+        self.assertEqual(inst.run(), STATUS_HALTED)
+        self.assertEqual(io.output, '-3\n0\n2\n5\n7\n')
+
+    def test_snapshot(self):
+        from LMC_interp.io_mgr import ListIOMgr
+        inst = self.ClassToTest.from_source(readfile('sort_5_nums.lmc'),
+                                            **self.extra_kwargs)
+        pristine = list(inst.memory)
+        snap = inst.snapshot()
+        for nums in [[3, 1, 2, 5, 4], [9, -8, 7, -6, 5]]:
+            io = inst.io = ListIOMgr(inst, nums)
+            inst.run()
+            self.assertEqual(io.output, ''.join(f'{n}\n' for n in sorted(nums)))
+            self.assertLess(len(inst.dirty_cells), 20)
+            inst.restore(snap)
+            self.assertEqual(list(inst.memory), pristine)
+            self.assertEqual((inst.ip, inst.n_instr, inst.is_halted), (0, 0, False))
+        inst.io = ListIOMgr(inst, [1, 2], wait_for_input=True)
+        inst.run()
+        mid = inst.snapshot()
+        inst.restore(snap)  # not the latest snapshot so copies everything
+        self.assertEqual(list(inst.memory), pristine)
+        inst.restore(mid)
+        self.assertEqual(inst.n_instr, 4)
+        inst.io = ListIOMgr(inst, [5, 4, 3])
+        inst.run()
+        self.assertEqual(inst.io.output, '1\n2\n3\n4\n5\n')
+
+    def test_fde_no_allocations(self):
+        import tracemalloc
+        # Values stay small ints (cached by Python) so they aren't allocated
+        inst = self.ClassToTest.from_source(
+            'loop LDA a\nADD one\nSUB one\nSTA b\nBRZ loop\nBRA loop\n'
+            'a DAT 7\nb DAT 0\none DAT 1', **self.extra_kwargs)
+        for _ in range(3):  # warm up (compiling, caches, n_instr not small)
+            inst.run(max_steps=50_000)
+        tracemalloc.start()
+        try:
+            for _ in range(3):  # tracemalloc's own warm up
+                inst.run(max_steps=1000)
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            inst.run(max_steps=0)  # just run()'s own overhead
+            overhead = tracemalloc.get_traced_memory()[1] - before
+            n_steps = 20 * 50_000
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            for _ in range(20):
+                inst.run(max_steps=50_000)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(inst.n_instr, 3 * 50_000 + 3 * 1000 + n_steps)
+        self.assertEqual(current - before, 0)  # nothing kept
+        # Only a few ints (n_instr, the step limit, ...) should be made (and
+        # freed) at a time. An error, instruction, tuple, etc. made on each
+        # step would take it over this.
+        self.assertLessEqual(peak - before - overhead, 4 * 32)
+
+    def test_output_sinks(self):
+        from LMC_interp.io_mgr import IOMgr
+        from LMC_interp.io_sinks import (
+            BufferedTextSink, CallbackSink, IntListSink)
+        source = '\n'.join([
+            'LDA a', 'OTC', 'OUT', 'LDA nl', 'OTC', 'OUT', 'HLT',
+            'a DAT 65', 'nl DAT 10'])
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        inst.io = IOMgr(inst, IntListSink(include_chars=True))
+        inst.run()
+        self.assertEqual(inst.io.sink.values, [65, 65, 10, 10])
+        texts = []
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        inst.io = IOMgr(inst, CallbackSink(texts.append))
+        inst.run()
+        self.assertEqual(texts, ['A', '65', '\n', '10\n'])
+        stream = StringIO()
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        inst.io = IOMgr(inst, BufferedTextSink(stream))
+        inst.run()
+        self.assertEqual(stream.getvalue(), 'A65\n10\n')
+
+    def test_input_sources(self):
+        from io import BytesIO
+        from LMC_interp.errors import InputOutOfRangeError, InvalidInputError
+        from LMC_interp.io_mgr import IOMgr, ListIOMgr
+        from LMC_interp.io_sinks import IntListSink
+        from LMC_interp.io_sources import IterableSource, StreamIntSource
+        source = readfile('sort_5_nums.lmc')
+        lo, hi = self.ClassToTest([0]).value_range
+        # only an error if the program gets to the bad value
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        io = inst.io = ListIOMgr(inst, [5, -3, 7, 2, 0, hi + 1])
+        inst.run()
+        self.assertEqual(io.output, '-3\n0\n2\n5\n7\n')
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        inst.io = ListIOMgr(inst, [5, -3, lo - 1, 2, 0])
+        with self.assertRaises(InputOutOfRangeError):
+            inst.run()
+        # chunk_size=2 so that numbers get split between chunks
+        for data in (' 51\n-3 \t7 2\n\n0', b'51 -3 7 2 0 \n'):
+            stream = StringIO(data) if isinstance(data, str) else BytesIO(data)
+            inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+            inst.io = IOMgr(inst, IntListSink(), StreamIntSource(stream, 2))
+            inst.run()
+            self.assertEqual(inst.io.sink.values, [-3, 0, 2, 7, 51])
+        inst = self.ClassToTest.from_source(source, **self.extra_kwargs)
+        inst.io = IOMgr(inst, IntListSink(), StreamIntSource(StringIO('1 x 3')))
+        with self.assertRaises(InvalidInputError):
+            inst.run()
+        # feed() mustn't read the values that are already there
+        src = IterableSource(itertools.count())
+        src.feed([-1])
+        self.assertEqual([src.read() for _ in range(3)], [0, 1, 2])
+
+    def test_load_wraps_value(self):
+        lo, hi = self.ClassToTest([0]).value_range
+        inst: _T = self.ClassToTest.from_source(
+            f'LDA big\nOUT\nHLT\nbig DAT {hi + 1}', **self.extra_kwargs)
+        with MockStdoutToString() as out:
+            inst.run()
+        self.assertEqual(out.string, f'{lo}\n')
 
     @classmethod
     def setUpClass(cls):
@@ -90,10 +314,479 @@ class CommonT(unittest.TestCase, Generic[_T]):
 class TestInterpB2(CommonT[InterpB2]):
     ClassToTest = InterpB2
 
+    def test_image(self):
+        from LMC_interp.io_mgr import ListIOMgr
+        src = readfile('sort_5_nums.lmc')
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'sort.img')
+            InterpB2.from_source(src).save_image(path)
+            insts = [InterpB2.from_image(path) for _ in range(2)]
+            self.assertIsInstance(insts[0].memory, memoryview)  # mmap-ed
+            for inst in insts:
+                self.assertEqual(list(inst.memory),
+                                 list(InterpB2.from_source(src).memory))
+                inst.io = ListIOMgr(inst, [3, 1, 2, 5, 4])
+                inst.run()
+                self.assertEqual(inst.io.output, '1\n2\n3\n4\n5\n')
+            del insts
+            InterpB2.from_source(src).save_image(path, whole_memory=False)
+            self.assertLess(os.path.getsize(path), 1000)
+            inst = InterpB2.from_image(path)
+            self.assertEqual(len(inst.memory), 0x10000)
+
+    def test_big_dat(self):
+        inst = InterpB2.from_source('LDA x\nOUT\nx DAT 99999999999')
+        self.assertEqual(inst.memory[2], 99999999999)
+
 
 class TestInterpreterB10(CommonT[InterpB2]):
     ClassToTest = InterpreterB10
 
 
+class TestInterpB2Closure(CommonT[InterpB2]):
+    ClassToTest = InterpB2
+    extra_kwargs = {'engine': 'closure'}
+
+
+class TestInterpreterB10Closure(CommonT[InterpreterB10]):
+    ClassToTest = InterpreterB10
+    extra_kwargs = {'engine': 'closure'}
+
+
+class BlockEngineCommonT(CommonT[_T]):
+    extra_kwargs = {'engine': 'block'}
+
+    def test_disk_cache(self):
+        from unittest import mock
+        from LMC_interp import block_compiler
+        inst = self.ClassToTest.from_source(readfile('sort_5_nums_perf.lmc'),
+                                            **self.extra_kwargs)
+        key = block_compiler.get_cache_key(inst, 0)
+        path = os.path.join(_module_cache_dir.name, 'blocks', f'{key}.bin')
+        block_compiler.get_block_program(inst)
+        self.assertFalse(os.path.exists(path))  # off by default
+        block_compiler._memo.pop(key)
+        with mock.patch.object(block_compiler, 'USE_DISK_CACHE', True):
+            block_compiler.get_block_program(inst)
+            self.assertTrue(os.path.exists(path))
+            block_compiler._memo.pop(key)  # force it to be loaded from disk
+            inst.run()
+        values = [inst.get(73 + i) for i in range(5)]
+        self.assertEqual(values, [-158, -56, 15, 73, 89])
+
+
+class TestInterpB2Block(BlockEngineCommonT[InterpB2]):
+    ClassToTest = InterpB2
+
+
+class TestInterpreterB10Block(BlockEngineCommonT[InterpreterB10]):
+    ClassToTest = InterpreterB10
+
+
+class TestInterpreterB10Predecode(CommonT[InterpreterB10]):
+    ClassToTest = InterpreterB10
+    extra_kwargs = {'predecode': True}
+
+
+class TestInterpB2Native(CommonT[InterpB2]):
+    ClassToTest = InterpB2
+    extra_kwargs = {'engine': 'native'}
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import LMC_interp.native_engine  # noqa: F401
+        except ImportError:
+            try:  # build it (needs a C compiler)
+                from LMC_compile.compile import compile_native
+                compile_native()
+                import LMC_interp.native_engine  # noqa: F401
+            except Exception as e:
+                raise unittest.SkipTest(f"Can't build the native engine: {e}")
+
+    def test_errors_and_budget(self):
+        from LMC_interp.errors import ProgramReadOOB
+        from LMC_interp.run_status import STATUS_BUDGET_EXHAUSTED
+        inst = InterpB2.from_source('LDA 70000', engine='native')
+        with self.assertRaises(ProgramReadOOB):
+            inst.run()
+        self.assertEqual((inst.ip, inst.n_instr), (1, 1))  # same as 'fde'
+        inst = InterpB2.from_source('loop ADD one\nSTA x\nBRA loop\none DAT 1\nx DAT',
+                                    engine='native')
+        self.assertEqual(inst.run(max_steps=3000), STATUS_BUDGET_EXHAUSTED)
+        self.assertEqual((inst.n_instr, inst.acc, inst.memory[4]), (3000, 1000, 1000))
+        self.assertEqual(inst.dirty_cells, {4})
+
+    def test_threaded_dispatch(self):
+        import subprocess
+        from pathlib import Path
+        from LMC_compile.compile import (
+            LmcRtCompiler, ccompiler, native_lib_filename)
+        with tempfile.TemporaryDirectory() as d:
+            try:
+                LmcRtCompiler(['lmc_native.c'], False, out_file=native_lib_filename(),
+                              out_type=ccompiler.CCompiler.SHARED_OBJECT,
+                              out_dir=Path(d), threaded=True).run()
+            except Exception as e:
+                self.skipTest(f"Can't build it with computed goto: {e}")
+            env = dict(os.environ, LMC_NATIVE_LIB=os.path.join(d, native_lib_filename()))
+            out = subprocess.run(
+                [sys.executable, '-m', 'LMC_interp', 'run', '-m', 'b2', '-e', 'native',
+                 os.path.join('LMC_compile', 'benchmark.lmc')],
+                env=env, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out, '14167\n')
+
+
+class TestParallel(unittest.TestCase):
+    def test_sort_5_nums(self):
+        from LMC_interp.parallel import run_parallel, Job
+        source = readfile('sort_5_nums.lmc')
+        rng = random.Random(2.71)
+        jobs = [Job(source, [rng.randint(-350, 350) for _ in range(5)], cls)
+                for cls in (InterpreterB10, InterpB2) for _ in range(20)]
+        results = dict(run_parallel(jobs, max_workers=2, chunksize=4))
+        self.assertEqual(sorted(results), list(range(len(jobs))))
+        for i, job in enumerate(jobs):
+            self.assertIsNone(results[i].error)
+            self.assertEqual(results[i].output,
+                             '\n'.join(map(str, sorted(job.inputs))) + '\n')
+
+    def test_limits(self):
+        from LMC_interp.errors import (
+            InstrLimitExceededError, TimeLimitExceededError)
+        from LMC_interp.parallel import run_parallel, Job
+        jobs = [Job('OUT\nBRA 0', max_instr=10),
+                Job('BRA 0', interp_cls=InterpB2, timeout=0.01),
+                Job('OUT\nHLT', max_instr=2)]
+        results = dict(run_parallel(jobs, executor='thread'))
+        self.assertIsInstance(results[0].error, InstrLimitExceededError)
+        self.assertEqual(results[0].output, '0\n' * 5)
+        self.assertEqual(results[0].n_instr, 10)
+        self.assertIsInstance(results[1].error, TimeLimitExceededError)
+        self.assertIsNone(results[2].error)
+
+    def test_optimize(self):
+        from LMC_interp.parallel import run_job, Job
+        source = readfile('sort_5_nums.lmc')
+        for cls in (InterpreterB10, InterpB2):
+            job = Job(source, [3, 1, 2, 5, 4], cls, {'optimize': True})
+            res = run_job(job)
+            self.assertIsNone(res.error)
+            self.assertEqual(res.output, '1\n2\n3\n4\n5\n')
+
+
+class TestCompiled(unittest.TestCase):
+    def test_lmco_roundtrip(self):
+        from LMC_interp.compiled import CompiledProgram, compile_source
+        from LMC_interp.io_mgr import ListIOMgr
+        source = readfile('sort_5_nums.lmc')
+        prog = compile_source(source, cache=None)
+        self.assertEqual(CompiledProgram.from_bytes(prog.to_bytes()), prog)
+        lines = source.splitlines()
+        self.assertIn('INP', lines[prog.source_map[0] - 1])
+        for cls in (InterpreterB10, InterpB2):
+            inst = cls.from_compiled(prog)
+            self.assertEqual(inst.memory, cls.from_source(source).memory)
+            inst.io = ListIOMgr(inst, [3, 1, 2, 5, 4])
+            inst.run()
+            self.assertEqual(inst.io.output, '1\n2\n3\n4\n5\n')
+
+    def test_cache(self):
+        from unittest import mock
+        from LMC_interp import compiled
+        with tempfile.TemporaryDirectory() as d, \
+                mock.patch.dict(os.environ, {'LMC_CACHE_DIR': d}):
+            cache = compiled.ProgramCache(memo_size=1, max_files=2, use_disk=True)
+            sources = [f'LDA {i}\nOUT\nHLT' for i in range(3)]
+            progs = [cache.compile(src) for src in sources]
+            self.assertEqual(progs[2].memory, (502, 902, 0))
+            self.assertEqual(len(os.listdir(os.path.join(d, 'programs'))), 2)
+            self.assertIs(cache.compile(sources[2]), progs[2])  # in memory
+            with mock.patch.object(compiled, '_parse_source') as parser:
+                self.assertEqual(cache.compile(sources[1]), progs[1])  # disk
+                parser.assert_not_called()
+            self.assertEqual(cache.compile(sources[1], append_hlt=True).memory,
+                             (501, 902, 0, 0))
+            cache.invalidate(sources[1])
+            cache.clear(disk=False)
+            with mock.patch.object(compiled, '_parse_source',
+                                   wraps=compiled._parse_source) as parser:
+                cache.compile(sources[1])
+                parser.assert_called_once()
+            InterpreterB10.from_source('LDA 9\nHLT')  # not written to disk
+            self.assertEqual(len(os.listdir(os.path.join(d, 'programs'))), 2)
+        # the parser output depends on the registered instructions
+        from LMC_interp.base_instruction import INSTR_DISPATCH
+        key = compiled.get_cache_key(sources[0])
+        with mock.patch.dict(INSTR_DISPATCH, {4: INSTR_DISPATCH[0]}):
+            self.assertNotEqual(compiled.get_cache_key(sources[0]), key)
+
+    def test_stream(self):
+        from LMC_interp.compiled import compile_source, compile_stream
+        from LMC_interp.io_mgr import ListIOMgr
+        # > 100 instructions so some operands have 3 digits
+        source = 'INP\nBRA end\n' + 'OUT\n' * 150 + 'end LDA x\nOUT\nx DAT 7'
+        prog = compile_stream(StringIO(source))
+        self.assertEqual(prog, compile_source(source, cache=None))
+        self.assertEqual(prog.memory[1], 752)
+        inst = InterpB2.from_compiled(prog)
+        self.assertEqual(inst.memory[152], (5 << 27) + 154)  # LDA x
+        inst.io = ListIOMgr(inst, [5])
+        inst.run()
+        self.assertEqual(inst.io.output, '7\n')
+
+
+class TestIncrementalParse(unittest.TestCase):
+    def assertSameAsFullParse(self, p):
+        from LMC_interp.parse_asm import AsmParser
+        full = AsmParser(p.src, p.extensions, p.do_append_hlt).parse()
+        self.assertEqual(p.memory, full.memory)
+        self.assertEqual(p.labels, full.labels)
+        self.assertEqual(p.parsed_instr_ls, full.parsed_instr_ls)
+
+    def test_update(self):
+        from LMC_interp.parse_asm import AsmParser, AsmUnknownLabelError
+        lines = readfile('sort_5_nums.lmc').splitlines()
+        p = AsmParser('\n'.join(lines)).parse()
+        i = lines.index('    LDA i1')
+        # same number of instructions so can be done incrementally
+        self.assertTrue(p.update(i, i + 1, ['    LDA i2', '']))
+        self.assertSameAsFullParse(p)
+        # moving a label also updates the instructions using it
+        lines = p.src.splitlines()
+        j = lines.index('i2 DAT 73')
+        self.assertTrue(p.update(j, j + 2, ['DAT 73', 'i2', lines[j + 1]]))
+        self.assertEqual(p.labels['i2'], p.labels['i3'])
+        self.assertSameAsFullParse(p)
+        self.assertFalse(p.update(i, i, ['    OUT']))  # addresses shift
+        self.assertSameAsFullParse(p)
+        with self.assertRaises(AsmUnknownLabelError):
+            p.update(i, i + 1, ['    LDA nonexistent'])
+        self.assertFalse(p.update(i, i + 1, ['    LDA i1']))
+        self.assertSameAsFullParse(p)
+
+
+class TestOptimizer(unittest.TestCase):
+    def test_optimize(self):
+        from LMC_interp.io_mgr import ListIOMgr
+        from LMC_interp.parse_asm import AsmParser
+        source = '\n'.join([
+            '      INP',
+            '      STA x',
+            '      LDA x     // redundant',
+            '      BRA skip  // to a BRA',
+            '      OUT       // unreachable',
+            'skip  BRA next  // to the next instruction',
+            'next  LDA one',
+            '      BRZ end   // never taken',
+            '      OUT',
+            'end   HLT',
+            'x     DAT',
+            'one   DAT 1',
+        ])
+        p = AsmParser(source, optimize=True).parse()
+        self.assertIsNone(p.optimize_result.skipped_reason)
+        self.assertEqual(p.memory, [901, 305, 506, 902, 0, 0, 1])
+        self.assertEqual(p.labels['x'], 5)
+        self.assertEqual(p.optimize_result.n_removed, 5)
+        for cls in (InterpreterB10, InterpB2):
+            insts = [cls.from_source(source, optimize=opt) for opt in (False, True)]
+            for inst in insts:
+                inst.io = ListIOMgr(inst, [42])
+                inst.run()
+                self.assertEqual(inst.io.output, '1\n')
+            self.assertEqual((insts[0].n_instr, insts[1].n_instr), (9, 5))
+
+    def test_self_modifying_not_optimized(self):
+        from LMC_interp.parse_asm import AsmParser
+        source = 'LDA instr\nSTA slot\nBRA slot\nslot HLT\ninstr OUT'
+        p = AsmParser(source, optimize=True).parse()
+        self.assertIsNotNone(p.optimize_result.skipped_reason)
+        self.assertEqual(p.memory, AsmParser(source).parse().memory)
+
+
+class TestDisassemble(unittest.TestCase):
+    def test_round_trip(self):
+        from LMC_interp.disassemble import disassemble
+        src = readfile('sort_5_nums.lmc')
+        for cls, isa in ((InterpreterB10, 'b10'), (InterpB2, 'b2')):
+            memory = cls.from_source(src).memory
+            text = disassemble(memory, isa)
+            self.assertEqual(list(cls.from_source(text).memory), list(memory))
+        text = disassemble([901, 308, 508, 710, 922, 0, 5, -1, 0, 1000],
+                           extensions=False, trim=False, addresses=False)
+        self.assertEqual(text.splitlines(), [
+            '   INP', '   STA L8', '   LDA L8', '   BRZ 10', '   DAT 922',
+            '   HLT', '   DAT 5', '   DAT -1', 'L8 HLT', '   DAT 1000'])
+
+    def test_image(self):
+        from LMC_interp.__main__ import main
+        memory = InterpB2.from_source(readfile('sort_5_nums.lmc')).memory
+        memory[0x8000] = 5 << 27 | 0xFFFF  # LDA of the last cell
+        with tempfile.TemporaryDirectory() as d:
+            InterpB2(memory).save_image(path := os.path.join(d, 'crash.img'))
+            with MockStdoutToString() as out:
+                self.assertEqual(main(['disasm', path]), 0)
+        self.assertIn('LDA 65535', out.string)  # (not in the trimmed output)
+        self.assertEqual(list(InterpB2.from_source(out.string).memory), list(memory))
+
+
+class TestRuntime(unittest.TestCase):
+    def _build(self):
+        try:
+            from LMC_compile.compile import compile_runtime
+            return compile_runtime()
+        except Exception as e:
+            self.skipTest(f"Can't build the runtime: {e}")
+
+    def test_io(self):
+        import subprocess
+        from LMC_interp.io_mgr import ListIOMgr
+        exe = self._build()
+        src = ('INP\nOUT\nINP\nOUT\nLDA e\nOTC\nLDA big\nOTC\nLDA n\nOUT\n'
+               'LDA nl\nOTC\nLDA n\nOUT\nHLT\n'
+               'e DAT 233\nbig DAT 128512\nn DAT -2147483648\nnl DAT 10')
+        inst = InterpB2.from_source(src)
+        inst.io = ListIOMgr(inst, [-7, 2147483647])
+        inst.run()
+        with tempfile.TemporaryDirectory() as d:
+            inst.reset()
+            inst.save_image(img := os.path.join(d, 'io.img'), whole_memory=False)
+            res = subprocess.run([exe, '-q', img], capture_output=True, check=True,
+                                 input=b'abc\n\n 12x\n99999999999\n  -7  \n+2147483647')
+        self.assertEqual(res.stdout.decode('utf-8'), 'Input must be an integer\n' * 2
+                         + 'Input out of range\n' + inst.io.output)
+
+    def test_batch(self):
+        import subprocess
+        exe = self._build()
+        with tempfile.TemporaryDirectory() as d:
+            sort_img, err_img = os.path.join(d, 'sort.img'), os.path.join(d, 'err.img')
+            InterpB2.from_source(readfile('sort_5_nums.lmc')).save_image(sort_img)
+            InterpB2.from_source('LDA 70000').save_image(err_img, whole_memory=False)
+            with open(inp := os.path.join(d, 'input.txt'), 'w') as f:
+                f.write('3\n-1\n2\n5\n4\n')
+            res = subprocess.run([exe, '-q', sort_img], input='9\n8\n7\n6\n5\n',
+                                 capture_output=True, text=True)
+            self.assertEqual((res.returncode, res.stdout), (0, '5\n6\n7\n8\n9\n'))
+            res = subprocess.run([exe, '--batch', sort_img, inp, err_img, inp, sort_img, inp],
+                                 capture_output=True, text=True)
+        self.assertEqual(res.returncode, 1)
+        self.assertEqual(res.stdout, '-1\n2\n3\n4\n5\n' * 2)
+        report = res.stderr.splitlines()
+        self.assertIn('77 instructions', report[0])  # same as InterpB2
+        self.assertIn('0 instructions', report[1])
+        self.assertIn('outside of memory', report[1])
+        self.assertIn('3 jobs (1 failed), 154 instructions', report[-1])
+
+
+class TestTranspile(unittest.TestCase):
+    def _run(self, src: str, inputs: list[int]) -> str:
+        import subprocess
+        from LMC_interp.parse_asm import AsmParser
+        try:
+            from LMC_compile.transpile import compile_program
+            exe = compile_program(AsmParser(src).parse(), 'test_transpile',
+                                  prompt=False)
+        except Exception as e:
+            raise unittest.SkipTest(f"Can't compile the program: {e}")
+        return subprocess.run([exe], input=''.join(f'{i}\n' for i in inputs),
+                              capture_output=True, text=True, check=True).stdout
+
+    def test_sort_5_nums(self):
+        src = readfile('sort_5_nums.lmc')
+        inputs = [89, -15, 73, -56, 0]
+        self.assertEqual(self._run(src, inputs), '-56\n-15\n0\n73\n89\n')
+
+    def test_self_modifying(self):
+        # The HLT is replaced with an OUT so this must fall back to the interpreter
+        src = 'LDA new\nSTA slot\nslot HLT\nHLT\nnew OUT'
+        self.assertEqual(self._run(src, []), f'{9 << 27 | 2}\n')
+        with MockStdoutToString() as out:
+            InterpB2.from_source(src).run()
+        self.assertEqual(out.string, f'{9 << 27 | 2}\n')
+
+
+class TestCLI(unittest.TestCase):
+    def test_run(self):
+        from LMC_interp.__main__ import main
+        with MockStdoutToString() as out:
+            self.assertEqual(main(['run', 'sort_5_nums.lmc', '3', '1', '2', '5', '4']), 0)
+        self.assertEqual(out.string, '1\n2\n3\n4\n5\n')
+        with MockStdinFromString('9 -8\n7 6\n0'), MockStdoutToString() as out:
+            self.assertEqual(main(['run', 'sort_5_nums.lmc', '-m', 'b2',
+                                   '-e', 'closure']), 0)
+        self.assertEqual(out.string, '-8\n0\n6\n7\n9\n')
+        with MockStdoutToString() as out:
+            self.assertEqual(main(['run', 'sort_5_nums.lmc', '1', '2']), 1)
+        self.assertEqual(main(['run', 'no_such_file.lmc', '1']), 1)
+        self.assertEqual(main(['disasm', 'no_such_file.bin']), 1)
+        self.assertEqual(main(['run', 'sort_5_nums.lmc', '1', '-m', 'b2',
+                               '--no-wrap-values']), 2)
+
+    def test_lazy_imports(self):
+        import subprocess
+        code = ('import sys; from LMC_interp.__main__ import main; '
+                'main(["run", "sort_5_nums.lmc", "1", "2", "3", "4", "5"]); '
+                'print(sorted({"LMC_interp.parse_asm", "dataclasses", "json"}'
+                ' & sys.modules.keys()))')
+        for _ in range(2):  # the 1st one parses it (and caches it)
+            res = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                 text=True, check=True)
+        self.assertEqual(res.stdout.splitlines()[-1], '[]')
+
+
+class TestScheduler(unittest.TestCase):
+    def test_round_robin(self):
+        from LMC_interp.errors import InstrLimitExceededError
+        from LMC_interp.io_mgr import ListIOMgr
+        from LMC_interp.scheduler import (
+            RoundRobinScheduler, TASK_HALTED, TASK_FAILED, TASK_WAITING)
+        sched = RoundRobinScheduler(quantum=50)
+        infinite = sched.add(InterpreterB10.from_source('BRA 0'), budget=10_000)
+        tasks = []
+        for cls in (InterpreterB10, InterpB2):
+            inst = cls.from_source(readfile('sort_5_nums.lmc'))
+            inst.io = ListIOMgr(inst, [3, 1, 2], wait_for_input=True)
+            tasks.append(sched.add(inst))
+        sched.run()
+        self.assertEqual([t.state for t in tasks], [TASK_WAITING] * 2)
+        self.assertEqual(infinite.state, TASK_FAILED)
+        self.assertIsInstance(infinite.error, InstrLimitExceededError)
+        self.assertEqual(infinite.interp.n_instr, 10_000)
+        for t in tasks:
+            sched.feed(t, [5, 4])
+        sched.run()
+        for t in tasks:
+            self.assertEqual(t.state, TASK_HALTED)
+            self.assertEqual(t.interp.io.output, '1\n2\n3\n4\n5\n')
+
+    def test_resume_keeps_compiled_code(self):
+        from LMC_interp.io_mgr import ListIOMgr
+        source = ('loop LDA n\nOUT\nSUB one\nSTA n\nBRP loop\nHLT\n'
+                  'n DAT 9\none DAT 1\ntwo DAT 4')
+        for cls in (InterpreterB10, InterpB2):
+            sub_two = cls.from_source('SUB 8').memory[0]
+            for engine in ('closure', 'block'):
+                inst = cls.from_source(source, engine=engine)
+                inst.io = ListIOMgr(inst, [])
+                inst.run(max_steps=12)
+                state = inst._engine_state
+                inst.run(max_steps=5)
+                self.assertIs(inst._engine_state, state)
+                inst.memory[2] = sub_two  # code changed between runs
+                inst.run()
+                self.assertEqual(inst.io.output, '9\n8\n7\n6\n2\n')
+        # run_batch uses a new IOMgr for each run
+        from LMC_interp.batch import run_batch_on
+        inst = InterpB2.from_source(readfile('sort_5_nums.lmc'), engine='closure')
+        run_batch_on(inst, [[3, 1, 2, 5, 4]])
+        state = inst._engine_state
+        results = run_batch_on(inst, [[5, 4, 3, 2, 1], [7, 7, 7, 7, 7]])
+        self.assertIs(inst._engine_state, state)
+        self.assertEqual([r.output for r in results],
+                         ['1\n2\n3\n4\n5\n', '7\n7\n7\n7\n7\n'])
+
+
 if __name__ == '__main__':
     unittest.main()